@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Cuts through the bounding box of a mask, with numpy and nibabel only"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os.path as op
+
+import numpy as np
+from nibabel.arrayproxy import is_proxy
+
+
+# axis projections of the masks seen so far, by file, modification time
+# and threshold, so that figures sharing a mask do not recount it. The
+# cache lives in one process: the report draws the panels sharing
+# images in one task (report.SHARED_IMAGES) so that they hit it
+_PROJECTIONS = {}
+
+
+def mask_projections(mask_nii, threshold=0.0):
+    """Counts of the voxels above threshold on each (i, j, k) axis
+
+    The mask is made from the stored data as a uint8 view, without a
+    thresholded copy of the image; it is reduced once to the (i, j)
+    plane, which gives the i and j counts, and once to the k axis.
+    """
+    filename = mask_nii.get_filename()
+    key = None
+    if filename and op.isfile(filename):
+        key = (op.abspath(filename), op.getmtime(filename), threshold)
+        if key in _PROJECTIONS:
+            return _PROJECTIONS[key]
+
+    if is_proxy(mask_nii.dataobj) and mask_nii.in_memory:
+        data = mask_nii.get_fdata()  # already decoded
+    else:
+        data = np.asanyarray(mask_nii.dataobj)
+    mask = (data > threshold).view(np.uint8)
+    ij_counts = mask.sum(axis=2, dtype=np.int64)
+    projections = (ij_counts.sum(axis=1), ij_counts.sum(axis=0),
+                   mask.sum(axis=(0, 1), dtype=np.int64))
+    if key is not None:
+        _PROJECTIONS[key] = projections
+    return projections
+
+
+def cuts_from_bbox(mask_nii, cuts=3, threshold=0.0):
+    """Finds equi-spaced cuts for presenting images
+
+    The mask is the voxels of mask_nii above threshold, so an image
+    can be passed directly instead of a thresholded copy of it.
+    """
+    from nibabel.affines import apply_affine
+
+    # First, project the number of masked voxels on each axes
+    # (sagittal planes to i, coronal planes to j, axial planes to k)
+    ijk_counts = mask_projections(mask_nii, threshold)
+    shape = mask_nii.shape[:3]
+
+    # If all voxels are masked in a slice (say that happens at k=10),
+    # then the value for ijk_counts for the projection to k (ie. ijk_counts[2])
+    # at that element of the orthogonal axes (ijk_counts[2][10]) is
+    # the total number of voxels in that slice (ie. Ni x Nj).
+    # Here we define some thresholds to consider the plane as "masked"
+    # The thresholds vary because of the shape of the brain
+    # I have manually found that for the axial view requiring 30%
+    # of the slice elements to be masked drops almost empty boxes
+    # in the mosaic of axial planes (and also addresses #281)
+    ijk_th = [
+        int((shape[1] * shape[2]) * 0.2),   # sagittal
+        int((shape[0] * shape[2]) * 0.0),   # coronal
+        int((shape[0] * shape[1]) * 0.3),   # axial
+    ]
+
+    vox_coords = []
+    for ax, (c, th) in enumerate(zip(ijk_counts, ijk_th)):
+        B = np.argwhere(c > th)
+        if B.size:
+            smin, smax = B.min(), B.max()
+
+        # Avoid too narrow selections of cuts (very small masks)
+        if not B.size or (th > 0 and (smin + cuts + 1) >= smax):
+            B = np.argwhere(c > 0)
+
+        # Resort to full plane if mask is seemingly empty
+        smin, smax = (B.min(), B.max()) if B.size else (0, shape[ax])
+        inc = (smax - smin) / (cuts + 1)
+        vox_coords.append([smin + (i + 1) * inc for i in range(cuts)])
+
+    ras_coords = apply_affine(mask_nii.affine, np.array(vox_coords).T)
+    return {k: v for k, v in zip(['x', 'y', 'z'], ras_coords.T.tolist())}
@@ -1,10 +1,16 @@
 
-from nipype.pipeline import engine as pe
-from nipype.interfaces import afni, ants,fsl,utility as niu
-from nipype.interfaces.fsl import Split
-from nipype.interfaces.fsl.preprocess import FUGUE,PRELUDE
+# nipype is imported by the functions that run the external tools, so
+# that the numpy helpers can be used and tested without it
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
 import nibabel as nb 
 import numpy as np 
+# the nifti writer shared with the python utilities
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from imgio import evict_cache, save_nifti
 
 def meanimage(in_file,out_file):
     'find mean of the 4D data'
@@ -17,7 +23,7 @@ def meanimage(in_file,out_file):
         data_mean=data
     
     out_img = nb.Nifti1Image(data_mean,im.affine,im.header)
-    out_img.to_filename(out_file)
+    save_nifti(out_img, out_file)
     return out_img
 
 def maskdata(in_file,out_file):
@@ -27,11 +33,14 @@ def maskdata(in_file,out_file):
     data=np.abs(data)
     data[data>0]=1
     out_img = nb.Nifti1Image(data,im.affine,im.header)
-    out_img.to_filename(out_file)
+    save_nifti(out_img, out_file)
     return out_img
 
-def n4_correction(in_file):
+def n4_correction(in_file,num_threads=None):
+    from nipype.interfaces import ants
     n4 = ants.N4BiasFieldCorrection()
+    if num_threads:
+        n4.inputs.num_threads=num_threads
     n4.inputs.dimension=3
     n4.inputs.input_image = in_file
     n4.inputs.bspline_fitting_distance = 300
@@ -42,13 +51,33 @@ def n4_correction(in_file):
     return n4.inputs.output_image
 
 def fslbet(in_file,out_file):
+    from nipype.interfaces import fsl
     bet=fsl.BET()
     bet.run(in_file=in_file,out_file=out_file,frac=0.5)
     return out_file
 
+def afniskullstrip(in_file,out_file,num_threads=None):
+    from nipype.interfaces import afni
+    skullstrip=afni.SkullStrip()
+    if num_threads:
+        skullstrip.inputs.num_threads=num_threads
+    skullstrip.inputs.in_file=in_file
+    skullstrip.inputs.out_file=out_file
+    skullstrip.run()
+    return out_file
+
 
-def antsregistration(fixed,moving,output_warped,transform_prefix):
+def antsregistration(fixed,moving,output_warped,transform_prefix,num_threads=None,
+                     cache_dir=None,cache_size=4*1024**3):
+    """
+    SyN registration of moving to fixed. With cache_dir, the transforms
+    and warped image are reused from an earlier run with the same voxel
+    data and parameters, see registration_cache_key.
+    """
+    from nipype.interfaces import ants
     reg = ants.Registration()
+    if num_threads:
+        reg.inputs.num_threads=num_threads
     reg.inputs.fixed_image =fixed
     reg.inputs.moving_image = moving
     reg.inputs.output_transform_prefix =transform_prefix
@@ -69,11 +98,80 @@ def antsregistration(fixed,moving,output_warped,transform_prefix):
     reg.inputs.use_estimate_learning_rate_once = [True, True]
     reg.inputs.use_histogram_matching = [True, True] # This is the default
     reg.inputs.output_warped_image =output_warped
-    reg.run()
     transfromfile=[transform_prefix+'Composite.h5',transform_prefix +'InverseComposite.h5']
+    outputs=transfromfile+[output_warped]
+    if cache_dir:
+        key=registration_cache_key(reg.inputs)
+        if restore_registration(cache_dir,key,outputs):
+            return reg.inputs.output_warped_image,transfromfile
+    reg.run()
+    if cache_dir:
+        store_registration(cache_dir,key,outputs,cache_size)
     return reg.inputs.output_warped_image,transfromfile
 
+# inputs of ants.Registration that name files or only affect speed
+_REG_UNHASHED = ('fixed_image', 'moving_image', 'output_transform_prefix',
+                 'output_warped_image', 'num_threads', 'environ')
+_REG_ENTRY = ('Composite.h5', 'InverseComposite.h5', 'Warped')
+
+def _image_digest(in_file, digest):
+    """Feed the voxel data, shape, type and affine of an image to digest."""
+    img = nb.load(in_file)
+    digest.update(repr((img.shape, str(img.get_data_dtype()))).encode())
+    digest.update(np.asarray(img.affine, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(np.asanyarray(img.dataobj)).tobytes())
+
+def registration_cache_key(inputs):
+    """
+    Content address of a registration: the voxel data of the fixed and
+    moving images and every parameter that changes the result.
+    """
+    digest = hashlib.sha1()
+    _image_digest(inputs.fixed_image, digest)
+    _image_digest(inputs.moving_image, digest)
+    params = dict((name, value) for name, value in inputs.get_traitsfree().items()
+                  if name not in _REG_UNHASHED)
+    digest.update(repr(sorted(params.items())).encode())
+    # the warped image is stored as written, .nii or .nii.gz
+    digest.update(b'gz' if inputs.output_warped_image.endswith('.gz') else b'nii')
+    return digest.hexdigest()
+
+def restore_registration(cache_dir, key, outputs):
+    """
+    Copy a cached registration to outputs (composite, inverse composite,
+    warped image); False if it is not cached. A hit refreshes the entry's
+    modification time, which is what evict_cache orders on.
+    """
+    entry = os.path.join(cache_dir, key)
+    try:
+        for name, out_file in zip(_REG_ENTRY, outputs):
+            shutil.copyfile(os.path.join(entry, name), out_file)
+        os.utime(entry, None)
+    except (IOError, OSError):
+        return False
+    return True
+
+def store_registration(cache_dir, key, outputs, cache_size=4*1024**3):
+    """
+    Add the outputs of a registration to the cache under key, then evict
+    down to cache_size bytes. The entry is built aside and renamed into
+    place, so concurrent runs never see a partial entry.
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    scratch = tempfile.mkdtemp(prefix='.' + key, dir=cache_dir)
+    try:
+        for name, out_file in zip(_REG_ENTRY, outputs):
+            shutil.copyfile(out_file, os.path.join(scratch, name))
+        os.chmod(scratch, 0o755)
+        os.rename(scratch, os.path.join(cache_dir, key))
+    except OSError:
+        # already stored by a concurrent run
+        shutil.rmtree(scratch, ignore_errors=True)
+    evict_cache(cache_dir, cache_size)
+
 def applytransform(in_file,reference,out_file,transformfile,interpolation='Linear'):
+    from nipype.interfaces import ants
     at=ants.ApplyTransforms()
     at.inputs.dimension = 3
     at.inputs.input_image = in_file
@@ -84,8 +182,11 @@ def applytransform(in_file,reference,out_file,transformfile,interpolation='Linea
     at.run()
     return at.inputs.output_image
 
-def afni3dQwarp(oppose_pe,matched_pe,source_warp):
+def afni3dQwarp(oppose_pe,matched_pe,source_warp,num_threads=None):
+    from nipype.interfaces import afni
     qwarp = afni.QwarpPlusMinus()
+    if num_threads:
+        qwarp.inputs.num_threads=num_threads
     qwarp.inputs.in_file =oppose_pe
     qwarp.inputs.nopadWARP = True
     qwarp.inputs.noweight=True
@@ -99,16 +200,101 @@ def afni3dQwarp(oppose_pe,matched_pe,source_warp):
     qwarp.run()  
     return source_warp+'_PLUS_WARP.nii.gz'
     
-def au2rads(in_file, newpath=None):
-    """Convert the input phase difference map in arbitrary units (a.u.) to rads."""
-    from scipy.stats import mode
-    from nipype.utils.filemanip import fname_presuffix
-    im = nb.load(in_file)
-    data = im.get_fdata(dtype='float32')
-    hdr = im.header.copy()
+def _load(in_file):
+    """Return ``in_file`` as a nibabel image, loading it if it is a path."""
+    if isinstance(in_file, str):
+        return nb.load(in_file)
+    return in_file
+
+
+def _fdata(img, dtype='float32'):
+    """A fresh floating point copy of the data of ``img``."""
+    return np.array(img.dataobj, dtype=dtype)
+
+
+def handoff(img, out_base, scratch=True):
+    """
+    Write ``img`` to ``out_base`` for an external tool and return the file
+    name: an uncompressed ``.nii`` scratch intermediate, or with
+    ``scratch=False`` a ``.nii.gz`` compressed as XCP_COMPRESSION says.
+    """
+    return save_nifti(_load(img), out_base + '.nii.gz', scratch=scratch)
+
+
+def mode_estimate(data, bin_width=None, nbins=1024, mask=None, max_bins=2**24):
+    """
+    Mode of data from a histogram filled by one bincount.
+
+    The finite values of data in mask (all of them by default) are
+    binned once, and the bin index of each value is kept: the fullest
+    bin (the lowest one on ties) is searched again for its most frequent
+    exact value, so that a value many voxels share (e.g. a zero
+    background) is returned as such; the centre of the bin is returned
+    when no value in it repeats. Integer valued data in one-wide bins
+    give the exact mode, equal to ``scipy.stats.mode``.
+
+    Parameters
+    ----------
+    bin_width : float, optional
+        Width of the bins; by default 1 for integer valued data, else the
+        range of the data over ``nbins``.
+    mask : boolean array, optional
+        The voxels of data to take the mode of.
+
+    Returns the estimate and the bin width used.
+    """
+    values = np.asarray(data)
+    values = values[mask] if mask is not None else values.reshape(-1)
+    if values.dtype.kind == 'f':
+        finite = np.isfinite(values)
+        if not finite.all():
+            values = values[finite]
+    if not values.size:
+        return np.nan, bin_width
+    lo, hi = float(values.min()), float(values.max())
+    integral = values.dtype.kind in 'iub'
+    if integral:
+        offset = values.astype(np.intp) - int(lo)
+    else:
+        offset = values - values.dtype.type(lo)
+    index = None
+    if bin_width is None:
+        head = offset[:1024]
+        if not integral and np.array_equal(head, np.rint(head)):
+            # the one-wide bins, if the values turn out to be integers
+            index = offset.astype(np.intp)
+            integral = np.array_equal(index, offset)
+        bin_width = 1.0 if integral else ((hi - lo) / nbins or 1.0)
+    nbin = int((hi - lo) / bin_width) + 1
+    if nbin > max_bins:
+        raise ValueError('bin width %g gives %d bins over %g..%g, use a wider bin'
+                         % (bin_width, nbin, lo, hi))
+    if integral and bin_width == 1:
+        index = offset if index is None else index
+    else:
+        index = (offset * (1. / bin_width)).astype(np.intp)
+        np.minimum(index, nbin - 1, out=index)
+    best = np.argmax(np.bincount(index, minlength=nbin))
+    if integral and bin_width == 1:
+        return lo + best, bin_width
+    exact, counts = np.unique(values[index == best], return_counts=True)
+    if exact.size == 1 or counts.max() > 1:
+        return float(exact[np.argmax(counts)]), bin_width
+    return lo + (best + 0.5) * bin_width, bin_width
+
+
+def au2rads_img(img, bin_width=None):
+    """
+    Convert a phase difference image in arbitrary units (a.u.) to rads.
+    The data are first centred on their mode, see mode_estimate.
+    """
+    img = _load(img)
+    data = _fdata(img)
+    hdr = img.header.copy()
 
     # First center data around 0.0.
-    data -= mode(data, axis=None)[0][0]
+    center, bin_width = mode_estimate(data, bin_width=bin_width)
+    data -= data.dtype.type(center)
 
     # Scale lower tail
     data[data < 0] = - np.pi * data[data < 0] / data[data < 0].min()
@@ -124,13 +310,19 @@ def au2rads(in_file, newpath=None):
 
     hdr.set_data_dtype(np.float32)
     hdr.set_xyzt_units('mm')
+    return nb.Nifti1Image(data, img.affine, hdr)
+
+
+def au2rads(in_file, newpath=None, bin_width=None):
+    """Convert the input phase difference map in arbitrary units (a.u.) to rads."""
+    from nipype.utils.filemanip import fname_presuffix
     out_file = fname_presuffix(in_file, suffix='_rads', newpath=newpath)
-    nb.Nifti1Image(data, im.affine, hdr).to_filename(out_file)
+    save_nifti(au2rads_img(in_file, bin_width=bin_width), out_file)
     return out_file
 
-def phdiff2fmap(in_file, delta_te, newpath=None):
+def phdiff2fmap_img(img, delta_te):
     r"""
-    Convert the input phase-difference map into a fieldmap in Hz.
+    Convert a phase-difference image into a fieldmap in Hz.
     Uses eq. (1) of [Hutton2002]_:
     .. math::
         \Delta B_0 (\text{T}^{-1}) = \frac{\Delta \Theta}{2\pi\gamma \Delta\text{TE}}
@@ -145,39 +337,46 @@ def phdiff2fmap(in_file, delta_te, newpath=None):
       <https://doi.org/10.1006/nimg.2001.1054>`_.
     """
     import math
-    import numpy as np
-    import nibabel as nb
-    from nipype.utils.filemanip import fname_presuffix
     #  GYROMAG_RATIO_H_PROTON_MHZ = 42.576
 
-    out_file = fname_presuffix(in_file, suffix='_fmap', newpath=newpath)
-    image = nb.load(in_file)
-    data = (image.get_fdata(dtype='float32') / (2. * math.pi * delta_te))
-    nii = nb.Nifti1Image(data, image.affine, image.header)
+    img = _load(img)
+    data = (_fdata(img) / (2. * math.pi * delta_te))
+    nii = nb.Nifti1Image(data, img.affine, img.header)
     nii.set_data_dtype(np.float32)
-    nii.to_filename(out_file)
+    return nii
+
+def phdiff2fmap(in_file, delta_te, newpath=None):
+    """Convert the input phase-difference map into a fieldmap in Hz, see phdiff2fmap_img."""
+    from nipype.utils.filemanip import fname_presuffix
+
+    out_file = fname_presuffix(in_file, suffix='_fmap', newpath=newpath)
+    save_nifti(phdiff2fmap_img(in_file, delta_te), out_file)
     return out_file
 
-def _torads(in_file, out_file,fmap_range=None):
+def torads_img(img, fmap_range=None):
         """
-        Convert a field map to rad/s units.
+        Convert a field map image to rad/s units.
         If fmap_range is None, the range of the fieldmap
         will be automatically calculated.
         Use fmap_range=0.5 to convert from Hz to rad/s
         """
         from math import pi
-        import nibabel as nb
-        #from nipype.utils.filemanip import fname_presuffix
 
-        fmapnii = nb.load(in_file)
-        fmapdata = fmapnii.get_fdata(dtype='float32')
+        fmapnii = _load(img)
+        fmapdata = _fdata(fmapnii)
 
         if fmap_range is None:
             fmap_range = max(abs(fmapdata.min()), fmapdata.max())
         fmapdata = fmapdata * (pi / fmap_range)
         out_img = nb.Nifti1Image(fmapdata, fmapnii.affine, fmapnii.header)
         out_img.set_data_dtype('float32')
-        out_img.to_filename(out_file)
+        return out_img
+
+def _torads(in_file, out_file,fmap_range=None):
+        """
+        Convert a field map to rad/s units, see torads_img.
+        """
+        save_nifti(torads_img(in_file, fmap_range=fmap_range), out_file)
         return out_file
 
 
@@ -193,37 +392,60 @@ def _tohz(in_file, range_hz, newpath=None):
     fmapdata = fmapdata * (range_hz / pi)
     out_img = nb.Nifti1Image(fmapdata, fmapnii.affine, fmapnii.header)
     out_img.set_data_dtype('float32')
-    out_img.to_filename(out_file)
+    save_nifti(out_img, out_file)
     return out_file
 
-def _despike2d(data, thres, neigh=None):
-    """Despike axial slices, as done in FSL's ``epiunwarp``."""
+def _despike2d(data, thres, neigh=None, maxiter=100):
+    """Despike axial slices, as done in FSL's ``epiunwarp``.
+
+    A voxel is a spike when it is further than thres times the range of
+    its in-plane neighbourhood from the median of it; spikes are set to
+    that median. All voxels are tested at once, and the tests are
+    repeated on the despiked data until no voxel changes, so that the
+    neighbours of a despiked voxel see its new value. Windows crossing
+    the edge of a slice repeat the edge voxels, and the median of an
+    even window is the upper of its two middle values.
+    """
     if neigh is None:
         neigh = [-1, 0, 1]
-    nslices = data.shape[-1]
-
-    for k in range(nslices):
-        data2d = data[..., k]
-
-        for i in range(data2d.shape[0]):
-            for j in range(data2d.shape[1]):
-                vals = []
-                thisval = data2d[i, j]
-                for ii in neigh:
-                    for jj in neigh:
-                        try:
-                            vals.append(data2d[i + ii, j + jj])
-                        except IndexError:
-                            pass
-                vals = np.array(vals)
-                patch_range = vals.max() - vals.min()
-                patch_med = np.median(vals)
-
-                if (patch_range > 1e-6 and
-                        (abs(thisval - patch_med) / patch_range) > thres):
-                    data[i, j, k] = patch_med
+    work = data if data.dtype.kind == 'f' else data.astype(np.float64)
+    for _ in range(maxiter):
+        med, prange = _despike_windows(work, neigh)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            spikes = (prange > 1e-6) & (np.abs(work - med) / prange > thres)
+        spikes &= data != med.astype(data.dtype)
+        if not spikes.any():
+            break
+        data[spikes] = med[spikes]
+        if work is not data:
+            work[spikes] = data[spikes]
     return data
 
+
+def despike_img(img, thres):
+    """Despike the axial slices of a map in memory, see _despike2d."""
+    nii = _load(img)
+    data = _despike2d(_fdata(nii), thres)
+    return nb.Nifti1Image(data, nii.affine, nii.header)
+
+
+def _despike_windows(data, neigh):
+    """Median and range of the in-plane neighbourhood of every voxel."""
+    from scipy import ndimage
+    size = max(neigh) - min(neigh) + 1
+    footprint = np.zeros((size, size, 1), dtype=bool)
+    offsets = np.array(neigh) - min(neigh)
+    footprint[np.ix_(offsets, offsets, [0])] = True
+    # puts the offset 0 of neigh on the voxel
+    origin = (-min(neigh) - size // 2,) * 2 + (0,)
+    kwargs = dict(footprint=footprint, origin=origin, mode='nearest')
+    # the upper of the two middle values of an even window, so that the
+    # despiked values are data values and the tests settle
+    med = ndimage.median_filter(data, **kwargs)
+    prange = ndimage.maximum_filter(data, **kwargs) - ndimage.minimum_filter(data, **kwargs)
+    return med, prange
+
+
 def _unwrap(fmap_data, mag_file, mask=None):
         from math import pi
         from nipype.interfaces.fsl import PRELUDE
@@ -235,15 +457,15 @@ def _unwrap(fmap_data, mag_file, mask=None):
         fmapmax = max(abs(fmap_data[mask > 0].min()), fmap_data[mask > 0].max())
         fmap_data *= pi / fmapmax
 
-        nb.Nifti1Image(fmap_data, magnii.affine).to_filename('fmap_rad.nii.gz')
-        nb.Nifti1Image(mask, magnii.affine).to_filename('fmap_mask.nii.gz')
-        nb.Nifti1Image(magnii.get_fdata(dtype='float32'),
-                   magnii.affine).to_filename('fmap_mag.nii.gz')
+        phase_file = handoff(nb.Nifti1Image(fmap_data, magnii.affine), 'fmap_rad')
+        mask_file = handoff(nb.Nifti1Image(mask, magnii.affine), 'fmap_mask')
+        magnitude_file = handoff(nb.Nifti1Image(magnii.get_fdata(dtype='float32'),
+                                                magnii.affine), 'fmap_mag')
 
         # Run prelude
-        res = PRELUDE(phase_file='fmap_rad.nii.gz',
-                  magnitude_file='fmap_mag.nii.gz',
-                  mask_file='fmap_mask.nii.gz').run()
+        res = PRELUDE(phase_file=phase_file,
+                  magnitude_file=magnitude_file,
+                  mask_file=mask_file).run()
 
         unwrapped = nb.load(
            res.outputs.unwrapped_phase_file).get_fdata(dtype='float32') * (fmapmax / pi)
@@ -258,23 +480,27 @@ def _fix_hdr(in_file, newpath=None):
     hdr.set_data_dtype('<f4')
     hdr.set_intent('vector', (), '')
     out_file = fname_presuffix(in_file, "_warpfield", newpath=newpath)
-    nb.Nifti1Image(nii.get_fdata(dtype='float32'), nii.affine, hdr).to_filename(
+    save_nifti(nb.Nifti1Image(nii.get_fdata(dtype='float32'), nii.affine, hdr),
         out_file)
     return out_file
 
 
-def vsm2dm(in_file,phaseEncDim,phaseEncSign,fieldmapout,field_sdcwarp):
+def vsm2dm_img(img,phaseEncDim,phaseEncSign):
+    """
+    Convert a voxel shift map image to a displacement field in mm.
+    Returns the fieldmap and the vector field images.
+    """
 
     #phaseEncDim = {'i': 0, 'j': 1, 'k': 2}[self.inputs.pe_dir[0]]
     #phaseEncSign = [1.0, -1.0][len(self.inputs.pe_dir) != 2]
 
         # Create new header
-    nii = nb.load(in_file)
+    nii = _load(img)
     hdr = nii.header.copy()
         #hdr.set_data_dtype(self._dtype)
 
         # Get data, convert to mm
-    data = nii.get_fdata()
+    data = _fdata(nii, dtype='float64')
     aff = np.diag([1.0, 1.0, -1.0])
     if np.linalg.det(aff) < 0 and phaseEncDim != 0:
        # Reverse direction since ITK is LPS
@@ -282,7 +508,7 @@ def vsm2dm(in_file,phaseEncDim,phaseEncSign,fieldmapout,field_sdcwarp):
 
     aff = aff.dot(nii.affine[:3, :3])
     data *= phaseEncSign * nii.header.get_zooms()[phaseEncDim]
-    nb.Nifti1Image(data, nii.affine, hdr).to_filename(fieldmapout)
+    fieldmap = nb.Nifti1Image(data, nii.affine, hdr)
 
         # Compose a vector field
     zeros = np.zeros_like(data)
@@ -290,11 +516,16 @@ def vsm2dm(in_file,phaseEncDim,phaseEncSign,fieldmapout,field_sdcwarp):
     field.insert(phaseEncDim, data)
     field = np.stack(field, -1)
 
+    hdr = hdr.copy()
     hdr.set_intent('vector', (), '')
         
-    nb.Nifti1Image(field[:, :, :, np.newaxis, :], nii.affine, hdr).to_filename(
-            field_sdcwarp)
+    return fieldmap, nb.Nifti1Image(field[:, :, :, np.newaxis, :], nii.affine, hdr)
 
+def vsm2dm(in_file,phaseEncDim,phaseEncSign,fieldmapout,field_sdcwarp):
+    """Write the fieldmap and vector field of vsm2dm_img."""
+    fieldmap, field = vsm2dm_img(in_file, phaseEncDim, phaseEncSign)
+    save_nifti(fieldmap, fieldmapout)
+    save_nifti(field, field_sdcwarp)
     return field_sdcwarp
 
 def substractimage(in_file1,in_file2,out_file):
@@ -302,70 +533,80 @@ def substractimage(in_file1,in_file2,out_file):
     data1=file1.get_data()
     data2=nb.load(in_file2).get_data()
     datadiff=data1-data2
-    nb.Nifti1Image(datadiff,file1.affine,file1.header).to_filename(
+    save_nifti(nb.Nifti1Image(datadiff,file1.affine,file1.header),
         out_file)
     return out_file
 
-def substractphaseimage(in_file1,in_file2,out_file):
-    file1=nb.load(in_file1)
-    data1=file1.get_data()
-    data2=nb.load(in_file2).get_data()
+def substractphaseimage_img(img1,img2):
+    """Phase difference of two phase images in rads, wrapped to 0..2pi."""
+    file1=_load(img1)
+    data1=np.asanyarray(file1.dataobj)
+    data2=np.asanyarray(_load(img2).dataobj)
     datadiff=data1-data2
     datadiff[datadiff < 0] += 2 * np.pi
     datadiff = np.clip(datadiff, 0.0, 2 * np.pi)
-    nb.Nifti1Image(datadiff,file1.affine,file1.header).to_filename(
-        out_file)
+    return nb.Nifti1Image(datadiff,file1.affine,file1.header)
+
+def substractphaseimage(in_file1,in_file2,out_file):
+    save_nifti(substractphaseimage_img(in_file1,in_file2), out_file)
     return out_file
 
 
-def _recenter(in_file,newpath):
+def recenter_img(img):
     """Recenter the phase-map distribution to the -pi..pi range."""
-    from os import getcwd
-    import numpy as np
-    import nibabel as nb
-    from nipype.utils.filemanip import fname_presuffix
-
-    nii = nb.load(in_file)
-    data = nii.get_fdata(dtype='float32')
+    nii = _load(img)
+    data = _fdata(nii)
     msk = data != 0
     msk[data == 0] = False
     data[msk] -= np.median(data[msk])
+    return nb.Nifti1Image(data, nii.affine, nii.header)
+
+
+def _recenter(in_file,newpath):
+    """Recenter the phase-map distribution to the -pi..pi range."""
+    from nipype.utils.filemanip import fname_presuffix
 
     out_file = fname_presuffix(in_file, suffix='_recentered',
                                newpath=newpath)
-    nb.Nifti1Image(data, nii.affine, nii.header).to_filename(out_file)
+    save_nifti(recenter_img(in_file), out_file)
     return out_file
 
 
-def _demean(in_file,newpath,in_mask=None, usemode=True):
+def demean_img(img,in_mask=None, usemode=True, bin_width=None):
     """
     Subtract the median (since it is robuster than the mean) from a map.
     Parameters
     ----------
+    in_mask : image or file, optional
+        Only voxels of the mask above 1e-4 are demeaned.
     usemode : bool
         Use the mode instead of the median (should be even more robust
         against outliers).
+    bin_width : float, optional
+        Histogram bin width of the mode, see mode_estimate.
     """
-    from os import getcwd
-
-    import numpy as np
-    import nibabel as nb
-    from nipype.utils.filemanip import fname_presuffix
-
-    nii = nb.load(in_file)
-    data = nii.get_fdata(dtype='float32')
+    nii = _load(img)
+    data = _fdata(nii)
 
     msk = np.ones_like(data, dtype=bool)
     if in_mask is not None:
-        msk[nb.load(in_mask).get_fdata(dtype='float32') < 1e-4] = False
+        msk[_fdata(_load(in_mask)) < 1e-4] = False
 
     if usemode:
-        from scipy.stats import mode
-        data[msk] -= mode(data[msk], axis=None)[0][0]
+        center, bin_width = mode_estimate(data, bin_width=bin_width, mask=msk)
+        data[msk] -= data.dtype.type(center)
     else:
         data[msk] -= np.median(data[msk], axis=None)
 
+    return nb.Nifti1Image(data, nii.affine, nii.header)
+
+
+def _demean(in_file,newpath,in_mask=None, usemode=True, bin_width=None):
+    """Subtract the mode or median from a map, see demean_img."""
+    from nipype.utils.filemanip import fname_presuffix
+
     out_file = fname_presuffix(in_file, suffix='_demean',
                                newpath=newpath)
-    nb.Nifti1Image(data, nii.affine, nii.header).to_filename(out_file)
+    save_nifti(demean_img(in_file, in_mask=in_mask, usemode=usemode,
+                          bin_width=bin_width), out_file)
     return out_file
\ No newline at end of file
@@ -3,12 +3,15 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
-from fmapprocessing import phdiff2fmap,au2rads, maskdata,n4_correction, fslbet,_demean,vsm2dm,antsregistration
-from fmapprocessing import _despike2d,_torads, _unwrap, substractimage,substractphaseimage,_recenter,applytransform
+from fmapprocessing import n4_correction, fslbet, maskdata, antsregistration, applytransform, handoff, save_nifti
+from fmapprocessing import (au2rads_img, substractphaseimage_img, recenter_img, demean_img,
+                            despike_img, phdiff2fmap_img, torads_img, vsm2dm_img)
 from nipype.interfaces import fsl
-import os,sys,glob,json
+import glob,json
 import numpy as np
 from argparse import (ArgumentParser, RawTextHelpFormatter)
+# on the path once fmapprocessing is imported
+from imgio import parse_bytes
 
 def get_parser():
     parser = ArgumentParser(
@@ -23,25 +26,48 @@ def get_parser():
     parser.add_argument(
         '-o', '--out', action='store', required=True,
         help='outdir')
+    parser.add_argument(
+        '-c', '--cachedir', action='store', default=None,
+        help='directory of cached ANTs registrations, reused when the\n'
+             'images and parameters are unchanged [default: no cache]')
+    parser.add_argument(
+        '-z', '--cachesize', action='store', default='4G',
+        help='size bound of the registration cache, e.g. 512M or 4G\n'
+             '[default: 4G]')
+    parser.add_argument(
+        '-d', '--despike', action='store', type=float, default=None,
+        help='despike the unwrapped fieldmap before the median filter, as\n'
+             'FSL epiunwarp: voxels further from the median of their\n'
+             'in-plane neighbourhood than this fraction of its range\n'
+             '(e.g. 0.7) are replaced by the median [default: off]')
+    parser.add_argument(
+        '-u', '--uncompressed', action='store_true', default=False,
+        help='write the files handed to PRELUDE, fslmaths and ANTs as\n'
+             'uncompressed .nii scratch intermediates [default: .nii.gz,\n'
+             'compressed as XCP_COMPRESSION says]')
     return parser
 opts = get_parser().parse_args()
 fmapdir=opts.fmapdir
 outdir=opts.out
 ref=opts.reference
+# the maps are passed in memory between the numpy steps and only written
+# where PRELUDE, fslmaths or ANTs need a file; with -u those files are
+# uncompressed scratch intermediates. The final outputs are compressed as
+# XCP_COMPRESSION says
+scratch=opts.uncompressed
+ext='.nii' if scratch else '.nii.gz'
+output_type='NIFTI' if scratch else 'NIFTI_GZ'
 #check if phasediff or phase1 and phase2 
 phasedifc=glob.glob(fmapdir+'/*phasediff.nii.gz')
 phase1=glob.glob(fmapdir+'/*phase1.nii.gz')
 phase2=glob.glob(fmapdir+'/*phase2.nii.gz')
 
-if os.path.isfile(phasedifc[0]):
+if phasedifc:
     phaseon=phasedifc[0]
-    #au2rads(phaseon,outdir)
-    #phasediff=glob.glob(outdir+'/*rads.nii.gz')[0]
-elif os.path.isfile(phase1[0]):
+elif phase1:
     phase1=phase1[0]; phase2=phase2[0]
-    ph1=au2rads(phase1); ph2=au2rads(phase2)
-    phasediff=outdir+'/phasediff.nii.gz'
-    pha=substractphaseimage(ph1,ph2,phasediff)
+    pha=substractphaseimage_img(au2rads_img(phase1),au2rads_img(phase2))
+    phaseon=handoff(pha,outdir+'/phasediff',scratch=scratch)
  
 mag=glob.glob(fmapdir+'/*magnitude1.nii.gz')[0]
 import shutil
@@ -49,51 +75,56 @@ shutil.copy2(mag,outdir+'/mag.nii.gz')
 mag1=outdir+'/mag.nii.gz'
 mag_bias=n4_correction(in_file=mag1)
 mag_brain=outdir+'/mag1_brain.nii.gz'
-mag_mask=outdir+'/mag1_mask.nii.gz'
+mag_mask=outdir+'/mag1_mask'+ext
 mag_brain=fslbet(in_file=mag_bias,out_file=mag_brain)
 
 
-magbrain_warped=outdir+'/mag_warped.nii.gz'
-phase_warped=outdir+'/phase_warped.nii.gz'
+magbrain_warped=outdir+'/mag_warped'+ext
+phase_warped=outdir+'/phase_warped'+ext
 opposed_regis=antsregistration(fixed=ref,moving=mag_brain,output_warped=magbrain_warped,
-transform_prefix=outdir+'/trans_')
+transform_prefix=outdir+'/trans_',cache_dir=opts.cachedir,cache_size=parse_bytes(opts.cachesize))
 applytransform(in_file=phaseon,reference=ref,out_file=phase_warped,
          transformfile=outdir+'/trans_Composite.h5',interpolation='LanczosWindowedSinc')
 
-au2rads(phase_warped,outdir)
-phasediff=glob.glob(outdir+'/*rads.nii.gz')
+phasediff=handoff(au2rads_img(phase_warped),outdir+'/phase_warped_rads',scratch=scratch)
 maskdata(magbrain_warped,mag_mask)
 
 #unwarp withe predule 
-unwrapped=outdir+'/unwrapped.nii.gz'
+unwrapped=outdir+'/unwrapped'+ext
 prefsl=fsl.PRELUDE()
 prefsl.inputs.magnitude_file=magbrain_warped
-prefsl.inputs.phase_file=phasediff[0]
+prefsl.inputs.phase_file=phasediff
 prefsl.inputs.mask_file=mag_mask
 prefsl.inputs.unwrapped_phase_file=unwrapped
+prefsl.inputs.output_type=output_type
 prefsl.run()
 #denoise demean recenter the fieldmap and 
 #recentre
-recentered=_recenter(unwrapped,newpath=outdir+'/')
+recentered=recenter_img(unwrapped)
+if opts.despike is not None:
+    recentered=despike_img(recentered,opts.despike)
+recentered=handoff(recentered,outdir+'/unwrapped_recentered',scratch=scratch)
 # denoise with fsl spatial filter 
-denoised=outdir+'/unwrapped_denoise.nii.gz'
+denoised=outdir+'/unwrapped_denoise'+ext
 denoise=fsl.SpatialFilter()
 denoise.inputs.in_file=recentered
 denoise.inputs.kernel_shape='sphere'
 denoise.inputs.kernel_size=3
 denoise.inputs.operation='median'
 denoise.inputs.out_file=denoised
+denoise.inputs.output_type=output_type
 denoise.run()
 
-demeamed=_demean(in_file=denoised,newpath=outdir+'/')
+demeamed=demean_img(denoised)
 
 # get delta te 
-if os.path.isfile(phasedifc[0]):
+dpdat=None; dt1=None
+if phasedifc:
     with open(glob.glob(fmapdir+'/*phasediff.json')[0],'r')  as jsonfile:
         obj=jsonfile.read()
     dpdat=json.loads(obj)
     delta_te=np.abs(dpdat['EchoTime2']-dpdat['EchoTime1'])
-elif os.path.isfile(glob.glob(fmapdir+'/*phase1.nii.gz')[0]):
+elif glob.glob(fmapdir+'/*phase1.nii.gz'):
     with open(glob.glob(fmapdir+'/*phase1.json')[0],'r') as jsonfile1:
         obj1=jsonfile1.read()
     dt1=json.loads(obj1)
@@ -103,9 +134,9 @@ elif os.path.isfile(glob.glob(fmapdir+'/*phase1.nii.gz')[0]):
     delta_te=np.abs(dt2['EchoTime']-dt1['EchoTime'])
 
 
-outfile=phdiff2fmap(in_file=demeamed,delta_te=delta_te,newpath=outdir+'/')
+fmap=phdiff2fmap_img(demeamed,delta_te=delta_te)
 
-out_file=_torads(in_file=outfile,out_file=outdir+'/fieldmapto_rads.nii.gz')
+fmap_rads=torads_img(fmap)
 if dpdat: 
     phasedir=dpdat['PhaseEncodingDirection']
     if phasedir == 'j':
@@ -119,9 +150,10 @@ elif dt1:
     else:
         phaseEncDim=1; phaseEncSign=-1
 
-field_sdcwarp=vsm2dm(in_file=out_file,phaseEncDim=phaseEncDim,phaseEncSign=phaseEncSign,
-fieldmapout=outdir+'/fieldmap.nii.gz',field_sdcwarp=outdir+'/sdc_warp.nii.gz')
+fieldmap,field=vsm2dm_img(fmap_rads,phaseEncDim=phaseEncDim,phaseEncSign=phaseEncSign)
+save_nifti(fieldmap,outdir+'/fieldmap.nii.gz')
+save_nifti(field,outdir+'/sdc_warp.nii.gz')
 
-outfile=_demean(field_sdcwarp,newpath=outdir+'/')
+save_nifti(demean_img(field),outdir+'/sdc_warp_demean.nii.gz')
 #final required outpu is sdc_warp_demean.nii.gz 
-# convert to fieldmap
\ No newline at end of file
+# convert to fieldmap
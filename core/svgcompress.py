@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Compression of the rasters embedded in the report figures"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import base64
+import io
+import subprocess
+import time
+import xml.sax
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import cpu_count
+from shutil import which
+from xml.sax.saxutils import XMLGenerator
+
+# one entry per svg_compress call: the method, number of rasters, svg
+# size before and after and seconds taken, for the report to summarise
+COMPRESSION_LOG = []
+
+_PNG_URI = 'data:image/png;base64,'
+_PILLOW_WEBP = []
+
+
+def has_pillow_webp():
+    ''' whether Pillow is installed with a WebP encoder '''
+    if not _PILLOW_WEBP:
+        try:
+            from PIL import Image
+        except ImportError:
+            _PILLOW_WEBP.append(False)
+        else:
+            Image.init()
+            _PILLOW_WEBP.append('WEBP' in Image.SAVE)
+    return _PILLOW_WEBP[0]
+
+
+def _png_to_webp(png_b64):
+    ''' a base64 PNG as a base64 80% quality WebP without alpha, as cwebp -q 80 -noalpha '''
+    from PIL import Image
+    png = Image.open(io.BytesIO(base64.b64decode(png_b64)))
+    webp = io.BytesIO()
+    png.convert('RGB').save(webp, format='WEBP', quality=80)
+    return base64.b64encode(webp.getvalue()).decode('ascii')
+
+
+class _OrderedWriter(io.TextIOBase):
+    '''
+    writes text and the results of pending conversions to out in
+    document order, waiting for the oldest conversion once more than
+    inflight of them are pending
+    '''
+
+    def __init__(self, out, inflight):
+        self._out, self._inflight = out, inflight
+        self._queue, self._pending = deque(), 0
+
+    def write(self, text):
+        self._queue.append(text)
+        self._drain(self._inflight)
+        return len(text)
+
+    def write_future(self, future):
+        self._queue.append(future)
+        self._pending += 1
+        self._drain(self._inflight)
+
+    def flush(self):
+        self._drain(0)
+
+    def _drain(self, inflight):
+        while self._queue:
+            head = self._queue[0]
+            if isinstance(head, Future):
+                if self._pending <= inflight and not head.done():
+                    break
+                head = head.result()
+                self._pending -= 1
+            self._out.write(head)
+            self._queue.popleft()
+
+
+class _RasterRewriter(XMLGenerator):
+    '''
+    copies the svg elements as they are parsed, handing the PNG rasters
+    to pool to be written as WebP; the prolog before <svg> is dropped
+    '''
+
+    def __init__(self, writer, pool):
+        XMLGenerator.__init__(self, writer, 'utf-8', short_empty_elements=True)
+        self._writer, self._pool = writer, pool
+
+    def startDocument(self):
+        pass
+
+    def startElement(self, name, attrs):
+        pngs = [key for key, value in attrs.items() if value.startswith(_PNG_URI)]
+        XMLGenerator.startElement(self, name, dict(
+            (key, value) for key, value in attrs.items() if key not in pngs))
+        for key in pngs:
+            self._writer.write(' %s="data:image/webp;base64,' % key)
+            self._writer.write_future(self._pool.submit(_png_to_webp,
+                                                        attrs[key][len(_PNG_URI):]))
+            self._writer.write('"')
+
+    def endDocument(self):
+        self._writer.flush()
+
+
+def _compress_rasters(image, chunk=1 << 16):
+    '''
+    replace the PNG rasters of an svg by WebP in one streaming pass of
+    the parser, the rasters being converted by a pool of threads
+    '''
+    out = io.StringIO()
+    nthreads = cpu_count()
+    with ThreadPoolExecutor(max_workers=nthreads) as pool:
+        parser = xml.sax.make_parser()
+        parser.setFeature(xml.sax.handler.feature_external_ges, False)
+        parser.setContentHandler(_RasterRewriter(_OrderedWriter(out, 2 * nthreads), pool))
+        for start in range(0, len(image), chunk):
+            parser.feed(image[start:start + chunk])
+        parser.close()
+    return out.getvalue()
+
+
+def _svgo(image, compress='auto'):
+    ''' the svg cleaned up by svgo, or as it is if svgo cannot run '''
+    cmd = 'svgo -i - -o - -q -p 3 --pretty --disable=cleanupNumericValues'
+    try:
+        pout = subprocess.run(cmd, input=image.encode('utf-8'), stdout=subprocess.PIPE,
+                              shell=True, check=True, close_fds=True).stdout
+    except OSError as e:
+        from errno import ENOENT
+        if compress is True and e.errno == ENOENT:
+            raise e
+        return image
+    return pout.decode('utf-8')
+
+
+def svg_compress(image, compress='auto'):
+    ''' takes an image as created by nilearn.plotting and returns a blob svg.
+    Performs compression (can be disabled). The rasters are converted to
+    WebP in process if Pillow can write WebP, else with cwebp; svgo then
+    cleans up the vector part when it is installed. '''
+    start, size = time.time(), len(image)
+    rasters = image.count('data:image/png')
+    if (compress is True or compress == 'auto') and has_pillow_webp():
+        image, method = _compress_rasters(image), 'pillow'
+        if which('svgo'):
+            image, method = _svgo(image, compress), 'pillow/svgo'
+    else:
+        image, method = _compress_with_tools(image, compress), 'svgo/cwebp'
+    COMPRESSION_LOG.append({'method': method, 'rasters': rasters, 'bytes_in': size,
+                            'bytes_out': len(image), 'seconds': time.time() - start})
+    return image
+
+
+def _compress_with_tools(image, compress='auto'):
+    ''' svg_compress with the svgo and cwebp commands. A bit hacky. '''
+
+    # Check availability of svgo and cwebp
+    has_compress = all((which('svgo'), which('cwebp')))
+    if compress is True and not has_compress:
+        raise RuntimeError('Compression is required, but svgo or cwebp are not installed')
+    else:
+        compress = (compress is True or compress == 'auto') and has_compress
+
+    # Compress the SVG file using SVGO
+    if compress:
+        image = _svgo(image, compress)
+
+    # Convert all of the rasters inside the SVG file with 80% compressed WEBP
+    if compress:
+        new_lines = []
+        with io.StringIO(image) as fp:
+            for line in fp:
+                if "image/png" in line:
+                    tmp_lines = [line]
+                    while "/>" not in line:
+                        line = fp.readline()
+                        tmp_lines.append(line)
+                    content = ''.join(tmp_lines).replace('\n', '').replace(
+                        ',  ', ',')
+
+                    left = content.split('base64,')[0] + 'base64,'
+                    left = left.replace("image/png", "image/webp")
+                    right = content.split('base64,')[1]
+                    png_b64 = right.split('"')[0]
+                    right = '"' + '"'.join(right.split('"')[1:])
+
+                    cmd = "cwebp -quiet -noalpha -q 80 -o - -- -"
+                    pout = subprocess.run(
+                        cmd, input=base64.b64decode(png_b64), shell=True,
+                        stdout=subprocess.PIPE, check=True, close_fds=True).stdout
+                    webpimg = base64.b64encode(pout).decode('utf-8')
+                    new_lines.append(left + webpimg + right)
+                else:
+                    new_lines.append(line)
+        lines = new_lines
+    else:
+        lines = image.splitlines()
+
+    svg_start = 0
+    for i, line in enumerate(lines):
+        if '<svg ' in line:
+            svg_start = i
+            continue
+
+    image_svg = lines[svg_start:]  # strip out extra DOCTYPE, etc headers
+    return ''.join(image_svg)  # straight up giant string
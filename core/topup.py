@@ -1,9 +1,11 @@
-from fmapprocessing import _fix_hdr,maskdata,n4_correction,meanimage
-from fmapprocessing import  antsregistration, afni3dQwarp,_torads,vsm2dm
-from nipype.interfaces import fsl,afni
-import os,sys,glob,json
-import numpy as np
+from fmapprocessing import _fix_hdr,n4_correction,meanimage,afniskullstrip
+from fmapprocessing import  antsregistration, afni3dQwarp,_torads
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+import glob,json,shutil
 from argparse import (ArgumentParser, RawTextHelpFormatter)
+# on the path once fmapprocessing is imported
+from imgio import parse_bytes
 def get_parser():
     parser = ArgumentParser(
         formatter_class=RawTextHelpFormatter,
@@ -20,6 +22,18 @@ def get_parser():
     parser.add_argument(
         '-o', '--out', action='store', required=True,
         help='outdir')
+    parser.add_argument(
+        '-n', '--nthreads', action='store', type=int, default=None,
+        help='threads for ANTs and AFNI, split between the matched and\n'
+             'opposed phase encoding branches [default: number of cpus]')
+    parser.add_argument(
+        '-c', '--cachedir', action='store', default=None,
+        help='directory of cached ANTs registrations, reused when the\n'
+             'images and parameters are unchanged [default: no cache]')
+    parser.add_argument(
+        '-z', '--cachesize', action='store', default='4G',
+        help='size bound of the registration cache, e.g. 512M or 4G\n'
+             '[default: 4G]')
     return parser
 opts = get_parser().parse_args()
 fmapdir=opts.fmapdir
@@ -45,44 +59,49 @@ else:
     matched_pe=glob.glob(fmapdir+'/*dir-AP_epi.nii.gz')[0]
     opposed_pe=glob.glob(fmapdir+'/*dir-PA_epi.nii.gz')[0]
 
-import shutil
-shutil.copy2(matched_pe,outdir+'/magmatchpe.nii.gz')
-shutil.copy2(opposed_pe,outdir+'/opposepe.nii.gz')
-matched_pe=outdir+'/magmatchpe.nii.gz'
-opposed_pe=outdir+'/opposepe.nii.gz'
-
-#find the mean,
-matched_mean=outdir+'/meanmatchpe.nii.gz'
-opposed_mean=outdir+'/meanoppppe.nii.gz'
-meanimage(matched_pe,matched_mean)
-meanimage(opposed_pe,opposed_mean)
+def prepare_branch(pe_file,pe_copy,mean_file,brain_file,warped_file,transform_prefix,
+                   strip_bias=True,num_threads=None):
+    """
+    copy, average, bias correct, skull strip and register one phase
+    encoding image to the reference; the branches of the two phase
+    encoding directions do not share any file
+    """
+    shutil.copy2(pe_file,pe_copy)
+    meanimage(pe_copy,mean_file)
+    if strip_bias:
+        strip_in=n4_correction(in_file=mean_file,num_threads=num_threads)
+    else:
+        strip_in=mean_file
+    #afni 3dskulkstrip is better
+    afniskullstrip(in_file=strip_in,out_file=brain_file,num_threads=num_threads)
+    antsregistration(fixed=reference,moving=brain_file,output_warped=warped_file,
+                     transform_prefix=transform_prefix,num_threads=num_threads,
+                     cache_dir=opts.cachedir,cache_size=parse_bytes(opts.cachesize))
+    return warped_file
 
-matched_bias=n4_correction(in_file=matched_mean)
-opposed_bias=n4_correction(in_file=opposed_mean)
-
-matched_brain=outdir+'/matchpe_brain.nii.gz'
-#afni 3dskulkstrip is better
+# the two branches are independent until 3dQwarp, run them side by side
+nthreads=opts.nthreads or cpu_count()
+branch_threads=max(1,nthreads//2)
 matched_brain=outdir+'/matchpe_brain.nii.gz' 
 opposed_brain=outdir+'/opppe_brain.nii.gz' 
-matched_mask=outdir+'/matchpe_mask.nii.gz' 
-opposed_mask=outdir+'/opppe_mask.nii.gz'
-skultri=afni.SkullStrip()
-skultri.inputs.in_file=matched_bias
-skultri.inputs.out_file=matched_brain
-skultri.run()
-
-skultri.inputs.in_file=opposed_mean
-skultri.inputs.out_file=opposed_brain
-skultri.run()
 
 #register both AP and PA to bold 
 opposed_warped=outdir+'/opposewd_warped.nii.gz'
 matched_warped=outdir+'/matched_warped.nii.gz'
 
-opposed_regis=antsregistration(fixed=reference,moving=opposed_brain,output_warped=opposed_warped,
-transform_prefix=outdir+'/trans1_')
-opposed_regis2=antsregistration(fixed=reference,moving=matched_brain,output_warped=matched_warped,
-transform_prefix=outdir+'/trans1_')
-sourcewarp=afni3dQwarp(oppose_pe=opposed_warped,matched_pe=matched_warped,source_warp=outdir+'/sourcewarp')
+with ThreadPoolExecutor(max_workers=2) as executor:
+    matched=executor.submit(prepare_branch,matched_pe,outdir+'/magmatchpe.nii.gz',
+                            outdir+'/meanmatchpe.nii.gz',matched_brain,matched_warped,
+                            outdir+'/trans_matched_',num_threads=branch_threads)
+    # as before, the opposed image is skull stripped without bias correction
+    opposed=executor.submit(prepare_branch,opposed_pe,outdir+'/opposepe.nii.gz',
+                            outdir+'/meanoppppe.nii.gz',opposed_brain,opposed_warped,
+                            outdir+'/trans_opposed_',strip_bias=False,
+                            num_threads=branch_threads)
+    matched_warped=matched.result()
+    opposed_warped=opposed.result()
+
+sourcewarp=afni3dQwarp(oppose_pe=opposed_warped,matched_pe=matched_warped,source_warp=outdir+'/sourcewarp',
+                       num_threads=nthreads)
 fixhdr=_fix_hdr(in_file=sourcewarp,newpath=outdir+'/')
-out_file=_torads(in_file=fixhdr,out_file=outdir+'/fieldmapto_rads.nii.gz')
\ No newline at end of file
+out_file=_torads(in_file=fixhdr,out_file=outdir+'/fieldmapto_rads.nii.gz')
@@ -7,11 +7,10 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import os
 import os.path as op
 import subprocess
-import base64
 import re
 from sys import version_info
 from uuid import uuid4
-from io import open, StringIO
+from io import open
 
 import numpy as np
 import nibabel as nb
@@ -25,6 +24,9 @@ from seaborn import color_palette
 #from .. import NIWORKFLOWS_LOG
 from nipype.utils import filemanip
 
+from cuts import cuts_from_bbox
+from svgcompress import svg_compress
+
 try:
     from shutil import which
 except ImportError:
@@ -95,71 +97,6 @@ def robust_set_limits(data, plot_params):
     return plot_params
 
 
-def svg_compress(image, compress='auto'):
-    ''' takes an image as created by nilearn.plotting and returns a blob svg.
-    Performs compression (can be disabled). A bit hacky. '''
-
-    # Check availability of svgo and cwebp
-    has_compress = all((which('svgo'), which('cwebp')))
-    if compress is True and not has_compress:
-        raise RuntimeError('Compression is required, but svgo or cwebp are not installed')
-    else:
-        compress = (compress is True or compress == 'auto') and has_compress
-
-    # Compress the SVG file using SVGO
-    if compress:
-        cmd = 'svgo -i - -o - -q -p 3 --pretty --disable=cleanupNumericValues'
-        try:
-            pout = subprocess.run(cmd, input=image.encode('utf-8'), stdout=subprocess.PIPE,
-                                  shell=True, check=True, close_fds=True).stdout
-        except OSError as e:
-            from errno import ENOENT
-            if compress is True and e.errno == ENOENT:
-                raise e
-        else:
-            image = pout.decode('utf-8')
-
-    # Convert all of the rasters inside the SVG file with 80% compressed WEBP
-    if compress:
-        new_lines = []
-        with StringIO(image) as fp:
-            for line in fp:
-                if "image/png" in line:
-                    tmp_lines = [line]
-                    while "/>" not in line:
-                        line = fp.readline()
-                        tmp_lines.append(line)
-                    content = ''.join(tmp_lines).replace('\n', '').replace(
-                        ',  ', ',')
-
-                    left = content.split('base64,')[0] + 'base64,'
-                    left = left.replace("image/png", "image/webp")
-                    right = content.split('base64,')[1]
-                    png_b64 = right.split('"')[0]
-                    right = '"' + '"'.join(right.split('"')[1:])
-
-                    cmd = "cwebp -quiet -noalpha -q 80 -o - -- -"
-                    pout = subprocess.run(
-                        cmd, input=base64.b64decode(png_b64), shell=True,
-                        stdout=subprocess.PIPE, check=True, close_fds=True).stdout
-                    webpimg = base64.b64encode(pout).decode('utf-8')
-                    new_lines.append(left + webpimg + right)
-                else:
-                    new_lines.append(line)
-        lines = new_lines
-    else:
-        lines = image.splitlines()
-
-    svg_start = 0
-    for i, line in enumerate(lines):
-        if '<svg ' in line:
-            svg_start = i
-            continue
-
-    image_svg = lines[svg_start:]  # strip out extra DOCTYPE, etc headers
-    return ''.join(image_svg)  # straight up giant string
-
-
 def svg2str(display_object, dpi=300):
     """
     Serializes a nilearn display object as a string
@@ -196,57 +133,6 @@ def extract_svg(display_object, dpi=300, compress='auto'):
     return image_svg[start_idx:end_idx]
 
 
-def cuts_from_bbox(mask_nii, cuts=3):
-    """Finds equi-spaced cuts for presenting images"""
-    from nibabel.affines import apply_affine
-
-    mask_data = mask_nii.get_data() > 0.0
-
-    # First, project the number of masked voxels on each axes
-    ijk_counts = [
-        mask_data.sum(2).sum(1),  # project sagittal planes to transverse (i) axis
-        mask_data.sum(2).sum(0),  # project coronal planes to to longitudinal (j) axis
-        mask_data.sum(1).sum(0),  # project axial planes to vertical (k) axis
-    ]
-
-    # If all voxels are masked in a slice (say that happens at k=10),
-    # then the value for ijk_counts for the projection to k (ie. ijk_counts[2])
-    # at that element of the orthogonal axes (ijk_counts[2][10]) is
-    # the total number of voxels in that slice (ie. Ni x Nj).
-    # Here we define some thresholds to consider the plane as "masked"
-    # The thresholds vary because of the shape of the brain
-    # I have manually found that for the axial view requiring 30%
-    # of the slice elements to be masked drops almost empty boxes
-    # in the mosaic of axial planes (and also addresses #281)
-    ijk_th = [
-        int((mask_data.shape[1] * mask_data.shape[2]) * 0.2),   # sagittal
-        int((mask_data.shape[0] * mask_data.shape[2]) * 0.0),   # coronal
-        int((mask_data.shape[0] * mask_data.shape[1]) * 0.3),   # axial
-    ]
-
-    vox_coords = []
-    for ax, (c, th) in enumerate(zip(ijk_counts, ijk_th)):
-        B = np.argwhere(c > th)
-        if B.size:
-            smin, smax = B.min(), B.max()
-
-        # Avoid too narrow selections of cuts (very small masks)
-        if not B.size or (th > 0 and (smin + cuts + 1) >= smax):
-            B = np.argwhere(c > 0)
-
-        # Resort to full plane if mask is seemingly empty
-        smin, smax = B.min(), B.max() if B.size else (0, mask_data.shape[ax])
-        inc = (smax - smin) / (cuts + 1)
-        vox_coords.append([smin + (i + 1) * inc for i in range(cuts)])
-
-    ras_coords = []
-    for cross in np.array(vox_coords).T:
-        ras_coords.append(apply_affine(
-            mask_nii.affine, cross).tolist())
-    ras_cuts = [list(coords) for coords in np.transpose(ras_coords)]
-    return {k: v for k, v in zip(['x', 'y', 'z'], ras_cuts)}
-
-
 def _3d_in_file(in_file):
     ''' if self.inputs.in_file is 3d, return it.
     if 4d, pick an arbitrary volume and return that.
@@ -283,10 +169,7 @@ def plot_segs(image_nii, seg_niis, out_file, bbox_nii=None, masked=False,
     plot_params = robust_set_limits(data, plot_params)
 
     bbox_nii = nb.load(image_nii if bbox_nii is None else bbox_nii)
-    if masked:
-        bbox_nii = nlimage.threshold_img(bbox_nii, 1e-3)
-
-    cuts = cuts_from_bbox(bbox_nii, cuts=7)
+    cuts = cuts_from_bbox(bbox_nii, cuts=7, threshold=1e-3 if masked else 0.0)
     plot_params['colors'] = colors or plot_params.get('colors', None)
     out_files = []
     for d in plot_params.pop('dimensions', ('z', 'x', 'y')):
@@ -50,6 +50,7 @@ output           logfile2             ${prefix}_logfile_spatial
 output           cbfbasil            ${prefix}_cbfbasil.nii.gz
 output           cbfpatial           ${prefix}_cbfspatial.nii.gz
 output           cbfpv               ${prefix}_cbfpv.nii.gz
+output           basil_qei           ${prefix}_basil_qei.tsv
 
 
 
@@ -274,11 +275,18 @@ routine @3 Orgainizing the output
               -V) )
    echo ${neg[0]}   >> ${negative_voxels_basil[cxt]}
 
- #aslqc 
+ #aslqc, all basil cbf maps in one run
+ qei_in=(); qei_out=()
+ [[ -f ${cbfbasil[cxt]} ]]   && qei_in+=( ${cbfbasil[cxt]} )   && qei_out+=( ${outdir}/${prefix}_cbfbasil )
+ [[ -f ${cbfspatial[cxt]} ]] && qei_in+=( ${cbfspatial[cxt]} ) && qei_out+=( ${outdir}/${prefix}_cbfspatial )
+ [[ -f ${cbfpv[cxt]} ]]      && qei_in+=( ${cbfpv[cxt]} )      && qei_out+=( ${outdir}/${prefix}_cbfpv )
+ if (( ${#qei_in[@]} > 0 )); then
+   exec_xcp  aslqc.py -i ${qei_in[@]}  -m ${mask[sub]} -g ${gm2seq[sub]} \
+          -w ${wm2seq[sub]} -c ${csf2seq[sub]} -o ${qei_out[@]} \
+          -t ${basil_qei[cxt]}
+ fi
+
  if [[ -f ${cbfbasil[cxt]} ]]; then 
-   exec_xcp  aslqc.py -i ${cbfbasil[cxt]}  -m ${mask[sub]} -g ${gm2seq[sub]} \
-          -w ${wm2seq[sub]} -c ${csf2seq[sub]} -o ${outdir}/${prefix}_cbfbasil
-   
    qc cbfbasil_qei   cbfbasil_qei   ${prefix}_cbfbasil_QEI.txt
 
    zscore_image ${cbfbasil[cxt]} ${cbfbasilZ[cxt]} ${mask[sub]}
@@ -288,9 +296,6 @@ routine @3 Orgainizing the output
 
 
  if [[ -f ${cbfspatial[cxt]} ]]; then 
-   exec_xcp  aslqc.py -i ${cbfspatial[cxt]}  -m ${mask[sub]} -g ${gm2seq[sub]} \
-          -w ${wm2seq[sub]} -c ${csf2seq[sub]} -o ${outdir}/${prefix}_cbfspatial
-   
    qc cbfspatial_qei   cbfspatial_qei   ${prefix}_cbfspatial_QEI.txt
 
    zscore_image ${cbfspatial[cxt]} ${cbfspatialZ[cxt]} ${mask[sub]}
@@ -298,9 +303,6 @@ routine @3 Orgainizing the output
  fi
 
   if [[ -f ${cbfpv[cxt]} ]]; then 
-   exec_xcp  aslqc.py -i ${cbfpv[cxt]}   -m ${mask[sub]} -g ${gm2seq[sub]} \
-          -w ${wm2seq[sub]} -c ${csf2seq[sub]} -o ${outdir}/${prefix}_cbfpv
-   
    qc cbfpv_qei   cbfpv_qei   ${prefix}_cbfpv_QEI.txt
    
    zscore_image ${cbfpv[cxt]}  ${cbfpvZ[cxt]} ${mask[sub]}
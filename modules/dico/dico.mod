@@ -71,19 +71,26 @@ else
      dico_fmapdir=${dico_fmapdir[cxt]}
 fi
 
+## reuse the ANTs registrations of unchanged images across runs, if the
+## design names a cache directory (dico_cachedir, bounded by dico_cachesize)
+dico_cache=
+if [[ -n ${dico_cachedir[cxt]} ]]; then
+    dico_cache="-c ${dico_cachedir[cxt]} -z ${dico_cachesize[cxt]:-4G}"
+fi
+
 if [[ -d ${dico_fmapdir} ]]; then 
 echo " there is fieldmap directory"
     phase=$(ls -f ${dico_fmapdir}/*phase*nii.gz 2>/dev/null) 
     if [[ -f ${phase} ]]; then 
        # run the phasediff.pye
        exec_sys mkdir -p ${outdir}/dico
-       python ${XCPEDIR}/core/phasediff.py -f ${dico_fmapdir}  -i ${intermediate}-referencebrain.nii.gz   -o ${outdir}/dico/ 
+       python ${XCPEDIR}/core/phasediff.py -f ${dico_fmapdir}  -i ${intermediate}-referencebrain.nii.gz   -o ${outdir}/dico/ ${dico_cache}
        exec_fsl immv ${outdir}/dico/sdc_warp.nii.gz  ${outdir}/${prefix}_fieldmap.nii.gz
        exec_fsl immv ${outdir}/dico/mag_warped.nii.gz  ${outdir}/${prefix}_magnitude.nii.gz 
 
     else 
        exec_sys mkdir -p ${outdir}/dico
-       python ${XCPEDIR}/core/topup.py -f ${dico_fmapdir} -o ${outdir}/dico/  -p ${dico_pedir}
+       python ${XCPEDIR}/core/topup.py -f ${dico_fmapdir} -o ${outdir}/dico/  -p ${dico_pedir} ${dico_cache}
        exec_fsl immv ${outdir}/dico/fieldmapto_rads.nii.gz  ${outdir}/${prefix}_fieldmap.nii.gz
        exec_fsl immv ${outdir}/dico/matched_warped.nii.gz ${outdir}/${prefix}_magnitude.nii.gz 
     fi
@@ -660,7 +660,7 @@ while (( ${#rem} > 0 ))
          #exec_fsl immv ${intermediate} ${intermediate}_${cur}
          exec_xcp removenonsteady.py -i  ${intermediate}.nii.gz  \
                      -t $out/prestats/${prefix}_fmriconf.tsv \
-                     -o $out/prestats/prepocessed.nii.gz -s $out/prestats/${prefix}_fmriconf.tsv
+                     -o $out/prestats/prepocessed.nii.gz -s $out/prestats/${prefix}_fmriconf.tsv -u
         
         exec_fsl immv $out/prestats/prepocessed.nii.gz  ${intermediate}_${cur}.nii.gz
          intermediate=${intermediate}_${cur}
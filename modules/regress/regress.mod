@@ -174,7 +174,7 @@ while (( ${#rem} > 0 ))
       #  * Global regressors
       #############################################################
       trep=$(exec_fsl fslval ${img[sub]} pixdim4)
-      exec_xcp addTR.py -i ${intermediate}.nii.gz  -o ${intermediate}.nii.gz -t ${trep} 
+      exec_xcp addTR.py -i ${intermediate}.nii.gz  -o ${intermediate}.nii.gz -t ${trep} -u
       routine                 @1    Despiking BOLD timeseries
       remove_outliers         --SIGNPOST=${signpost}              \
                               --INPUT=${intermediate}             \
@@ -205,7 +205,7 @@ while (( ${#rem} > 0 ))
       # residuals of the model as the processed timeseries.
       #############################################################
       trep=$(exec_fsl fslval ${img[sub]} pixdim4)
-      exec_xcp addTR.py -i ${intermediate}.nii.gz  -o ${intermediate}.nii.gz -t ${trep} 
+      exec_xcp addTR.py -i ${intermediate}.nii.gz  -o ${intermediate}.nii.gz -t ${trep} -u
       routine                 @7    Demeaning and detrending BOLD timeseries
       demean_detrend       --SIGNPOST=${signpost}           \
                            --ORDER=${regress_dmdt[cxt]}     \
@@ -234,7 +234,7 @@ while (( ${#rem} > 0 ))
       #############################################################
       routine                 @2    Temporally filtering image and confounds
       trep=$(exec_fsl fslval ${img[sub]} pixdim4)
-      exec_xcp addTR.py -i ${intermediate}.nii.gz  -o ${intermediate}.nii.gz -t ${trep} 
+      exec_xcp addTR.py -i ${intermediate}.nii.gz  -o ${intermediate}.nii.gz -t ${trep} -u
       filter_temporal         --SIGNPOST=${signpost}              \
                               --FILTER=${regress_tmpf[cxt]}       \
                               --INPUT=${intermediate}.nii.gz             \
@@ -322,7 +322,7 @@ while (( ${#rem} > 0 ))
          done 
 
          trep=$(exec_fsl fslval ${img[sub]} pixdim4)
-         exec_xcp addTR.py -i ${intermediate}.nii.gz  -o ${intermediate}.nii.gz -t ${trep} 
+         exec_xcp addTR.py -i ${intermediate}.nii.gz  -o ${intermediate}.nii.gz -t ${trep} -u
          subroutine           @4.6  [Executing detrend]
          proc_afni   ${intermediate}_${cur}.nii.gz \
          3dTproject                         \
@@ -48,6 +48,7 @@ output                cbfscrubR                ${prefix}_cbfscrubR.nii.gz
 output                cbfscrubZ                ${prefix}_cbfscrubZ.nii.gz
 output                cbfscoreZ                ${prefix}_cbfscoreZ.nii.gz
 output                cbfscore_tsnr            ${prefix}_cbfscore_tsnr.nii.gz 
+output                scorescrub_qei           ${prefix}_scorescrub_qei.tsv
 
 qc nvoldel  nvoldel  ${prefix}_nvoldel.txt 
 
@@ -88,9 +89,11 @@ if ! is_image ${cbfscrub[cxt]}
             -t     ${scorescrub_thresh[cxt]} \
             -o     ${outdir}/${prefix}
 
-   #aslqc 
-   exec_xcp  aslqc.py -i ${cbfscore[cxt]}  -m ${mask[sub]} -g ${gm2seq[sub]} \
-          -w ${wm2seq[sub]} -c ${csf2seq[sub]} -o ${outdir}/${prefix}_cbfscore
+   #aslqc, score and scrub cbf in one run 
+   exec_xcp  aslqc.py -i ${cbfscore[cxt]} ${cbfscrub[cxt]}  -m ${mask[sub]} -g ${gm2seq[sub]} \
+          -w ${wm2seq[sub]} -c ${csf2seq[sub]} \
+          -o ${outdir}/${prefix}_cbfscore ${outdir}/${prefix}_cbfscrub \
+          -t ${scorescrub_qei[cxt]}
    
 
    qc cbfscore_qei   cbfscore_qei   ${prefix}_cbfscore_QEI.txt
@@ -111,9 +114,6 @@ if ! is_image ${cbfscrub[cxt]}
 
 
 
-   exec_xcp  aslqc.py -i ${cbfscrub[cxt]}  -m ${mask[sub]} -g ${gm2seq[sub]} \
-          -w ${wm2seq[sub]} -c ${csf2seq[sub]} -o ${outdir}/${prefix}_cbfscrub
-   
    qc cbfscrub_qei   cbfscrub_qei   ${prefix}_cbfscrub_QEI.txt
    #compute relative CBF 
 
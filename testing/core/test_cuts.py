@@ -0,0 +1,31 @@
+import os.path as op
+import sys
+
+import nibabel as nb
+import numpy as np
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..', '..', 'core'))
+from cuts import _PROJECTIONS, cuts_from_bbox, mask_projections  # noqa: E402
+
+
+def test_mask_projections(tmpdir):
+    rng = np.random.RandomState(0)
+    data = rng.normal(size=(12, 15, 9)).astype(np.float32)
+    mask = data > 0.5
+    filename = str(tmpdir.join('mask.nii.gz'))
+    nb.Nifti1Image(data, np.eye(4)).to_filename(filename)
+
+    img = nb.load(filename)
+    projections = mask_projections(img, 0.5)
+    for counts, axes in zip(projections, [(1, 2), (0, 2), (0, 1)]):
+        assert np.array_equal(counts, mask.sum(axis=axes))
+    # a mask already counted is not read again
+    assert mask_projections(nb.load(filename), 0.5) is projections
+    assert len([key for key in _PROJECTIONS if key[0] == filename]) == 1
+
+
+def test_cuts_from_bbox_empty_mask():
+    img = nb.Nifti1Image(np.zeros((10, 10, 10), dtype=np.float32), np.eye(4))
+    cuts = cuts_from_bbox(img, cuts=4, threshold=1e-3)
+    # the full plane is used when nothing is masked
+    assert cuts['z'] == [2.0, 4.0, 6.0, 8.0]
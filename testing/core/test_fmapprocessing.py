@@ -0,0 +1,152 @@
+import os
+import os.path as op
+import sys
+
+import nibabel as nb
+import numpy as np
+import pytest
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..', '..', 'core'))
+from fmapprocessing import (_despike2d, demean_img, despike_img, handoff, mode_estimate,  # noqa: E402
+                            registration_cache_key, restore_registration, store_registration)
+
+
+def loop_despike2d(data, thres, neigh=None):
+    """ the voxel by voxel scan that _despike2d replaces """
+    if neigh is None:
+        neigh = [-1, 0, 1]
+    for k in range(data.shape[-1]):
+        data2d = data[..., k]
+        for i in range(data2d.shape[0]):
+            for j in range(data2d.shape[1]):
+                vals = []
+                thisval = data2d[i, j]
+                for ii in neigh:
+                    for jj in neigh:
+                        try:
+                            vals.append(data2d[i + ii, j + jj])
+                        except IndexError:
+                            pass
+                vals = np.array(vals)
+                patch_range = vals.max() - vals.min()
+                patch_med = np.median(vals)
+                if (patch_range > 1e-6 and
+                        (abs(thisval - patch_med) / patch_range) > thres):
+                    data[i, j, k] = patch_med
+    return data
+
+
+@pytest.mark.parametrize('neigh', [None, [-2, -1, 0, 1]])
+def test_despike2d_isolated_spikes_match_loop(neigh):
+    # spikes far from each other and from the edges are despiked in one
+    # pass, as the voxel by voxel scan does
+    data = np.ones((20, 18, 3)) * [5., 7., 11.]
+    data[5, 6, 0] = data[12, 10, 1] = 400
+    data[14, 4, 2] = data[3, 15, 2] = -300
+    for thres in (0.1, 0.5, 0.9):
+        despiked = _despike2d(data.copy(), thres, neigh)
+        assert np.array_equal(despiked, loop_despike2d(data.copy(), thres, neigh))
+        assert np.array_equal(despiked, np.ones((20, 18, 3)) * [5., 7., 11.])
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64, np.int16])
+@pytest.mark.parametrize('neigh', [None, [-2, -1, 0, 1]])
+def test_despike2d_converges(dtype, neigh):
+    rng = np.random.RandomState(0)
+    for shape in [(1, 5, 2), (4, 3, 1), (9, 7, 3), (40, 30, 4)]:
+        data = (rng.normal(size=shape) * 20).astype(dtype)
+        spikes = rng.uniform(size=shape) < 0.2
+        data[spikes] *= 10
+        for thres in (0.1, 0.5, 0.9):
+            despiked = _despike2d(data.copy(), thres, neigh)
+            assert despiked.dtype == dtype
+            # no spike is left once the tests stop changing voxels
+            assert np.array_equal(_despike2d(despiked.copy(), thres, neigh), despiked)
+
+
+def test_despike_img():
+    data = np.full((6, 6, 2), 5.0, dtype=np.float32)
+    data[2, 3, 1] = 100
+    despiked = despike_img(nb.Nifti1Image(data, np.eye(4)), 0.7).get_fdata()
+    assert np.array_equal(despiked, np.full((6, 6, 2), 5.0))
+
+
+def test_handoff(tmpdir):
+    img = nb.Nifti1Image(np.arange(24, dtype=np.float32).reshape(2, 3, 4), np.eye(4))
+    scratch = handoff(img, str(tmpdir.join('phase')))
+    final = handoff(img, str(tmpdir.join('phase')), scratch=False)
+    assert scratch.endswith('phase.nii') and final.endswith('phase.nii.gz')
+    for out_file in (scratch, final):
+        assert np.array_equal(nb.load(out_file).get_fdata(), img.get_fdata())
+
+
+def test_mode_estimate():
+    from scipy.stats import mode
+    rng = np.random.RandomState(0)
+    for dtype in (np.int16, np.float32, np.float64):
+        data = rng.randint(-50, 50, size=(7, 6, 5)).astype(dtype)
+        estimate, bin_width = mode_estimate(data)
+        assert bin_width == 1 and estimate == np.ravel(mode(data, axis=None)[0])[0]
+    data = rng.normal(3, 1, size=200000)
+    data[:10] = np.nan
+    estimate, bin_width = mode_estimate(data, bin_width=0.25)
+    assert bin_width == 0.25 and abs(estimate - 3) < 0.3
+    # only the voxels in the mask count
+    mask = data > 3.5
+    estimate, bin_width = mode_estimate(data, mask=mask)
+    assert estimate > 3.5 and abs(estimate - 3.5) < 0.5
+
+
+def test_mode_estimate_exact_zero():
+    # a warp with a zero background off the centre of its bin
+    rng = np.random.RandomState(0)
+    data = np.zeros((20, 20, 20), dtype=np.float32)
+    data[:10] = rng.normal(-2.4, 3, size=(10, 20, 20))
+    estimate, bin_width = mode_estimate(data)
+    assert estimate == 0.0 and bin_width != 1
+    # a bin holding a single distinct value gives that value
+    assert mode_estimate(np.array([0.3, 0.3, 7.9]), bin_width=1.0)[0] == 0.3
+    demeaned = demean_img(nb.Nifti1Image(data, np.eye(4))).get_fdata()
+    assert np.array_equal(demeaned[10:], np.zeros((10, 20, 20)))
+
+
+class FakeInputs(object):
+    def __init__(self, fixed, moving, warped, **params):
+        self.fixed_image, self.moving_image, self.output_warped_image = fixed, moving, warped
+        self.params = params
+
+    def get_traitsfree(self):
+        return dict(self.params, fixed_image=self.fixed_image, moving_image=self.moving_image,
+                    output_warped_image=self.output_warped_image, num_threads=4)
+
+
+def test_registration_cache_hit_and_eviction(tmpdir):
+    tmpdir = str(tmpdir)
+    cache = os.path.join(tmpdir, 'cache')
+    rng = np.random.RandomState(0)
+    images = []
+    for name in ('fixed', 'moving', 'moving_copy'):
+        images.append(os.path.join(tmpdir, name + '.nii.gz'))
+    data = rng.normal(size=(6, 5, 4)).astype(np.float32)
+    nb.Nifti1Image(data, np.eye(4)).to_filename(images[0])
+    nb.Nifti1Image(data[::-1].copy(), np.eye(4)).to_filename(images[1])
+    nb.Nifti1Image(data[::-1].copy(), np.eye(4)).to_filename(images[2])
+    outputs = [os.path.join(tmpdir, name) for name in ('Composite.h5', 'InverseComposite.h5',
+                                                       'warped.nii.gz')]
+    key = registration_cache_key(FakeInputs(images[0], images[1], outputs[2], transforms=['SyN']))
+    # same voxel data under another name and thread count: same key
+    assert key == registration_cache_key(FakeInputs(images[0], images[2], outputs[2],
+                                                    transforms=['SyN']))
+    assert key != registration_cache_key(FakeInputs(images[0], images[1], outputs[2],
+                                                    transforms=['Affine']))
+    assert not restore_registration(cache, key, outputs)
+    for i, out_file in enumerate(outputs):
+        with open(out_file, 'wb') as fobj:
+            fobj.write(bytes([i]) * 100)
+    store_registration(cache, key, outputs)
+    for out_file in outputs:
+        os.remove(out_file)
+    assert restore_registration(cache, key, outputs)
+    assert open(outputs[1], 'rb').read() == bytes([1]) * 100
+    store_registration(cache, 'other', outputs, cache_size=400)
+    assert sorted(os.listdir(cache)) == ['other']
@@ -0,0 +1,107 @@
+import ast
+import fnmatch
+import os.path as op
+
+REPORT = op.join(op.dirname(op.abspath(__file__)), '..', '..', 'core', 'report.py')
+
+# calls reading the file named by their first argument
+READERS = {('IMAGES', 'image'), ('IMAGES', 'data'), ('IMAGES', 'header'),
+           ('np', 'loadtxt'), ('path', 'isfile'), ('Path', 'isfile'), (None, 'open')}
+# keyword arguments of the plotting helpers that are files they read
+READ_KEYWORDS = {'plot_segs': ('image_nii', 'seg_niis', 'bbox_nii')}
+
+
+def module_value(tree, name):
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], 'id', None) == name:
+            return node.value
+
+
+def path_patterns(node, names):
+    '''
+    the paths an expression builds, relative to outdir, with {prefix} and
+    {template} left in and * for the values only known at run time; None
+    for an expression that does not build paths
+    '''
+    if not isinstance(node, (ast.Name, ast.BinOp, ast.List)):
+        try:
+            value = ast.literal_eval(node)
+        except ValueError:
+            return None
+        return [value] if isinstance(value, str) else None
+    if isinstance(node, ast.Name):
+        if node.id in names:
+            return names[node.id]
+        return {'outdir': [''], 'prefix': ['{prefix}'],
+                'template': ['{template}']}.get(node.id, ['*'])
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = path_patterns(node.left, names), path_patterns(node.right, names)
+        if left is not None and right is not None:
+            return [a + b for a in left for b in right]
+    if isinstance(node, ast.List):
+        items = [path_patterns(item, names) for item in node.elts]
+        if all(item is not None for item in items):
+            return [pattern for item in items for pattern in item]
+    return None
+
+
+def call_name(func):
+    if isinstance(func, ast.Name):
+        return None, func.id
+    if isinstance(func, ast.Attribute):
+        owner = func.value
+        owner = owner.attr if isinstance(owner, ast.Attribute) else getattr(owner, 'id', None)
+        return owner, func.attr
+    return None, None
+
+
+def panel_reads(function):
+    ''' the files a panel function reads, in the order it names them '''
+    names, reads = {}, []
+    for node in ast.walk(function):
+        if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name):
+            patterns = path_patterns(node.value, names)
+            if patterns is not None and any('/' in p for p in patterns):
+                names[node.targets[0].id] = patterns
+        elif isinstance(node, ast.For) and isinstance(node.target, ast.Name):
+            names[node.target.id] = ['*']
+    for node in ast.walk(function):
+        if not isinstance(node, ast.Call):
+            continue
+        owner, name = call_name(node.func)
+        args = []
+        if (owner, name) in READERS:
+            args = node.args[:1]
+        elif name in READ_KEYWORDS:
+            args = [k.value for k in node.keywords if k.arg in READ_KEYWORDS[name]]
+        elif (owner, name) == ('os', 'system'):
+            # the file copied by cp
+            for command in path_patterns(node.args[0], names):
+                words = command.split()
+                if words[0] == 'cp':
+                    reads.append(words[1])
+        for arg in args:
+            patterns = path_patterns(arg, names)
+            assert patterns is not None, ('%s reads a file named by %s' %
+                                          (function.name, ast.dump(arg)))
+            reads.extend(patterns)
+    return [read.lstrip('/') for read in reads]
+
+
+def test_panel_inputs_cover_panel_reads():
+    with open(REPORT) as source:
+        tree = ast.parse(source.read())
+    functions = dict((node.name, node) for node in tree.body
+                     if isinstance(node, ast.FunctionDef))
+    panels = module_value(tree, 'PANELS')
+    inputs = ast.literal_eval(module_value(tree, 'PANEL_INPUTS'))
+    for key, value in zip(panels.keys, panels.values):
+        module = ast.literal_eval(key)
+        reads = panel_reads(functions[value.id])
+        patterns = inputs.get(module, [])
+        for read in reads:
+            assert any(fnmatch.fnmatchcase(read, pattern) for pattern in patterns), \
+                'panel %s reads %s, which is not in PANEL_INPUTS' % (module, read)
+        for pattern in patterns:
+            assert any(fnmatch.fnmatchcase(read, pattern) for read in reads), \
+                'panel %s does not read %s of PANEL_INPUTS' % (module, pattern)
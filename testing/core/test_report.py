@@ -0,0 +1,17 @@
+import os.path as op
+import sys
+
+import pytest
+
+pytest.importorskip('nipype')
+pytest.importorskip('svgutils')
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..', '..', 'core'))
+from report import panel_tasks  # noqa: E402
+
+
+def test_panel_tasks_share_template():
+    modules = ['struc', 'prestats', 'coreg', 'norm', 'alff', 'reho', 'qcfc']
+    # norm shares the template with struc, which shares figures with
+    # prestats and coreg
+    assert panel_tasks(modules) == [['struc', 'prestats', 'coreg', 'norm'],
+                                    ['alff', 'reho'], ['qcfc']]
@@ -0,0 +1,69 @@
+import base64
+import os.path as op
+import sys
+from io import BytesIO, StringIO
+from xml.dom import minidom
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..', '..', 'core'))
+import svgcompress  # noqa: E402
+from svgcompress import COMPRESSION_LOG, _compress_rasters, has_pillow_webp, svg_compress  # noqa: E402
+
+
+def mosaic_svg(panels=3):
+    matplotlib = pytest.importorskip('matplotlib')
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(1, panels)
+    for ax in axes:
+        ax.imshow(np.cumsum(np.random.RandomState(0).rand(64, 64), axis=0))
+    image = StringIO()
+    fig.savefig(image, format='svg')
+    plt.close(fig)
+    return image.getvalue()
+
+
+@pytest.fixture
+def webp():
+    if not has_pillow_webp():
+        pytest.skip('Pillow cannot write WebP')
+
+
+def test_svg_compress_webp(webp, monkeypatch):
+    from PIL import Image
+    monkeypatch.setattr(svgcompress, 'which', lambda cmd: None)
+
+    svg = svg_compress(mosaic_svg(), compress=True)
+    assert svg.startswith('<svg ') and 'image/png' not in svg
+    rasters = svg.split('data:image/webp;base64,')[1:]
+    assert len(rasters) == 3
+    webp = Image.open(BytesIO(base64.b64decode(rasters[0].split('"')[0])))
+    assert webp.format == 'WEBP' and webp.mode == 'RGB'
+    assert COMPRESSION_LOG[-1]['method'] == 'pillow'
+    assert COMPRESSION_LOG[-1]['rasters'] == 3
+    assert COMPRESSION_LOG[-1]['bytes_out'] < COMPRESSION_LOG[-1]['bytes_in']
+
+
+def test_compress_rasters_streams(webp):
+    image = mosaic_svg(panels=5)
+    # chunks and in-flight rasters much smaller than the figure
+    svg = _compress_rasters(image, chunk=1000)
+    assert svg == _compress_rasters(image)
+    before, after = (minidom.parseString(text.encode('utf-8')) for text in (image, svg))
+    assert ([node.tagName for node in before.getElementsByTagName('*')] ==
+            [node.tagName for node in after.getElementsByTagName('*')])
+    assert svg.count('data:image/webp;base64,') == 5
+
+
+def test_svgo_final_pass(webp, monkeypatch):
+    cleaned = []
+    monkeypatch.setattr(svgcompress, 'which', lambda cmd: '/usr/bin/' + cmd)
+    monkeypatch.setattr(svgcompress, '_svgo',
+                        lambda image, compress: cleaned.append(image) or image)
+    svg = svg_compress(mosaic_svg(), compress=True)
+    # svgo sees the svg once the rasters are WebP
+    assert cleaned == [svg] and 'image/png' not in svg
+    assert COMPRESSION_LOG[-1]['method'] == 'pillow/svgo'
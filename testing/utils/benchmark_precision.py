@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+'''
+Wall time and peak memory of the python utilities at float32 and float64
+working precision (XCP_PRECISION). Each run is a separate process, so the
+peak resident memory is that of the utility alone.
+
+    python testing/utils/benchmark_precision.py [-i bold.nii.gz -m mask.nii.gz]
+
+Without -i a reference dataset is made: a 96x96x60x300 int16 BOLD series
+with a brain-shaped mask. The tissue maps, CBF map, confounds, temporal
+mask and surface series the utilities also need are derived from it.
+'''
+from argparse import ArgumentParser
+import os
+import os.path as op
+import resource
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+
+UTILS = op.abspath(op.join(op.dirname(op.abspath(__file__)), '..', '..', 'utils'))
+
+
+def reference_dataset(outdir, bold=None, mask=None, shape=(96, 96, 60, 300)):
+    '''
+    write everything the benchmarked utilities read to outdir
+    '''
+    rng = np.random.RandomState(0)
+    files = {}
+    if bold is None:
+        grid = np.indices(shape[:3]).astype(np.float32)
+        radius = np.sqrt(sum(((g - (n - 1) / 2.) / (n / 2.)) ** 2
+                             for g, n in zip(grid, shape[:3])))
+        brain = radius < 0.8
+        data = np.empty(shape, dtype=np.int16)
+        base = np.where(brain, 1000 + 200 * np.cos(6 * radius), 0).astype(np.float32)
+        for t in range(shape[3]):
+            data[..., t] = base + brain * rng.normal(0, 20, shape[:3])
+        img = nib.Nifti1Image(data, np.diag([2.5, 2.5, 2.5, 1]))
+        img.header.set_zooms((2.5, 2.5, 2.5, 2.))
+        bold = op.join(outdir, 'bold.nii.gz')
+        img.to_filename(bold)
+        mask = op.join(outdir, 'mask.nii.gz')
+        nib.Nifti1Image(brain.astype(np.uint8), img.affine).to_filename(mask)
+    img = nib.load(bold)
+    brain = np.asanyarray(nib.load(mask).dataobj) > 0
+    nvol = img.shape[3]
+    files['bold'], files['mask'] = bold, mask
+
+    mean = np.asarray(img.dataobj[..., :10], dtype=np.float32).mean(axis=3)
+    low, high = mean[brain].min(), mean[brain].max()
+    scaled = brain * (mean - low) / max(high - low, 1)
+    tissues = np.stack([scaled, (1 - scaled) * brain, 1. - brain], axis=0)
+    for name, tissue in zip(('gm', 'wm', 'csf'), tissues):
+        files[name] = op.join(outdir, name + '.nii.gz')
+        nib.Nifti1Image(tissue.astype(np.float32), img.affine).to_filename(files[name])
+    files['cbf'] = op.join(outdir, 'cbf.nii.gz')
+    cbf = 60 * (2.5 * tissues[0] + tissues[1]) + brain * rng.normal(0, 5, brain.shape)
+    nib.Nifti1Image(cbf.astype(np.float32), img.affine).to_filename(files['cbf'])
+
+    tmask = np.ones(nvol)
+    tmask[rng.choice(nvol, nvol // 10, replace=False)] = 0
+    files['tmask'] = op.join(outdir, 'tmask.1D')
+    np.savetxt(files['tmask'], tmask, fmt='%d')
+    confounds = pd.DataFrame(rng.normal(size=(nvol, 6)),
+                             columns=['trans_x', 'trans_y', 'trans_z',
+                                      'rot_x', 'rot_y', 'rot_z'])
+    confounds['non_steady_state_outlier00'] = np.arange(nvol) == 0
+    confounds['non_steady_state_outlier01'] = np.arange(nvol) == 1
+    files['tab'] = op.join(outdir, 'confounds.tsv')
+    confounds.astype(float).to_csv(files['tab'], sep='\t', index=False)
+    files['confound'] = op.join(outdir, 'confmat.1D')
+    np.savetxt(files['confound'], confounds.iloc[:, :6].values)
+    files['fd'] = op.join(outdir, 'fd.1D')
+    np.savetxt(files['fd'], np.abs(rng.normal(0, 0.1, nvol)))
+
+    # the in-mask voxels as the vertices of a surface series
+    from nibabel.gifti import GiftiDataArray, GiftiImage
+    vertices = np.asarray(img.dataobj, dtype=np.float32)[brain][:32492]
+    files['gifti'] = op.join(outdir, 'sub_hemi-L_bold.func.gii')
+    nib.save(GiftiImage(darrays=[GiftiDataArray(col, intent='NIFTI_INTENT_TIME_SERIES')
+                                 for col in vertices.T]), files['gifti'])
+    return files
+
+
+def commands(files, outdir):
+    ''' the argument list of each utility on the reference dataset '''
+    out = lambda name: op.join(outdir, name)
+    return [
+        ('interpolate.py', ['-i', files['bold'], '-o', out('interp.nii.gz'),
+                            '-t', files['tmask'], '-m', files['mask'], '-a', '2']),
+        ('aslqc.py', ['-i', files['cbf'], '-o', out('cbf'), '-m', files['mask'],
+                      '-g', files['gm'], '-w', files['wm'], '-c', files['csf']]),
+        ('removenonsteady.py', ['-i', files['bold'], '-o', out('trimmed.nii.gz'),
+                                '-t', files['tab'], '-s', out('trimmed.tsv')]),
+        ('addTR.py', ['-i', files['bold'], '-o', out('tr.nii.gz'), '-t', '2.5']),
+        ('surfaceprocessing.py', ['-p', 'sub', '-o', outdir, '-f', files['fd'],
+                                  '-d', files['fd'], '-t', '2', '-c', files['confound'],
+                                  '-g', files['gifti'], '-r', 'DMT-TMP-REG',
+                                  '-l', '0.08', '-s', '0.01', '-x', 'skip']),
+    ]
+
+
+def run_child(script, args):
+    '''
+    run one utility as __main__ in this process and print its wall time
+    and peak resident memory
+    '''
+    sys.path.insert(0, UTILS)
+    sys.argv = [script] + args
+    start = time.time()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        runpy.run_path(op.join(UTILS, script), run_name='__main__')
+    finally:
+        sys.stdout = stdout
+    print('%f %d' % (time.time() - start, peak_kib()))
+
+
+def peak_kib():
+    '''
+    peak resident memory of this process in KiB. On linux this is the
+    high water mark of /proc, which unlike ru_maxrss is reset by exec.
+    '''
+    if op.exists('/proc/self/status'):
+        for line in open('/proc/self/status'):
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def measure(script, args, precision):
+    env = dict(os.environ, XCP_PRECISION=precision)
+    result = subprocess.run([sys.executable, op.abspath(__file__), '--child', script]
+                            + args, env=env, stdout=subprocess.PIPE, check=True,
+                            universal_newlines=True)
+    seconds, peak_kib = result.stdout.split()[-2:]
+    return float(seconds), int(peak_kib) / 1024.
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--child':
+        run_child(sys.argv[2], sys.argv[3:])
+        return
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('-i', '--img', help='reference 4D BOLD series')
+    parser.add_argument('-m', '--mask', help='brain mask of the BOLD series')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help='runs per utility and precision; the fastest is kept')
+    opts = parser.parse_args()
+    if bool(opts.img) != bool(opts.mask):
+        parser.error('give both --img and --mask, or neither')
+
+    workdir = tempfile.mkdtemp()
+    try:
+        files = reference_dataset(workdir, opts.img, opts.mask)
+        print('%-22s %18s %18s %14s' % ('utility', 'float64 s / MiB',
+                                        'float32 s / MiB', 'saved MiB'))
+        for script, args in commands(files, workdir):
+            runs = {}
+            for precision in ('float64', 'float32'):
+                timings = [measure(script, args, precision) for _ in range(opts.repeat)]
+                runs[precision] = (min(t for t, _ in timings), min(m for _, m in timings))
+            print('%-22s %8.2f / %7.0f %8.2f / %7.0f %14.0f'
+                  % ((script,) + runs['float64'] + runs['float32']
+                     + (runs['float64'][1] - runs['float32'][1],)))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import os.path as op
+import shutil
+import sys
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..', '..', 'utils'))
+from addTR import set_tr  # noqa: E402
+
+
+@pytest.mark.parametrize('ext', ['.nii', '.nii.gz'])
+@pytest.mark.parametrize('in_place', [True, False])
+def test_set_tr_keeps_data(tmpdir, ext, in_place):
+    data = np.random.RandomState(0).normal(100, 30, size=(4, 5, 3, 6))
+    img = nib.Nifti1Image(data, np.diag([2., 2., 3., 1.]))
+    img.header.set_zooms((2., 2., 3., 1.))
+    # stored as scaled int16
+    img.set_data_dtype(np.int16)
+    in_file = str(tmpdir.join('bold' + ext))
+    img.to_filename(in_file)
+    out_file = in_file if in_place else str(tmpdir.join('out' + ext))
+    reference = str(tmpdir.join('reference' + ext))
+    shutil.copyfile(in_file, reference)
+
+    assert set_tr(in_file, out_file, '0.72') == out_file
+    before, after = nib.load(reference), nib.load(out_file)
+    assert np.isclose(after.header.get_zooms()[-1], 0.72)
+    assert after.header.get_zooms()[:3] == before.header.get_zooms()[:3]
+    assert after.get_data_dtype() == np.int16
+    assert (after.dataobj.slope, after.dataobj.inter) == (before.dataobj.slope,
+                                                          before.dataobj.inter)
+    assert before.dataobj.slope != 1
+    assert np.array_equal(after.dataobj.get_unscaled(), before.dataobj.get_unscaled())
+    # setting the same TR again leaves the file as it is
+    stamp = op.getmtime(out_file)
+    set_tr(out_file, out_file, '0.72')
+    assert op.getmtime(out_file) == stamp
+
+
+def test_set_tr_intermediate_uncompressed(tmpdir, monkeypatch):
+    import addTR
+    data = np.zeros((16, 16, 16, 4), dtype=np.float32)
+    in_file = str(tmpdir.join('bold.nii.gz'))
+    nib.Nifti1Image(data, np.eye(4)).to_filename(in_file)
+    monkeypatch.setattr(sys, 'argv', ['addTR.py', '-i', in_file, '-o', in_file,
+                                      '-t', '2', '-u'])
+    addTR.main()
+    assert op.getsize(in_file) > data.nbytes
+    assert np.isclose(nib.load(in_file).header.get_zooms()[-1], 2)
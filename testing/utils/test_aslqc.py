@@ -0,0 +1,48 @@
+import os.path as op
+import sys
+
+import nibabel as nb
+import numpy as np
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..', '..', 'utils'))
+import aslqc  # noqa: E402
+
+
+def save(data, filename):
+    nb.Nifti1Image(data.astype(np.float32), np.eye(4)).to_filename(filename)
+    return filename
+
+
+def run(monkeypatch, args):
+    monkeypatch.setattr(sys, 'argv', ['aslqc.py'] + args)
+    aslqc.main()
+
+
+def test_batch_matches_single_runs(monkeypatch, tmpdir):
+    rng = np.random.RandomState(0)
+    shape = (12, 12, 10)
+    gm = rng.uniform(size=shape)
+    wm = (1 - gm) * rng.uniform(size=shape)
+    csf = 1 - gm - wm
+    priors = [save(p, str(tmpdir.join(n + '.nii.gz')))
+              for p, n in zip((gm, wm, csf), ('gm', 'wm', 'csf'))]
+    mask = save(np.ones(shape), str(tmpdir.join('mask.nii.gz')))
+    cbfs = [save(40 * (2.5 * gm + wm) + rng.normal(0, s, shape),
+                 str(tmpdir.join('cbf%d.nii.gz' % i))) for i, s in enumerate((5, 20))]
+    common = ['-m', mask, '-g', priors[0], '-w', priors[1], '-c', priors[2]]
+
+    single = []
+    for i, cbf in enumerate(cbfs):
+        out = str(tmpdir.join('single%d' % i))
+        run(monkeypatch, ['-i', cbf, '-o', out] + common)
+        single.append(out)
+    batch = [str(tmpdir.join('batch%d' % i)) for i in range(len(cbfs))]
+    table = str(tmpdir.join('qei.tsv'))
+    run(monkeypatch, ['-i'] + cbfs + ['-o'] + batch + common + ['-t', table])
+
+    for s, b in zip(single, batch):
+        assert np.loadtxt(s + '_QEI.txt') == np.loadtxt(b + '_QEI.txt')
+        assert np.array_equal(nb.load(s + 'R.nii.gz').get_fdata(),
+                              nb.load(b + 'R.nii.gz').get_fdata())
+    rows = np.genfromtxt(table, names=True, dtype=None, encoding=None)
+    assert np.allclose(rows['QEI'], [np.loadtxt(b + '_QEI.txt') for b in batch], atol=1e-5)
@@ -0,0 +1,98 @@
+import gzip
+import os
+import os.path as op
+import sys
+
+import nibabel as nib
+import numpy as np
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..', '..', 'utils'))
+import imgio  # noqa: E402
+from imgio import (evict_cache, get_data, parse_bytes, save_like, save_nifti,  # noqa: E402
+                   write_aside)
+from interpolate import interpolate_data  # noqa: E402
+
+
+def test_float32_path_matches_float64(tmpdir):
+    rng = np.random.RandomState(0)
+    data = rng.normal(1000, 20, size=(4, 5, 6, 40)).round().astype(np.int16)
+    filename = str(tmpdir.join('bold.nii.gz'))
+    nib.Nifti1Image(data, np.eye(4)).to_filename(filename)
+    img = nib.load(filename)
+    single, double = get_data(img), get_data(img, np.float64)
+    assert single.dtype == np.float32 and double.dtype == np.float64
+    assert np.array_equal(single, data)
+
+    tmask = np.ones(40)
+    tmask[[3, 4, 17, 30]] = 0
+    expected = interpolate_data(double.reshape(-1, 40), tmask, 2.0)
+    result = interpolate_data(single.reshape(-1, 40), tmask, 2.0)
+    assert result.dtype == np.float32
+    assert np.allclose(result, expected, rtol=1e-6)
+
+
+def test_write_aside_keeps_target_on_error(tmpdir):
+    target = tmpdir.join('out.txt')
+    target.write('old')
+    try:
+        with write_aside(str(target)) as scratch:
+            open(scratch, 'w').write('new')
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert target.read() == 'old' and tmpdir.listdir() == [target]
+    with write_aside(str(target)) as scratch:
+        open(scratch, 'w').write('new')
+    assert target.read() == 'new' and tmpdir.listdir() == [target]
+
+
+def test_save_nifti_compression(monkeypatch, tmpdir):
+    data = np.random.RandomState(0).normal(size=(8, 8, 8, 5)).astype(np.float32)
+    img = nib.Nifti1Image(data, np.eye(4))
+    scratch = save_nifti(img, str(tmpdir.join('scratch.nii.gz')), scratch=True)
+    assert scratch.endswith('scratch.nii') and np.array_equal(nib.load(scratch).get_fdata(), data)
+
+    # a stand-in for pigz on the path, to check the streamed output
+    fake = tmpdir.mkdir('bin').join('pigz')
+    fake.write('#!/bin/sh\nexec gzip -c "$1"\n')
+    fake.chmod(0o755)
+    monkeypatch.setenv('PATH', str(fake.dirpath()) + os.pathsep + os.environ['PATH'])
+    for setting in ('0', '1', 'pigz:3'):
+        monkeypatch.setattr(imgio, 'COMPRESSION', setting)
+        out = save_nifti(img, str(tmpdir.join('final%s.nii.gz' % setting[-1])))
+        with gzip.open(out) as fobj:
+            fobj.read()
+        assert np.array_equal(nib.load(out).get_fdata(), data)
+    assert imgio.compression('pigz:3')[1] is not None
+
+
+def test_parse_bytes():
+    assert parse_bytes(4096) == 4096
+    assert parse_bytes('512M') == 512 * 1024**2
+    assert parse_bytes('1.5kb') == 1536
+
+
+def test_evict_cache(tmpdir):
+    for age, name in enumerate(['old.npz', 'new.npz', 'scratch.tmp']):
+        tmpdir.join(name).write('x' * 100)
+        os.utime(str(tmpdir.join(name)), (age, age))
+    evict_cache(str(tmpdir), 150, suffix='.npz')
+    assert sorted(p.basename for p in tmpdir.listdir()) == ['new.npz', 'scratch.tmp']
+
+    cache = tmpdir.mkdir('cache')
+    for age, name in enumerate(['.building', 'old', 'new']):
+        cache.mkdir(name).join('entry').write('x' * 100)
+        os.utime(str(cache.join(name)), (age, age))
+    evict_cache(str(cache), 100)
+    assert sorted(p.basename for p in cache.listdir()) == ['.building', 'new']
+
+
+def test_intermediate_stored_uncompressed(tmpdir):
+    data = np.zeros((16, 16, 16, 4), dtype=np.float32)
+    img = nib.Nifti1Image(data, np.eye(4))
+    stored = save_like(data, img, str(tmpdir.join('stored.nii.gz')), compresslevel=0)
+    final = save_nifti(img, str(tmpdir.join('final.nii.gz')))
+    # the name is kept, the data are not compressed
+    assert stored.endswith('stored.nii.gz')
+    assert op.getsize(stored) > data.nbytes > 10 * op.getsize(final)
+    assert np.array_equal(nib.load(stored).get_fdata(), data)
@@ -0,0 +1,193 @@
+import os
+import os.path as op
+import sys
+import tracemalloc
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..', '..', 'utils'))
+from interpolate import (BinScheduler, cached_lomb_scargle_basis,  # noqa: E402
+                         interpolate_data, interpolate_image_streaming,
+                         lomb_scargle_basis, lomb_scargle_transform,
+                         slab_thickness)
+
+
+def loop_interpolate(data, tmask, t_rep, ofreq=8, hifreq=1):
+    """Single-bin port of the original observation-by-observation loop."""
+    nvol = data.shape[1]
+    t_obs = np.array(np.where(tmask != 0))
+    seen_samples = (t_obs + 1) * t_rep
+    timespan = np.max(seen_samples) - np.min(seen_samples)
+    n_samples_seen = seen_samples.shape[-1]
+    all_samples = np.arange(start=t_rep, stop=t_rep * (nvol + 1), step=t_rep)
+    freqs = np.arange(start=1 / (timespan * ofreq), step=1 / (timespan * ofreq),
+                      stop=(hifreq * n_samples_seen / (2 * timespan) +
+                            1 / (timespan * ofreq)))
+    w = 2 * np.pi * freqs
+    offsets = np.arctan2(np.sum(np.sin(2 * np.outer(w, seen_samples)), 1),
+                         np.sum(np.cos(2 * np.outer(w, seen_samples)), 1)) / (2 * w)
+    cosine_term = np.cos(np.outer(w, seen_samples) - np.outer(w * offsets, np.ones(n_samples_seen)))
+    sine_term = np.sin(np.outer(w, seen_samples) - np.outer(w * offsets, np.ones(n_samples_seen)))
+    voxel_bin = data[:, t_obs.ravel()]
+    mult = np.zeros((w.shape[0], n_samples_seen, voxel_bin.shape[0]))
+    for obs in range(n_samples_seen):
+        mult[:, obs, :] = np.outer(cosine_term[:, obs], voxel_bin[:, obs])
+    c = (np.sum(mult, 1).T / np.sum(cosine_term**2, 1)).T
+    for obs in range(n_samples_seen):
+        mult[:, obs, :] = np.outer(sine_term[:, obs], voxel_bin[:, obs])
+    s = (np.sum(mult, 1).T / np.sum(sine_term**2, 1)).T
+    s_recon = np.zeros((nvol, voxel_bin.shape[0]))
+    c_recon = np.zeros((nvol, voxel_bin.shape[0]))
+    for i in range(w.shape[0]):
+        s_recon += np.outer(np.sin(w[i] * all_samples), s[i, :])
+        c_recon += np.outer(np.cos(w[i] * all_samples), c[i, :])
+    recon = (c_recon + s_recon).T
+    norm_fac = np.std(recon, 1, ddof=1) / np.std(voxel_bin, 1, ddof=1)
+    recon = (recon.T / norm_fac).T
+    out = data.copy()
+    out[np.ix_(np.arange(data.shape[0]), t_obs.ravel())] = recon[:, t_obs.ravel()]
+    return out
+
+
+@pytest.fixture
+def series():
+    rng = np.random.RandomState(0)
+    data = rng.normal(100, 5, size=(37, 48))
+    tmask = np.ones(48)
+    tmask[[4, 5, 6, 20, 31, 32, 45]] = 0
+    return data, tmask
+
+
+def test_matches_loop_implementation(series):
+    data, tmask = series
+    expected = loop_interpolate(data, tmask, 2.0)
+    result = interpolate_data(data.copy(), tmask, 2.0, voxbin=10)
+    assert np.allclose(result, expected, rtol=1e-10, atol=1e-10)
+
+
+def test_rejects_uncensored_mask(series):
+    data, tmask = series
+    with pytest.raises(ValueError):
+        lomb_scargle_basis(np.ones_like(tmask), 2.0)
+
+
+def test_streaming_matches_in_memory(series, tmp_path):
+    data, tmask = series
+    img = nib.Nifti1Image(data.reshape(37, 1, 1, 48).repeat(3, axis=2), np.eye(4))
+    logmask = np.ones(img.shape[:3], dtype=bool)
+    logmask[:5, 0, 1] = False
+    out_file = str(tmp_path / 'interpolated.nii.gz')
+    interpolate_image_streaming(img, logmask, tmask, 2.0, out_file,
+                                mem_budget=600 * 1024)
+    expected = np.zeros(img.shape)
+    expected[logmask] = interpolate_data(img.get_fdata()[logmask], tmask, 2.0)
+    result = nib.load(out_file).get_fdata()
+    assert np.allclose(result, expected, rtol=1e-5, atol=1e-3)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['interpolated.nii.gz']
+
+
+def test_streaming_peak_within_budget(series, tmp_path):
+    _, tmask = series
+    # the float64 image is cast slab by slab, so that every slab is allocated
+    data = np.random.RandomState(1).normal(100, 5, size=(20, 20, 12, 48))
+    img = nib.Nifti1Image(data, np.eye(4))
+    mem_budget = 7700000
+    _, fit_basis, recon_basis = lomb_scargle_basis(tmask, 2.0)
+    assert 1 < slab_thickness(img.shape, fit_basis, recon_basis, mem_budget,
+                              np.float32) < img.shape[2]
+    tracemalloc.start()
+    try:
+        interpolate_image_streaming(img, np.ones(img.shape[:3], dtype=bool), tmask,
+                                    2.0, str(tmp_path / 'interpolated.nii.gz'),
+                                    mem_budget=mem_budget, dtype=np.float32)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak <= mem_budget
+
+
+def test_parallel_matches_serial(series):
+    data, tmask = series
+    expected = interpolate_data(data.copy(), tmask, 2.0, voxbin=10)
+    result = interpolate_data(data.copy(), tmask, 2.0, voxbin=10, nprocs=2)
+    assert np.allclose(result, expected, rtol=1e-12, atol=1e-12)
+
+
+def test_parallel_streaming_within_budget(series, tmp_path):
+    _, tmask = series
+    data = np.random.RandomState(1).normal(100, 5, size=(20, 20, 12, 48))
+    img = nib.Nifti1Image(data, np.eye(4))
+    mem_budget = 8300000
+    seen, fit_basis, recon_basis = lomb_scargle_basis(tmask, 2.0)
+    nslices = slab_thickness(img.shape, fit_basis, recon_basis, mem_budget,
+                             np.float32, nprocs=2)
+    assert nslices < slab_thickness(img.shape, fit_basis, recon_basis,
+                                    mem_budget, np.float32)
+    slab_voxels = 20 * 20 * nslices
+    # what the workers allocate between them: the transform of a full slab
+    slab = data.reshape(-1, 48)[:slab_voxels].astype(np.float32)
+    tracemalloc.start()
+    try:
+        lomb_scargle_transform(slab, seen, fit_basis, recon_basis)
+        workers = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # the shared memory of the scheduler, outside the traced heap
+    shared = slab_voxels * 48 * 4 + fit_basis.nbytes + recon_basis.nbytes
+    tracemalloc.start()
+    try:
+        interpolate_image_streaming(img, np.ones(img.shape[:3], dtype=bool), tmask,
+                                    2.0, str(tmp_path / 'interpolated.nii.gz'),
+                                    mem_budget=mem_budget, nprocs=2, dtype=np.float32)
+        parent = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert parent + shared + workers <= mem_budget
+
+
+def test_streaming_gzipped_input(series, tmp_path):
+    data, tmask = series
+    in_file = str(tmp_path / 'bold.nii.gz')
+    nib.Nifti1Image(data.reshape(37, 1, 1, 48).repeat(3, axis=2).astype(np.float32),
+                    np.eye(4)).to_filename(in_file)
+    img = nib.load(in_file)
+    out_dir = tmp_path / 'out'
+    out_dir.mkdir()
+    out_file = str(out_dir / 'interpolated.nii.gz')
+    interpolate_image_streaming(img, np.ones(img.shape[:3], dtype=bool), tmask, 2.0,
+                                out_file, mem_budget=600 * 1024)
+    expected = interpolate_data(img.get_fdata().reshape(-1, 48), tmask, 2.0)
+    result = nib.load(out_file).get_fdata().reshape(-1, 48)
+    assert np.allclose(result, expected, rtol=1e-5, atol=1e-3)
+    # the decompressed scratch copy is gone
+    assert [p.name for p in out_dir.iterdir()] == ['interpolated.nii.gz']
+
+
+def test_workers_use_one_blas_thread(series):
+    data, tmask = series
+    seen, fit_basis, recon_basis = lomb_scargle_basis(tmask, 2.0)
+    scheduler = BinScheduler(seen, fit_basis, recon_basis, data.shape[0], 2)
+    try:
+        assert scheduler.pool.apply(os.getenv, ('OPENBLAS_NUM_THREADS',)) == '1'
+        threadpoolctl = pytest.importorskip('threadpoolctl')
+        info = scheduler.pool.apply(threadpoolctl.threadpool_info)
+        assert all(pool['num_threads'] == 1 for pool in info)
+    finally:
+        scheduler.close()
+
+
+def test_basis_cache_hit_and_eviction(series, tmp_path):
+    _, tmask = series
+    built = lomb_scargle_basis(tmask, 2.0)
+    first = cached_lomb_scargle_basis(tmask, 2.0, cache_dir=str(tmp_path))
+    second = cached_lomb_scargle_basis(tmask, 2.0, cache_dir=str(tmp_path))
+    for a, b, c in zip(built, first, second):
+        assert np.array_equal(a, b) and np.array_equal(a, c)
+    assert len(list(tmp_path.iterdir())) == 1
+
+    entry_size = next(tmp_path.iterdir()).stat().st_size
+    cached_lomb_scargle_basis(tmask, 3.0, cache_dir=str(tmp_path),
+                              cache_size=entry_size + 1)
+    assert len(list(tmp_path.iterdir())) == 1
@@ -0,0 +1,55 @@
+import os.path as op
+import sys
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..', '..', 'utils'))
+from removenonsteady import nonsteady_volumes, trim_volumes  # noqa: E402
+
+
+def test_nonsteady_volumes():
+    tab = pd.DataFrame({'non_steady_state_outlier00': [1, 0, 0, 0, 0],
+                        'non_steady_state_outlier01': [0, 1, 0, 0, 0],
+                        'csf': [.1, .2, .3, .4, .5]})
+    assert list(nonsteady_volumes(tab)) == [0, 1]
+    assert list(nonsteady_volumes(tab[['csf']])) == []
+
+
+@pytest.mark.parametrize('ext', ['.nii', '.nii.gz'])
+def test_trim_volumes_keeps_stored_data(tmpdir, ext):
+    data = np.random.RandomState(0).normal(100, 30, size=(4, 5, 3, 8))
+    img = nib.Nifti1Image(data, np.diag([2., 2., 3., 1.]))
+    img.header.set_zooms((2., 2., 3., 0.8))
+    # stored as scaled int16
+    img.set_data_dtype(np.int16)
+    in_file = str(tmpdir.join('bold' + ext))
+    img.to_filename(in_file)
+    out_file = str(tmpdir.join('trimmed' + ext))
+
+    trim_volumes(in_file, out_file, [0, 1])
+    before, after = nib.load(in_file), nib.load(out_file)
+    assert after.shape == (4, 5, 3, 6)
+    assert after.get_data_dtype() == np.int16
+    assert after.header.get_zooms() == before.header.get_zooms()
+    assert (after.dataobj.slope, after.dataobj.inter) == (before.dataobj.slope,
+                                                          before.dataobj.inter)
+    # exactly the first two volumes are gone, the last one is kept
+    assert np.array_equal(after.dataobj.get_unscaled(),
+                          before.dataobj.get_unscaled()[..., 2:])
+
+    trim_volumes(in_file, in_file, [])
+    assert np.array_equal(nib.load(in_file).get_fdata(), before.get_fdata())
+
+
+def test_trim_volumes_single_volume(tmpdir):
+    data = np.random.RandomState(1).normal(size=(4, 5, 3)).astype(np.float32)
+    in_file = str(tmpdir.join('bold.nii.gz'))
+    nib.Nifti1Image(data, np.eye(4)).to_filename(in_file)
+    out_file = str(tmpdir.join('trimmed.nii.gz'))
+    trim_volumes(in_file, out_file, [])
+    assert np.array_equal(nib.load(out_file).get_fdata(), data)
+    with pytest.raises(ValueError):
+        trim_volumes(in_file, out_file, [0])
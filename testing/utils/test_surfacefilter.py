@@ -0,0 +1,184 @@
+import os.path as op
+import sys
+
+import numpy as np
+import pytest
+from scipy.signal import butter, filtfilt
+
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..', '..', 'utils'))
+from surfacefilter import (butter_bandpass, compute_dvars, demean_detrend_data,  # noqa: E402
+                           confound_basis, fused_filt_reg, linear_regression,
+                           surface_filt_reg, write_gifti_cifti)
+
+
+def loop_demean_detrend(data, TR, order=1):
+    """Vertex-by-vertex port of the original demean_detrend_data."""
+    if np.mean(data) > 0.00000000001:
+        demeand = data - np.outer(np.mean(data, axis=1), np.ones(data.shape[1]))
+    else:
+        demeand = data
+    x = np.linspace(0, (data.shape[1] - 1) * TR, num=data.shape[1])
+    predicted = np.zeros_like(demeand)
+    for j in range(demeand.shape[0]):
+        predicted[j, :] = np.polyval(np.polyfit(x, demeand[j, :], order), x)
+    return demeand - predicted
+
+
+def loop_bandpass(data, fs, lowpass, highpass, order=2):
+    """Vertex-by-vertex port of the original butter_bandpass."""
+    nyq = 0.5 * fs
+    b, a = butter(order, [float(highpass) / nyq, float(lowpass) / nyq], btype='band')
+    y = np.zeros_like(data)
+    for i in range(data.shape[0]):
+        y[i, :] = filtfilt(b, a, data[i, :])
+    return y + np.outer(np.mean(data, axis=1), np.ones(data.shape[1]))
+
+
+def lstsq_residuals(data, confound):
+    """Residuals of data on an intercept and the confounds by least squares."""
+    design = np.column_stack((np.ones(data.shape[1]), confound.T))
+    beta = np.linalg.lstsq(design, data.T, rcond=None)[0]
+    return data - np.dot(design, beta).T
+
+
+@pytest.fixture
+def surface_data():
+    rng = np.random.RandomState(42)
+    trend = np.linspace(0, 3, 120)
+    return 1000 + rng.normal(0, 10, size=(200, 120)) + trend
+
+
+@pytest.mark.parametrize('order', [1, 2])
+def test_demean_detrend_matches_loop(surface_data, order):
+    expected = loop_demean_detrend(surface_data, TR=2.0, order=order)
+    result = demean_detrend_data(surface_data, TR=2.0, order=order)
+    assert np.allclose(result, expected, rtol=1e-10, atol=1e-8)
+
+
+def test_bandpass_matches_loop(surface_data):
+    expected = loop_bandpass(surface_data, fs=0.5, lowpass='0.08', highpass='0.01')
+    result = butter_bandpass(surface_data, fs=0.5, lowpass='0.08', highpass='0.01')
+    assert np.allclose(result, expected, rtol=1e-10, atol=1e-8)
+
+
+@pytest.mark.parametrize('process_order', [['DMT', 'TMP', 'REG'], ['DMT', 'REG', 'TMP']])
+def test_fused_pipeline_matches_staged(surface_data, process_order):
+    rng = np.random.RandomState(0)
+    confound = rng.normal(size=(6, surface_data.shape[1]))
+    dd_data = loop_demean_detrend(surface_data, TR=2.0)
+    dd_confound = loop_demean_detrend(confound, TR=2.0)
+    if process_order[1] == 'TMP':
+        filtered = loop_bandpass(dd_data, 0.5, 0.08, 0.01)
+        filtered_confound = loop_bandpass(dd_confound, 0.5, 0.08, 0.01)
+        expected = lstsq_residuals(filtered, filtered_confound)
+    else:
+        expected = loop_bandpass(lstsq_residuals(dd_data, dd_confound), 0.5, 0.08, 0.01)
+
+    data = surface_data.astype(np.float32)
+    fused_filt_reg(data, confound, tr=2.0, lowpass=0.08, highpass=0.01,
+                   process_order=process_order)
+    assert data.dtype == np.float32
+    assert np.allclose(data, expected, atol=1e-5 * np.abs(expected).max())
+
+
+def test_fused_pipeline_designs_filter_once(surface_data, monkeypatch):
+    import surfacefilter
+    calls = []
+    monkeypatch.setattr(surfacefilter, 'butter',
+                        lambda *args, **kwargs: calls.append(args) or butter(*args, **kwargs))
+    confound = np.random.RandomState(0).normal(size=(6, surface_data.shape[1]))
+    fused_filt_reg(surface_data.copy(), confound, tr=2.0, lowpass=0.08, highpass=0.01,
+                   process_order=['DMT', 'TMP', 'REG'])
+    assert len(calls) == 1
+
+
+def test_chunked_dvars_matches_full(surface_data):
+    datax = np.hstack((np.zeros((surface_data.shape[0], 1)), np.diff(surface_data)))
+    expected = np.sqrt(np.sum(np.square(datax), axis=0) / surface_data.shape[0])
+    assert np.allclose(compute_dvars(surface_data, chunk=7), expected)
+
+
+def test_projection_regression_matches_least_squares(surface_data):
+    rng = np.random.RandomState(1)
+    confound = rng.normal(size=(5, surface_data.shape[1]))
+    # a duplicated regressor makes the design rank deficient
+    confound = np.vstack((confound, confound[:1]))
+    expected = lstsq_residuals(surface_data, confound)
+    assert np.allclose(linear_regression(surface_data, confound), expected, atol=1e-8)
+
+
+def test_confound_basis_cache(surface_data):
+    confound = np.random.RandomState(2).normal(size=(4, surface_data.shape[1]))
+    first = confound_basis(confound, cache=True)
+    assert confound_basis(confound.copy(), cache=True) is first
+    assert confound_basis(confound) is not first
+
+
+def save_gifti(data, filename):
+    import nibabel as nb
+    from nibabel.gifti import GiftiDataArray, GiftiImage
+    image = GiftiImage(darrays=[GiftiDataArray(col, intent='NIFTI_INTENT_TIME_SERIES')
+                                for col in data.T])
+    image.meta['AnatomicalStructurePrimary'] = 'CortexLeft'
+    nb.save(image, filename)
+    return filename
+
+
+@pytest.mark.parametrize('encoding', ['GIFTI_ENCODING_B64GZ', 'GIFTI_ENCODING_B64BIN',
+                                      'GIFTI_ENCODING_EXTBIN'])
+def test_gifti_writer_round_trip(surface_data, encoding, tmpdir):
+    import nibabel as nb
+    data = surface_data[:300, :20].astype(np.float32)
+    template_file = save_gifti(data, str(tmpdir.join('template.L_bold.func.gii')))
+    out_file = str(tmpdir.join('out.func.gii'))
+    write_gifti_cifti(2 * data, template_file, out_file, encoding=encoding, sidecar=True)
+    written = nb.load(out_file)
+    assert np.array_equal(np.column_stack([d.data for d in written.darrays]), 2 * data)
+    assert written.meta['AnatomicalStructurePrimary'] == 'CortexLeft'
+    assert np.array_equal(np.load(out_file + '.npy', mmap_mode='r'), 2 * data)
+
+
+def test_deferred_qc_figures(surface_data, tmpdir):
+    data = (surface_data[:500] + 100).astype(np.float32)
+    datafile = save_gifti(data, str(tmpdir.join('sub_hemi-L_bold.func.gii')))
+    ntp = data.shape[1]
+    fd = np.linspace(0, 1, ntp)
+    confound = np.random.RandomState(3).normal(size=(3, ntp))
+    pre_svg, post_svg = str(tmpdir.join('pre.svg')), str(tmpdir.join('post.svg'))
+    qc_file = str(tmpdir.join('qc.npz'))
+    surface_filt_reg(datafile=datafile, confound=confound, lowpass=0.08, highpass=0.01,
+                     outfilename=str(tmpdir.join('out.func.gii')), pre_svg=pre_svg,
+                     post_svg=post_svg, fd=fd, tr=2, dvars=fd,
+                     process_order=['DMT', 'TMP', 'REG'], qc_file=qc_file, render=False)
+    assert not op.exists(pre_svg) and not op.exists(post_svg)
+    with np.load(qc_file) as qc:
+        assert qc['pre_carpet'].dtype == np.float32
+        assert qc['pre_carpet'].shape == qc['post_carpet'].shape
+        assert np.allclose(qc['pre_dvars'], compute_dvars(data), rtol=1e-5)
+        assert np.allclose(qc['fd'], fd)
+        assert str(qc['post_svg']) == post_svg
+
+
+def test_surfaceprocessing_filter_order(surface_data, tmpdir, monkeypatch):
+    import nibabel as nb
+    import surfaceprocessing
+    data = surface_data[:50]
+    confound = np.random.RandomState(3).normal(size=(6, data.shape[1]))
+    gifti = save_gifti(data.astype(np.float32), str(tmpdir.join('sub_L_bold.func.gii')))
+    np.savetxt(str(tmpdir.join('confound.1D')), confound.T)
+    np.savetxt(str(tmpdir.join('fd.1D')), np.zeros(data.shape[1]))
+    monkeypatch.setattr(sys, 'argv', [
+        'surfaceprocessing.py', '-p', 'sub', '-o', str(tmpdir), '-g', gifti,
+        '-f', str(tmpdir.join('fd.1D')), '-d', str(tmpdir.join('fd.1D')),
+        '-c', str(tmpdir.join('confound.1D')), '-t', '2', '-y', '4',
+        '-r', 'DMT-TMP-REG', '-l', '0.08', '-s', '0.01', '-x', 'skip', '-n', '1'])
+    surfaceprocessing.main()
+
+    # data and confounds filtered at order 4, then regressed
+    filtered = loop_bandpass(loop_demean_detrend(data, TR=2.0), 0.5, 0.08, 0.01, order=4)
+    filtered_confound = loop_bandpass(loop_demean_detrend(confound, TR=2.0),
+                                      0.5, 0.08, 0.01, order=4)
+    expected = lstsq_residuals(filtered, filtered_confound)
+    written = nb.load(str(tmpdir.join('sub_residualized_hemi-L_bold.func.gii')))
+    result = np.column_stack([d.data for d in written.darrays])
+    assert np.allclose(result, expected, atol=1e-4 * np.abs(expected).max())
@@ -0,0 +1,18 @@
+import os.path as op
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip('nilearn')
+pytest.importorskip('seaborn')
+sys.path.insert(0, op.join(op.dirname(op.abspath(__file__)), '..', '..', 'utils'))
+from surfaceplot import plot_carpet  # noqa: E402
+
+
+def test_plot_carpet_decimates(tmpdir):
+    data = np.random.RandomState(0).normal(100, 5, size=(2000, 60))
+    out_file = str(tmpdir.join('carpet.svg'))
+    # without t_dec the carpet is decimated here
+    assert plot_carpet(data, tr=2.0, output_file=out_file) == out_file
+    assert op.getsize(out_file) > 0
@@ -3,8 +3,10 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 from argparse import (ArgumentParser, RawTextHelpFormatter)
-import numpy as np
+import os
+import shutil
 import nibabel as nib
+from imgio import open_image, save_nifti, write_aside
 
 def get_parser():
 
@@ -23,27 +25,66 @@ def get_parser():
     parser.add_argument(
         '-t', '--trep', action='store', required=True,
         help='[required]'
-             '\nTemporal mask indicating whether each volume is seen or '
-             '\nunseen. For instance, 1 could indicate that a volume '
-             '\nshould be retained, while 0 would indicate that the '
-             '\nvolume should be censored.')
+             '\nRepetition time to write into the header. Only the header'
+             '\nis rewritten; the data keep their type and scaling.')
+    parser.add_argument(
+        '-u', '--uncompressed', action='store_true', default=False,
+        help='the output is an intermediate read back by the next step:'
+             '\nstore it uncompressed (gzip level 0) under its .nii.gz name'
+             '\n[default: compressed as XCP_COMPRESSION says]')
 
     return parser
 
 
-opts            =   get_parser().parse_args()
+def set_tr(in_file, out_file, t_rep, compresslevel=None, blocksize=16*1024**2):
+    '''
+    Write in_file to out_file with its TR (the last zoom, pixdim[4]) set
+    to t_rep. Only the header changes: the data bytes, their type and
+    scaling are copied as they are. An uncompressed file patched in place
+    only has its header rewritten; otherwise the data are streamed,
+    blocksize bytes at a time, behind the new header, and compressed as
+    XCP_COMPRESSION says unless compresslevel is given.
+    Returns out_file.
+    '''
+    img             =   nib.load(in_file)
+    same_file       =   os.path.exists(out_file) and os.path.samefile(in_file, out_file)
+
+    if not isinstance(img.header, nib.Nifti1Header) or img.file_map['image'].filename != in_file:
+        # not a single file nifti: save it again, keeping the data type
+        header      =   img.header.copy()
+        header.set_zooms(tuple(header.get_zooms()[:-1]) + (float(t_rep),))
+        img1        =   img.__class__(img.dataobj, img.affine, header)
+        return save_nifti(img1, out_file, compresslevel=compresslevel)
+
+    # the header as stored, scaling included (nib.load moves it to dataobj)
+    with open_image(in_file, 'rb') as fobj:
+        stored      =   img.header_class.from_fileobj(fobj)
+    header          =   stored.copy()
+    zooms           =   list(header.get_zooms())
+    zooms[-1]       =   float(t_rep)
+    header.set_zooms(tuple(zooms))
+    hdr_bytes       =   header.binaryblock
+    if same_file and hdr_bytes == stored.binaryblock:
+        return out_file
+    if same_file and not in_file.endswith('.gz'):
+        with open(out_file, 'r+b') as fobj:
+            fobj.write(hdr_bytes)
+        return out_file
+
+    # write aside and rename, so that in_file may be out_file
+    with write_aside(out_file, like=in_file) as scratch:
+        with open_image(in_file, 'rb') as src, open_image(scratch, 'wb', compresslevel) as dst:
+            src.read(len(hdr_bytes))
+            dst.write(hdr_bytes)
+            shutil.copyfileobj(src, dst, blocksize)
+    return out_file
 
-t_rep=np.asarray(opts.trep, dtype='float64')
 
-# Get zooms to ensure correct TR
-img             =   nib.load(opts.img)
-header = img.header.copy()
-zooms = np.array(header.get_zooms())
-zomms=list(zooms)
-zooms[-1] = float(opts.trep)
-header.set_zooms(tuple(zooms))
+def main():
+    opts            =   get_parser().parse_args()
+    set_tr(opts.img, opts.out, opts.trep,
+           compresslevel=0 if opts.uncompressed else None)
 
-img_data=img.get_fdata()
-img1       =   nib.Nifti1Image(dataobj=img_data,affine=img.affine,header=header)
-nib.save(img1, opts.out)
 
+if __name__ == '__main__':
+    main()
@@ -8,10 +8,10 @@ import numpy as np
 import pandas as pd 	
 import os as os 	
 import sys as sys	
-import seaborn as sns	
 from nibabel.processing import smooth_image	
 from scipy.stats import gmean	
 from argparse import (ArgumentParser, RawTextHelpFormatter)
+from imgio import ACCUMULATE, get_data, load_data, load_mask, save_nifti
 
 def get_parser():
 
@@ -19,13 +19,15 @@ def get_parser():
         formatter_class=RawTextHelpFormatter,
         description='ASL QC from Dolui et al and other ')
     parser.add_argument(
-        '-i', '--img', action='store', required=True,
+        '-i', '--img', action='store', required=True, nargs='+',
         help='[required]'
-             '\nPath to the 3D or 4D CBF timeseries.')
+             '\nPath to the 3D or 4D CBF timeseries. Several CBF maps'
+             '\nof one subject can be given; the tissue maps and mask'
+             '\nare then read once for all of them.')
     parser.add_argument(
-        '-o', '--out', action='store', required=True,
+        '-o', '--out', action='store', required=True, nargs='+',
         help='[required]'
-             '\n Output path.')
+             '\n Output path, one per CBF map.')
     parser.add_argument(
         '-g', '--gm', action='store', required=False,
         help='grey matter')
@@ -38,19 +40,14 @@ def get_parser():
     parser.add_argument(
         '-m', '--mask', action='store',required=True,
         help='cbf mask')
+    parser.add_argument(
+        '-t', '--table', action='store',required=False,
+        help='also write the QEI and its components of all CBF maps'
+             '\nto this tab separated table')
   
     
     return parser
 
-opts            =   get_parser().parse_args()
-
-gm=opts.gm
-wm=opts.wm
-mask=opts.mask
-out=opts.out
-img=opts.img
-csf=opts.csf
-
 def fun1(x,xdata):
     d1=np.exp(-(x[0])*np.power(xdata,x[1]))
     return(d1)
@@ -63,60 +60,95 @@ x1 = [0.054,0.9272]
 x2 = [2.8478,0.5196]
 x4 = [3.0126, 2.4419]
 
-img1=nib.load(img)
-img_data=img1.get_fdata()
-mas=nib.load(mask).get_fdata()
-logmask         =   np.isclose(mas, 1)
-imgts=img_data[logmask]
-#check if the image is 3D or 4D 
 
+def load_priors(gm,wm,csf):
+    '''
+    read the tissue probability maps once and derive what the QEI of
+    every CBF map needs: the pseudo CBF and the tissue masks
+    '''
+    gm0=load_data(gm)[1]; 
+    if len(gm0.shape)==4:
+       gmm=gm0[...,-1]
+       wm0=load_data(wm)[1]; wmm=wm0[...,-1]
+       cm0=load_data(csf)[1]; ccf=cm0[...,-1]
+    else:
+       gmm=gm0; wmm=load_data(wm)[1]; ccf=load_data(csf)[1]
 
+    priors={}
+    priors['pbcf']=2.5*gmm+wmm
+    priors['gm1']=np.array(gmm>0.8)
+    priors['wm1']=np.array(wmm>0.8)
+    priors['cc1']=np.array(ccf>0.8)
+    return priors
 
-# compute relative cbf 
 
-cbf=img1.get_fdata()
-cbf1=cbf[logmask]/np.mean(cbf[logmask])
-img2=np.zeros(shape=[img1.shape[0],img1.shape[1],img1.shape[2]])
-img2[logmask]=cbf1
-img_rel        =   nib.Nifti1Image(dataobj=img2,
+def relative_cbf(img1,cbf,logmask,out):
+    '''
+    write the CBF map relative to its mean within the mask to out+'R.nii.gz'
+    '''
+    cbf1=cbf[logmask]/np.mean(cbf[logmask],dtype=ACCUMULATE)
+    img2=np.zeros(shape=[img1.shape[0],img1.shape[1],img1.shape[2]],dtype=cbf.dtype)
+    img2[logmask]=cbf1
+    img_rel        =   nib.Nifti1Image(dataobj=img2,
                                                 affine=img1.affine,
                                                 header=img1.header)
-out3=out+'R.nii.gz'                                            
-nib.save(img_rel,out3)
-    
+    out3=out+'R.nii.gz'                                            
+    return save_nifti(img_rel,out3)
 
-if gm and wm and csf:
-   img_3        =   nib.Nifti1Image(dataobj=cbf,
+
+def compute_qei(img1,cbf,priors):
+    '''
+    quality evaluation index of a CBF map (Dolui et al.) and its
+    components: CV (pooled tissue variance over mean GM CBF), negGM
+    (fraction of negative GM voxels) and r (spatial correlation with the
+    pseudo CBF)
+    '''
+    pbcf=priors['pbcf']; gm1=priors['gm1']; wm1=priors['wm1']; cc1=priors['cc1']
+    img_3        =   nib.Nifti1Image(dataobj=cbf,
                                                 affine=img1.affine,
                                                 header=img1.header)
-   scbf=smooth_image(img_3,fwhm=5)
-   cbf=scbf.get_fdata() 
-   out3=out+'_QEI.txt'
-   
-   gm0=nib.load(gm).get_fdata(); 
-   if len(gm0.shape)==4:
-      gmm=gm0[...,-1]
-      wm0=nib.load(wm).get_fdata(); wmm=wm0[...,-1]
-      cm0=nib.load(csf).get_fdata(); ccf=cm0[...,-1]
-   else:
-      gmm=gm0; wmm=nib.load(wm).get_fdata(); ccf=nib.load(csf).get_fdata()
-  
+    scbf=smooth_image(img_3,fwhm=5)
+    cbf=get_data(scbf,cbf.dtype) 
 
-   pbcf=2.5*gmm+wmm
-   msk=np.array((cbf!= 0)&(cbf != np.nan )&(pbcf != np.nan )).astype(int)
+    msk=np.array((cbf!= 0)&(cbf != np.nan )&(pbcf != np.nan )).astype(int)
 
-   gm1=np.array(gmm>0.8)
-   wm1=np.array(wmm>0.8)
-   cc1=np.array(ccf>0.8)
-   r1=np.array([0,np.corrcoef(cbf[msk==1],pbcf[msk==1])[1,0]]).max()
+    r1=np.array([0,np.corrcoef(cbf[msk==1],pbcf[msk==1])[1,0]]).max()
    
-   V=((np.sum(gm1)-1)*np.var(cbf[gm1>0])+(np.sum(wm1)-1)*np.var(cbf[wm1>0])+(np.sum(cc1)-1)*np.var(cbf[cc1>0])) \
+    V=((np.sum(gm1)-1)*np.var(cbf[gm1>0],dtype=ACCUMULATE)+(np.sum(wm1)-1)*np.var(cbf[wm1>0],dtype=ACCUMULATE)
+       +(np.sum(cc1)-1)*np.var(cbf[cc1>0],dtype=ACCUMULATE)) \
          /(np.sum(gm1>0)+np.sum(wm1>0)+np.sum(cc1>0)-3)
     
-   negGM=np.sum(cbf[gm1]<0)/(np.sum(gm1))
-   GMCBF=np.mean(cbf[gm1])
-   CV=V/np.abs(GMCBF)
-   Q = [fun1(x1,CV),fun1(x2,negGM),fun2(x4,r1)]
-   np.savetxt(out3,[gmean(Q)],delimiter='\t',fmt="%5.5f")
+    negGM=np.sum(cbf[gm1]<0)/(np.sum(gm1))
+    GMCBF=np.mean(cbf[gm1],dtype=ACCUMULATE)
+    CV=V/np.abs(GMCBF)
+    Q = [fun1(x1,CV),fun1(x2,negGM),fun2(x4,r1)]
+    return {'QEI':gmean(Q),'CV':CV,'negGM':negGM,'r':r1}
+
+
+def main():
+    opts            =   get_parser().parse_args()
+    if len(opts.img) != len(opts.out):
+        sys.exit('give one output path per CBF map')
+
+    logmask         =   load_mask(opts.mask)
+    priors=None
+    if opts.gm and opts.wm and opts.csf:
+        priors=load_priors(opts.gm,opts.wm,opts.csf)
+
+    rows=[]
+    for img,out in zip(opts.img,opts.out):
+        img1,cbf=load_data(img)
+        # compute relative cbf 
+        relative_cbf(img1,cbf,logmask,out)
+        if priors is not None:
+            qei=compute_qei(img1,cbf,priors)
+            np.savetxt(out+'_QEI.txt',[qei['QEI']],delimiter='\t',fmt="%5.5f")
+            rows.append(dict(cbf=img,**qei))
+
+    if opts.table and rows:
+        pd.DataFrame(rows,columns=['cbf','QEI','CV','negGM','r']).to_csv(
+            opts.table,sep='\t',index=False,float_format='%.5f')
+
 
- 
\ No newline at end of file
+if __name__ == '__main__':
+    main()
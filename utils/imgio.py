@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+''' image input and output shared by the python utilities '''
+
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+import nibabel as nib
+
+# working precision of the image data, float32 unless XCP_PRECISION
+# (float32 or float64) says otherwise; sums, means, variances and
+# least squares fits accumulate in ACCUMULATE whatever the precision
+PRECISION = os.environ.get('XCP_PRECISION', 'float32')
+ACCUMULATE = np.float64
+
+# how final .nii.gz outputs are compressed, from XCP_COMPRESSION: a gzip
+# level, 0 to 9, or pigz[:level] for a parallel gzip on every cpu; scratch
+# intermediates are always written uncompressed, see save_nifti
+COMPRESSION = os.environ.get('XCP_COMPRESSION', '1')
+
+
+def working_dtype(dtype=None):
+    '''
+    the floating point type images are read into: dtype if given,
+    otherwise PRECISION
+    '''
+    dtype = np.dtype(PRECISION if dtype is None else dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError('the working precision is float32 or float64, not '
+                         + str(dtype))
+    return dtype
+
+
+def get_data(img, dtype=None):
+    '''
+    the scaled data of a loaded image in the working precision; unlike
+    get_fdata() the float64 array is never made for float32
+    '''
+    return img.get_fdata(caching='unchanged', dtype=working_dtype(dtype))
+
+
+def load_data(filename, dtype=None):
+    '''
+    load an image and return it with its data in the working precision
+    '''
+    img = nib.load(filename)
+    return img, get_data(img, dtype)
+
+
+def load_mask(filename, value=1):
+    '''
+    boolean mask of the voxels of filename equal to value
+    '''
+    return np.isclose(load_data(filename)[1], value)
+
+
+def save_like(data, img, filename, compresslevel=None):
+    '''
+    save data with the affine and header of img; the header decides the
+    data type on disk, as for nib.save
+    '''
+    return save_nifti(img.__class__(data, img.affine, img.header), filename,
+                      compresslevel=compresslevel)
+
+
+def compression(setting=None):
+    '''
+    gzip level and pigz threads (None for python's gzip) of a
+    compression setting [default: COMPRESSION]. pigz falls back to
+    python's gzip at the same level if it is not installed.
+    '''
+    setting = str(COMPRESSION if setting is None else setting).strip().lower()
+    name, _, level = setting.partition(':')
+    if name == 'pigz':
+        level = int(level or 6)
+        threads = os.cpu_count() if shutil.which('pigz') else None
+    else:
+        level, threads = int(name), None
+    if not 0 <= level <= 9:
+        raise ValueError('XCP_COMPRESSION is a gzip level 0-9 or pigz[:level], not '
+                         + setting)
+    return level, threads
+
+
+class PigzFile(io.RawIOBase):
+    '''
+    write only file object compressing through a pigz process; like a
+    gzip file in write mode it can only seek forward, writing zeros
+    '''
+
+    def __init__(self, filename, level, threads):
+        super(PigzFile, self).__init__()
+        self._out = open(filename, 'wb')
+        self._proc = subprocess.Popen(['pigz', '-%d' % level, '-p', str(threads), '-c'],
+                                      stdin=subprocess.PIPE, stdout=self._out)
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._proc.stdin.write(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        if whence == 2 or offset < self._pos:
+            raise io.UnsupportedOperation('pigz streams only seek forward')
+        self.write(b'\0' * (offset - self._pos))
+        return self._pos
+
+    def close(self):
+        if self.closed:
+            return
+        super(PigzFile, self).close()
+        self._proc.stdin.close()
+        status = self._proc.wait()
+        self._out.close()
+        if status:
+            raise IOError('pigz exited with status %d' % status)
+
+
+def open_image(filename, mode, compresslevel=None):
+    '''
+    open a nifti file, through gzip for .gz names. Written .gz files are
+    compressed as COMPRESSION says, or at compresslevel if given.
+    '''
+    if not filename.endswith('.gz'):
+        return open(filename, mode)
+    if 'r' in mode:
+        return gzip.open(filename, mode)
+    level, threads = compression()
+    if compresslevel is not None:
+        level, threads = compresslevel, None
+    if threads:
+        return PigzFile(filename, level, threads)
+    return gzip.open(filename, mode, compresslevel=level)
+
+
+def scratch_name(filename):
+    '''
+    the uncompressed .nii name of a scratch intermediate
+    '''
+    return filename[:-3] if filename.endswith('.nii.gz') else filename
+
+
+def save_nifti(img, filename, scratch=False, compresslevel=None):
+    '''
+    write a nifti image and return the name written. Scratch
+    intermediates, read back by the next step, are written uncompressed
+    as .nii; other .nii.gz files are compressed as COMPRESSION says,
+    unless compresslevel is given. An intermediate whose .nii.gz name the
+    next step expects is stored uncompressed with compresslevel=0.
+    '''
+    if scratch:
+        filename = scratch_name(filename)
+    if not filename.endswith('.gz') or len(img.files_types) > 1:
+        nib.save(img, filename)
+        return filename
+    with write_aside(filename) as aside:
+        with open_image(aside, 'wb', compresslevel) as fobj:
+            img.to_file_map(img.make_file_map({'image': fobj}))
+    img.set_filename(filename)
+    return filename
+
+
+@contextlib.contextmanager
+def write_aside(out_file, like=None):
+    '''
+    yield a scratch file next to out_file and move it onto out_file once
+    the block completes, so that out_file may also be the input. The
+    scratch file gets the permissions of like, or 644.
+    '''
+    fd, scratch = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(out_file)),
+                                   suffix=os.path.basename(out_file))
+    os.close(fd)
+    try:
+        yield scratch
+        if like is None:
+            os.chmod(scratch, 0o644)
+        else:
+            shutil.copymode(like, scratch)
+        os.replace(scratch, out_file)
+    finally:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+
+
+def parse_bytes(size):
+    '''
+    convert a byte count such as 4096, 512M or 4G into bytes
+    '''
+    size = str(size).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(float(size))
+
+
+def evict_cache(cache_dir, cache_size, suffix=''):
+    '''
+    delete the least recently used entries of an on-disk cache until it
+    holds at most cache_size bytes. An entry is a file or a directory of
+    cache_dir whose name ends with suffix; names starting with a dot are
+    entries still being built and are left alone. Entries are ordered on
+    their modification time, which a cache hit should refresh.
+    '''
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.startswith('.') or not name.endswith(suffix):
+            continue
+        entry = os.path.join(cache_dir, name)
+        try:
+            if os.path.isdir(entry):
+                size = sum(os.path.getsize(os.path.join(entry, f))
+                           for f in os.listdir(entry))
+            else:
+                size = os.path.getsize(entry)
+            entries.append((os.stat(entry).st_mtime, size, entry))
+        except OSError:
+            continue
+    total = sum(entry[1] for entry in entries)
+    for _, size, entry in sorted(entries):
+        if total <= cache_size:
+            break
+        if os.path.isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+        total -= size
@@ -3,8 +3,16 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 from argparse import (ArgumentParser, RawTextHelpFormatter)
+import hashlib
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
 import numpy as np
 import nibabel as nib
+from imgio import (ACCUMULATE, evict_cache, get_data, load_mask, open_image, parse_bytes,
+                   save_like, save_nifti, working_dtype)
 
 def get_parser():
 
@@ -58,179 +66,521 @@ def get_parser():
              '\nNumber of voxels to transform at one time; a higher '
              '\nnumber increases computational speed but also increases '
              '\nmemory usage')
+    parser.add_argument(
+        '-b', '--membudget', action='store',
+        help='\nStream the image through memory in slabs of axial '
+             '\nslices instead of loading it whole. The value is the '
+             '\nworking memory budget in bytes; a K, M or G suffix may '
+             '\nbe used (e.g. 4G). --voxbin is ignored in this mode.')
+    parser.add_argument(
+        '-n', '--nprocs', action='store', default=1, type=int,
+        help='[default 1]'
+             '\nNumber of worker processes across which voxel bins are '
+             '\nshared out; the wall time is printed at the end of the '
+             '\nrun')
+    parser.add_argument(
+        '-c', '--cachedir', action='store',
+        help='\nDirectory in which to cache the Lomb-Scargle basis of '
+             '\neach temporal mask, so that repeated interpolations over '
+             '\nthe same censoring pattern skip basis construction')
+    parser.add_argument(
+        '-z', '--cachesize', action='store', default='1G',
+        help='[default 1G]'
+             '\nMaximum size of the basis cache; the least recently used '
+             '\nbases are evicted beyond it')
+    parser.add_argument(
+        '-u', '--uncompressed', action='store_true', default=False,
+        help='\nThe output is an intermediate read back by the next '
+             '\nstep: store it uncompressed (gzip level 0) under its '
+             '\n.nii.gz name [default: compressed as XCP_COMPRESSION says]')
     
     return parser
 
 
-opts            =   get_parser().parse_args()
-print(opts.img)
+def lomb_scargle_basis(tmask, t_rep, ofreq=8, hifreq=1):
+    '''
+    Build the Lomb-Scargle basis for one temporal mask. The basis depends
+    only on the censoring pattern and the sampling parameters, so it is
+    computed once and shared by every voxel.
 
-img             =   nib.load(opts.img)
-#t_rep           =   img.header['pixdim'][4]
-t_rep=np.asarray(opts.reptime, dtype='float64')
-mask = nib.load(opts.mask)
-mask_data       =   mask.get_fdata()
-logmask         =   np.isclose(mask_data, 1)
-img_data            =   img.get_fdata()
-img_data            =   img_data[logmask]
-nvox                =   img_data.shape[0]
-nvol                =   img_data.shape[1]
+    tmask : temporal mask, nonzero for seen volumes
+    t_rep : repetition time in seconds
+    ofreq : oversampling frequency
+    hifreq : maximum frequency, as a fraction of the Nyquist frequency
 
-
-
-
-tmask  = np.loadtxt(opts.tmask) 
-indices = tmask.shape[-1]
-t_obs=np.array(np.where(tmask != 0))
+    returns seen, fit_basis, recon_basis
+    seen : indices of the seen volumes
+    fit_basis : (seen volumes x 2*frequencies) matrix mapping the seen
+        samples of a voxel to its cosine and sine coefficients
+    recon_basis : (2*frequencies x volumes) matrix mapping the
+        coefficients back to the full time series
+    '''
+    tmask                   =   np.asarray(tmask).ravel()
+    t_rep                   =   float(t_rep)
+    nvol                    =   tmask.shape[0]
+    seen                    =   np.flatnonzero(tmask != 0)
 
     ##########################################################################
     # Total timespan of seen observations, in seconds
     ##########################################################################
-seen_samples            =   (t_obs + 1) * t_rep
-timespan                =   np.max(seen_samples) - np.min(seen_samples)
-if timespan == 0:
-     img_data1            =   img.get_fdata()
-     img_out2        =   nib.Nifti1Image(dataobj=img_data1,
-                                                affine=img.affine,
-                                                header=img.header)
-     nib.save(img_out2, opts.out) 
-     raise ValueError('Only one volume is flagged.')
-
-n_samples_seen          =   seen_samples.shape[-1]
-if n_samples_seen == nvol:
-     raise ValueError('No interpolation is necessary for this dataset.')
-#if n_samples_seen / nvol > 0.7:
-     #raise ValueError('More than 70% of the timepoints are to be interpolated.')
+    seen_samples            =   (seen + 1) * t_rep
+    if seen_samples.size < 2:
+        raise ValueError('Only one volume is flagged.')
+    timespan                =   seen_samples.max() - seen_samples.min()
+    n_samples_seen          =   seen_samples.shape[0]
+    if n_samples_seen == nvol:
+        raise ValueError('No interpolation is necessary for this dataset.')
+
     ##########################################################################
     # Temoral indices of all observations, seen and unseen
     ##########################################################################
-all_samples             =   np.arange(start=t_rep,stop=t_rep*(nvol+1),step=t_rep)
-        
+    all_samples             =   np.arange(1, nvol + 1) * t_rep
+
     ##########################################################################
-    # Calculate sampling frequencies
+    # Calculate sampling frequencies and angular frequencies
     ##########################################################################
-sampling_frequencies    =   np.arange(
-                                    start=1/(timespan*opts.ofreq),
-                                    step=1/(timespan*opts.ofreq),
-                                    stop=(opts.hifreq*n_samples_seen/
+    sampling_frequencies    =   np.arange(
+                                    start=1/(timespan*ofreq),
+                                    step=1/(timespan*ofreq),
+                                    stop=(hifreq*n_samples_seen/
                                         (2*timespan)+
-                                        1/(timespan*opts.ofreq)))
+                                        1/(timespan*ofreq)))
+    angular_frequencies     =   2 * np.pi * sampling_frequencies
+
     ##########################################################################
-    # Angular frequencies
+    # Constant offsets
     ##########################################################################
-angular_frequencies     =   2 * np.pi * sampling_frequencies
+    phase                   =   np.outer(angular_frequencies, seen_samples)
+    offsets                 =   np.arctan2(np.sum(np.sin(2*phase), 1),
+                                           np.sum(np.cos(2*phase), 1)
+                                           ) / (2 * angular_frequencies)
+
     ##########################################################################
-    # Constant offsets
+    # Prepare sin and cos basis terms. The coefficients of each term are
+    # termfinal = sum(termmult,2)./sum(term.^2,2), so the denominators are
+    # folded into the basis and the numerators become a matrix product.
     ##########################################################################
-offsets =   np.arctan2(
-                    np.sum(
-                        np.sin(2*np.outer(angular_frequencies, seen_samples)),
-                        1),
-                    np.sum(
-                        np.cos(2*np.outer(angular_frequencies, seen_samples)),
-                        1)
-                    ) / (2 * angular_frequencies)
-    
+    phase                  -=   (angular_frequencies * offsets)[:, None]
+    cosine_term             =   np.cos(phase)
+    sine_term               =   np.sin(phase)
+    cosine_term            /=   np.sum(cosine_term**2, 1)[:, None]
+    sine_term              /=   np.sum(sine_term**2, 1)[:, None]
+    fit_basis               =   np.vstack((cosine_term, sine_term)).T
+
     ##########################################################################
-    # Prepare sin and cos basis terms
+    # Reconstruction terms over all observations, seen and unseen
     ##########################################################################
-from numpy import matlib 
-cosine_term             =   np.cos(np.outer(angular_frequencies, 
-                                seen_samples) -
-                                matlib.repmat(angular_frequencies*offsets, 
-                                    n_samples_seen, 1).T)
-sine_term               =   np.sin(np.outer(angular_frequencies, 
-                                seen_samples) -
-                                matlib.repmat(angular_frequencies*offsets, 
-                                    n_samples_seen, 1).T)
+    phase                   =   np.outer(angular_frequencies, all_samples)
+    recon_basis             =   np.vstack((np.cos(phase), np.sin(phase)))
 
+    return seen, np.ascontiguousarray(fit_basis), recon_basis
 
-n_voxel_bins            =   int(np.ceil(nvox /opts.voxbin))
 
-for current_bin in range(1,n_voxel_bins+2):
-    print('Voxel bin ' + str(current_bin) + ' out of ' + 
-              str(n_voxel_bins+1))
-    
-        ######################################################################
-        # Extract the seen samples for the current bin
-        ######################################################################
-    bin_index           =   np.arange(start=(current_bin-1)*(opts.voxbin-1),
-                                          stop=current_bin*opts.voxbin)
-    bin_index           =   np.intersect1d(bin_index, range(0,nvox))
+def lomb_scargle_transform(voxel_bin, seen, fit_basis, recon_basis):
+    '''
+    Interpolate one bin of voxels with a precomputed basis.
 
-    voxel_bin           =   img_data[bin_index,:][:,t_obs.ravel()]
-   
+    voxel_bin : voxels by timepoints; overwritten with the result
+    seen, fit_basis, recon_basis : output of lomb_scargle_basis
+
+    The fit and reconstruction are computed in float64 whatever the
+    type of voxel_bin.
+    '''
+    seen_data               =   np.asarray(voxel_bin[:, seen], dtype=ACCUMULATE)
+    coefficients            =   np.dot(seen_data, fit_basis)
+    recon                   =   np.dot(coefficients, recon_basis)
+    del coefficients
 
-    n_features              =   voxel_bin.shape[0]
-    ##########################################################################
-    # Compute the transform from seen data as follows for sin and cos terms:
-    # termfinal = sum(termmult,2)./sum(term.^2,2)
-    # Compute numerators and denominators, then divide
-    ##########################################################################
-    
-    mult                =   np.zeros(shape=(angular_frequencies.shape[0],
-                                                n_samples_seen,
-                                                n_features))
-
-    for obs in range(0,n_samples_seen):
-             mult[:,obs,:]   = np.outer(cosine_term[:,obs],voxel_bin[:,obs])
-            
-    numerator           =   np.sum(mult,1)
-    denominator         =   np.sum(cosine_term**2,1)
-    c                =   (numerator.T/denominator).T
-         
-    for obs in range(0,n_samples_seen):
-             mult[:,obs,:]   = np.outer(sine_term[:,obs],voxel_bin[:,obs])
-            
-    numerator           =   np.sum(mult,1)
-    denominator         =   np.sum(sine_term**2,1)
-    s               =   (numerator.T/denominator).T
-    
-    
-    ##########################################################################
-    # Interpolate over unseen epochs, reconstruct the time series
-    ##########################################################################
-    
-    term_prod           =   np.sin(np.outer(angular_frequencies, all_samples))
-    term_recon          =   np.zeros(shape=(angular_frequencies.shape[0],
-                                                nvol,n_features))
-    for i in range(angular_frequencies.shape[0]):
-            term_recon[i,:,:] = np.outer(term_prod[i,:],s[i,:])
-
-    s_recon          =   np.sum(term_recon,0)
-
-    term_prod           =   np.cos(np.outer(angular_frequencies, all_samples))
-    term_recon          =   np.zeros(shape=(angular_frequencies.shape[0],
-                                                nvol,n_features))
-    for i in range(angular_frequencies.shape[0]):
-            term_recon[i,:,:] = np.outer(term_prod[i,:],c[i,:])
-    c_recon          =   np.sum(term_recon,0)   
-    
-    recon                   =   (c_recon + s_recon).T
-    del c_recon, s_recon
-        
     ##########################################################################
     # Normalise the reconstructed spectrum. This is necessary when the
     # oversampling frequency exceeds 1.
     ##########################################################################
-    std_recon               =   np.std(recon,1,ddof=1)
-    std_orig                =   np.std(voxel_bin,1,ddof=1)
-    norm_fac                =   std_recon/std_orig
-    del std_recon, std_orig
-    recon                   =   (recon.T/norm_fac).T
-    del norm_fac
-        ##################################################################
-        # Write the current bin into the image matrix. Replace only unseen
-        # observations with their interpolated values.
-        ######################################################################
-    img_data[np.ix_(bin_index,t_obs.ravel())] \
-             = recon[:,t_obs.ravel()]
-    del recon
-
-img_data_out            =   np.zeros(shape=img.shape)
-img_data_out[logmask]   =   img_data
-    
-img_interpolated        =   nib.Nifti1Image(dataobj=img_data_out,
-                                                affine=img.affine,
-                                                header=img.header)
-nib.save(img_interpolated, opts.out)
+    norm_fac                =   (np.std(recon, 1, ddof=1) /
+                                 np.std(seen_data, 1, ddof=1))
+    recon                  /=   norm_fac[:, None]
+
+    ##########################################################################
+    # Write the current bin back into the data matrix.
+    ##########################################################################
+    voxel_bin[:, seen]      =   recon[:, seen]
+    return voxel_bin
+
+
+def basis_cache_key(tmask, t_rep, ofreq=8, hifreq=1):
+    '''
+    Content address of the basis for a temporal mask and sampling
+    parameters.
+    '''
+    digest                  =   hashlib.sha1()
+    digest.update(np.packbits(np.asarray(tmask).ravel() != 0).tobytes())
+    digest.update(np.array([np.asarray(tmask).size, t_rep, ofreq, hifreq],
+                           dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def cached_lomb_scargle_basis(tmask, t_rep, ofreq=8, hifreq=1,
+                              cache_dir=None, cache_size=1024**3):
+    '''
+    lomb_scargle_basis backed by an on-disk cache keyed on
+    basis_cache_key. A hit refreshes the entry's modification time, which
+    is what evict_cache orders on. Without cache_dir the basis is
+    always built.
+    '''
+    if cache_dir is None:
+        return lomb_scargle_basis(tmask=tmask, t_rep=t_rep,
+                                  ofreq=ofreq, hifreq=hifreq)
+    path                    =   os.path.join(
+                                    cache_dir,
+                                    basis_cache_key(tmask, t_rep, ofreq,
+                                                    hifreq) + '.npz')
+    try:
+        with np.load(path) as cached:
+            basis           =   (cached['seen'], cached['fit_basis'],
+                                 cached['recon_basis'])
+        os.utime(path, None)
+        print('Using cached basis ' + path)
+        return basis
+    except Exception:
+        pass
+
+    basis                   =   lomb_scargle_basis(tmask=tmask, t_rep=t_rep,
+                                                   ofreq=ofreq, hifreq=hifreq)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    scratch_fd, scratch     =   tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    try:
+        with os.fdopen(scratch_fd, 'wb') as scratch_file:
+            np.savez(scratch_file, seen=basis[0], fit_basis=basis[1],
+                     recon_basis=basis[2])
+        os.chmod(scratch, 0o644)
+        os.replace(scratch, path)
+    except OSError:
+        if os.path.exists(scratch):
+            os.remove(scratch)
+    evict_cache(cache_dir, cache_size, suffix='.npz')
+    return basis
+
+
+_worker = {}
+
+
+def _shared_array(shape, dtype=np.float64):
+    '''
+    Allocate a float32 or float64 array in shared memory that worker
+    processes can attach to without copying. Returns the raw buffer and
+    an array view.
+    '''
+    dtype                   =   np.dtype(dtype)
+    raw                     =   mp.RawArray('f' if dtype == np.float32 else 'd',
+                                            int(np.prod(shape)))
+    return raw, np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+# thread pools of the BLAS libraries numpy may be linked against
+_BLAS_THREADS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+def _init_worker(seen, fit_basis, recon_basis, data):
+    '''
+    Attach a worker process to the shared basis and data buffers. Each
+    buffer is passed as a (raw buffer, shape, dtype) triple. The worker's
+    BLAS is held to one thread, so that the pool does not oversubscribe
+    the cpus; threadpoolctl, if installed, also limits a BLAS already
+    loaded before the environment is read.
+    '''
+    for name in _BLAS_THREADS:
+        os.environ[name]    =   '1'
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        pass
+    else:
+        _worker['blas']     =   threadpool_limits(limits=1)
+    _worker['seen']         =   seen
+    for name, (raw, shape, dtype) in (('fit_basis', fit_basis),
+                                      ('recon_basis', recon_basis),
+                                      ('data', data)):
+        _worker[name]       =   np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+def _transform_bin(bounds):
+    '''
+    Interpolate rows start:stop of the shared data buffer in place.
+    '''
+    start, stop             =   bounds
+    data                    =   _worker['data']
+    data[start:stop]        =   lomb_scargle_transform(
+                                    data[start:stop], _worker['seen'],
+                                    _worker['fit_basis'],
+                                    _worker['recon_basis'])
+
+
+class BinScheduler(object):
+    '''
+    Share voxel bins out to a pool of worker processes. The basis and a
+    data buffer of up to max_voxels rows live in shared memory, so each
+    task only carries the bounds of its bin. The scheduler keeps track of
+    the wall time for report(). The data buffer holds dtype, the type of
+    the data transformed.
+    '''
+
+    def __init__(self, seen, fit_basis, recon_basis, max_voxels, nprocs,
+                 dtype=np.float64):
+        self.nprocs         =   nprocs
+        fit_raw, fit        =   _shared_array(fit_basis.shape)
+        recon_raw, recon    =   _shared_array(recon_basis.shape)
+        fit[...]            =   fit_basis
+        recon[...]          =   recon_basis
+        data_shape          =   (max_voxels, recon_basis.shape[1])
+        data_raw, self.data =   _shared_array(data_shape, dtype)
+        self.pool           =   mp.Pool(
+                                    processes=nprocs,
+                                    initializer=_init_worker,
+                                    initargs=(seen,
+                                              (fit_raw, fit_basis.shape, fit.dtype),
+                                              (recon_raw, recon_basis.shape, recon.dtype),
+                                              (data_raw, data_shape, self.data.dtype)))
+        self.wall_time      =   0.0
+
+    def transform(self, data, voxbin):
+        '''
+        Interpolate a voxels by timepoints matrix in place, voxbin
+        voxels per task.
+        '''
+        start_time          =   time.time()
+        nvox                =   data.shape[0]
+        self.data[:nvox]    =   data
+        bins                =   [(start, min(start + voxbin, nvox))
+                                 for start in range(0, nvox, voxbin)]
+        for done, _ in enumerate(
+                self.pool.imap_unordered(_transform_bin, bins)):
+            print('Voxel bin ' + str(done + 1) + ' out of ' + str(len(bins)))
+        data[...]           =   self.data[:nvox]
+        self.wall_time     +=   time.time() - start_time
+        return data
+
+    def report(self):
+        '''
+        Print the wall time of the work done so far. The speedup over a
+        serial run is that run's wall time over this one; summed worker
+        CPU time is no measure of it.
+        '''
+        print('Interpolated with ' + str(self.nprocs) + ' processes in '
+              + '%.2fs wall time' % self.wall_time)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def interpolate_data(data, tmask, t_rep, ofreq=8, hifreq=1, voxbin=3000,
+                     nprocs=1, cache_dir=None, cache_size=1024**3):
+    '''
+    Interpolate over censored epochs of a voxels by timepoints matrix
+    using least squares spectral analysis. The matrix is updated in
+    place, voxbin voxels at a time, and returned. With nprocs > 1 the
+    bins are shared out to a pool of processes; this needs one extra
+    copy of the matrix in shared memory. The basis is cached under
+    cache_dir, if given.
+    '''
+    seen, fit_basis, recon_basis = cached_lomb_scargle_basis(
+        tmask=tmask, t_rep=t_rep, ofreq=ofreq, hifreq=hifreq,
+        cache_dir=cache_dir, cache_size=cache_size)
+    nvox, nvol              =   data.shape
+    if nvol != recon_basis.shape[1]:
+        raise ValueError('The temporal mask has ' + str(recon_basis.shape[1])
+                         + ' volumes but the data has ' + str(nvol) + '.')
+
+    if nprocs > 1:
+        scheduler           =   BinScheduler(seen, fit_basis, recon_basis,
+                                             nvox, nprocs, data.dtype)
+        try:
+            scheduler.transform(data, voxbin)
+            scheduler.report()
+        finally:
+            scheduler.close()
+        return data
+
+    n_voxel_bins            =   int(np.ceil(nvox / voxbin))
+    for current_bin in range(n_voxel_bins):
+        print('Voxel bin ' + str(current_bin + 1) + ' out of ' +
+              str(n_voxel_bins))
+        bin_slice           =   slice(current_bin * voxbin,
+                                      (current_bin + 1) * voxbin)
+        data[bin_slice]     =   lomb_scargle_transform(
+                                    data[bin_slice], seen,
+                                    fit_basis, recon_basis)
+    return data
+
+
+def slab_thickness(shape, fit_basis, recon_basis, mem_budget,
+                   dtype=np.float64, nprocs=1):
+    '''
+    Number of axial slices that can be interpolated at once within
+    mem_budget bytes. Every voxel of a slab is charged for the slab read
+    from disk and its masked copy, in dtype, for the float32 output slab,
+    and for the float64 temporaries of lomb_scargle_transform: the seen
+    samples and the reconstruction, next to either the coefficients or
+    the deviations taken to normalise the reconstruction. With nprocs > 1
+    the temporaries are spread over the workers, and each voxel is also
+    charged for its row of the BinScheduler data buffer, in dtype, next
+    to the shared copy of the basis.
+    '''
+    nseen, ncoef            =   fit_basis.shape
+    nvol                    =   recon_basis.shape[1]
+    copies                  =   3 if nprocs > 1 else 2
+    voxel_bytes             =   ((copies * np.dtype(dtype).itemsize + 4) * nvol
+                                 + 8 * (nseen + nvol + max(ncoef, nvol)))
+    slice_bytes             =   shape[0] * shape[1] * voxel_bytes
+    basis_bytes             =   fit_basis.nbytes + recon_basis.nbytes
+    if nprocs > 1:
+        basis_bytes        *=   2
+    free_bytes              =   mem_budget - basis_bytes
+    nslices                 =   int(free_bytes // slice_bytes)
+    if nslices < 1:
+        raise ValueError('A memory budget of ' + str(mem_budget) + ' bytes '
+                         'cannot hold a single slice; at least ' +
+                         str(slice_bytes + mem_budget - free_bytes) +
+                         ' bytes are required.')
+    return min(nslices, shape[2])
+
+
+def interpolate_image_streaming(img, logmask, tmask, t_rep, out_file,
+                                ofreq=8, hifreq=1, mem_budget=2*1024**3,
+                                nprocs=1, cache_dir=None,
+                                cache_size=1024**3, dtype=None,
+                                compresslevel=None):
+    '''
+    Interpolate a 4D image slab by slab without loading it whole. Each
+    slab of axial slices is read through the image's array proxy,
+    interpolated within logmask and written into a float32 memory map,
+    which is then saved to out_file. A gzipped image is first
+    decompressed once to a scratch .nii next to out_file: a slab spans
+    every volume, and a gzip stream cannot seek back, so each slab read
+    would otherwise decompress the image again from the start.
+
+    img : nibabel 4D image
+    logmask : boolean 3D mask of voxels to interpolate
+    mem_budget : working memory budget in bytes
+    nprocs : number of worker processes sharing each slab
+    dtype : type the slabs are read into [default: imgio.PRECISION]
+    cache_dir, cache_size : basis cache, as in cached_lomb_scargle_basis
+    compresslevel : gzip level of out_file, see imgio.save_nifti
+    '''
+    seen, fit_basis, recon_basis = cached_lomb_scargle_basis(
+        tmask=tmask, t_rep=t_rep, ofreq=ofreq, hifreq=hifreq,
+        cache_dir=cache_dir, cache_size=cache_size)
+    if img.shape[3] != recon_basis.shape[1]:
+        raise ValueError('The temporal mask has ' + str(recon_basis.shape[1])
+                         + ' volumes but the data has ' + str(img.shape[3])
+                         + '.')
+    dtype                   =   working_dtype(dtype)
+    nslices                 =   slab_thickness(img.shape, fit_basis,
+                                               recon_basis, mem_budget, dtype,
+                                               nprocs)
+
+    scratch_dir             =   os.path.dirname(os.path.abspath(out_file))
+    scratch_fd, scratch     =   tempfile.mkstemp(suffix='.dat', dir=scratch_dir)
+    os.close(scratch_fd)
+    unzipped                =   None
+    scheduler               =   None
+    try:
+        in_file             =   img.get_filename()
+        if (in_file and in_file.endswith('.gz')
+                and len(img.files_types) == 1):
+            unzipped_fd, unzipped = tempfile.mkstemp(suffix='.nii',
+                                                     dir=scratch_dir)
+            with os.fdopen(unzipped_fd, 'wb') as dst, \
+                    open_image(in_file, 'rb') as src:
+                shutil.copyfileobj(src, dst, 1024**2)
+            img             =   nib.load(unzipped)
+        if nprocs > 1:
+            max_voxels      =   max(int(logmask[:, :, z:z + nslices].sum())
+                                    for z in range(0, img.shape[2], nslices))
+            scheduler       =   BinScheduler(seen, fit_basis, recon_basis,
+                                             max(max_voxels, 1), nprocs, dtype)
+        img_data_out        =   np.memmap(scratch, dtype=np.float32,
+                                          mode='w+', shape=img.shape,
+                                          order='F')
+        n_slabs             =   int(np.ceil(img.shape[2] / nslices))
+        for current_slab in range(n_slabs):
+            print('Slab ' + str(current_slab + 1) + ' out of ' + str(n_slabs))
+            z               =   slice(current_slab * nslices,
+                                      (current_slab + 1) * nslices)
+            slab            =   np.asarray(img.dataobj[:, :, z, :],
+                                           dtype=dtype)
+            slab_mask       =   logmask[:, :, z]
+            slab_out        =   np.zeros(slab.shape, dtype=np.float32)
+            if slab_mask.any() and scheduler is not None:
+                voxbin      =   -(-int(slab_mask.sum()) // nprocs)
+                slab_out[slab_mask] = scheduler.transform(slab[slab_mask],
+                                                          voxbin)
+            elif slab_mask.any():
+                slab_out[slab_mask] = lomb_scargle_transform(
+                                        slab[slab_mask], seen,
+                                        fit_basis, recon_basis)
+            del slab
+            img_data_out[:, :, z, :] = slab_out
+            del slab_out
+        img_data_out.flush()
+        if scheduler is not None:
+            scheduler.report()
+
+        header              =   img.header.copy()
+        header.set_data_dtype(np.float32)
+        header.set_slope_inter(1, 0)
+        save_nifti(nib.Nifti1Image(dataobj=img_data_out, affine=img.affine,
+                                   header=header), out_file,
+                   compresslevel=compresslevel)
+        del img_data_out
+    finally:
+        if scheduler is not None:
+            scheduler.close()
+        os.remove(scratch)
+        if unzipped is not None:
+            os.remove(unzipped)
+    return out_file
+
+
+def main():
+    opts            =   get_parser().parse_args()
+    print(opts.img)
+
+    img             =   nib.load(opts.img)
+    t_rep           =   np.asarray(opts.reptime, dtype='float64')
+    tmask           =   np.loadtxt(opts.tmask)
+
+    compresslevel   =   0 if opts.uncompressed else None
+    if np.count_nonzero(tmask) < 2:
+        save_like(get_data(img), img, opts.out, compresslevel)
+        raise ValueError('Only one volume is flagged.')
+
+    logmask         =   load_mask(opts.mask)
+
+    if opts.membudget:
+        interpolate_image_streaming(img, logmask, tmask, t_rep, opts.out,
+                                    ofreq=opts.ofreq, hifreq=opts.hifreq,
+                                    mem_budget=parse_bytes(opts.membudget),
+                                    nprocs=opts.nprocs,
+                                    cache_dir=opts.cachedir,
+                                    cache_size=parse_bytes(opts.cachesize),
+                                    compresslevel=compresslevel)
+        return
+
+    img_data        =   get_data(img)[logmask]
+
+    img_data        =   interpolate_data(img_data, tmask, t_rep,
+                                         ofreq=opts.ofreq,
+                                         hifreq=opts.hifreq,
+                                         voxbin=opts.voxbin,
+                                         nprocs=opts.nprocs,
+                                    cache_dir=opts.cachedir,
+                                    cache_size=parse_bytes(opts.cachesize))
+
+    img_data_out            =   np.zeros(shape=img.shape, dtype=img_data.dtype)
+    img_data_out[logmask]   =   img_data
+    save_like(img_data_out, img, opts.out, compresslevel)
+
+
+if __name__ == '__main__':
+    main()
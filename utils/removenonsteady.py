@@ -8,6 +8,7 @@ from argparse import (ArgumentParser, RawTextHelpFormatter)
 import numpy as np
 import nibabel as nib
 import pandas as pd
+from imgio import open_image, save_nifti, write_aside
 
 #AZEEZ
 
@@ -33,32 +34,87 @@ def get_parser():
         '-s', '--sab', action='store', required=True,
         help='[required]'
              '\n return confound regressors table')
+    parser.add_argument(
+        '-u', '--uncompressed', action='store_true', default=False,
+        help='the output is an intermediate read back by the next step:'
+             '\nstore it uncompressed (gzip level 0) under its .nii.gz name'
+             '\n[default: compressed as XCP_COMPRESSION says]')
 
     return parser
 
 
-opts = get_parser().parse_args()
+def nonsteady_volumes(tab):
+    '''
+    indices of the volumes flagged in the non_steady_state columns of the
+    confound table
+    '''
+    tad = tab.loc[:, tab.columns.str.contains('non_steady_state')]
+    tads = tad.sum(axis=1, skipna=True)
+    return np.flatnonzero(tads.values > 0)
+
+
+def trim_volumes(in_file, out_file, drop, compresslevel=None):
+    '''
+    write in_file without the volumes in drop to out_file. The kept
+    volumes are copied one at a time as stored, so the data type and
+    scaling of the image do not change.
+    '''
+    img = nib.load(in_file)
+    proxy = img.dataobj
+    shape = img.shape
+    if len(shape) < 4:
+        # a single volume
+        if len(drop):
+            raise ValueError('%s has a single volume, none can be dropped' % in_file)
+        return save_nifti(img.__class__(np.asanyarray(proxy), img.affine, img.header),
+                          out_file, compresslevel=compresslevel)
+    keep = np.setdiff1d(np.arange(shape[3]), drop)
+    if (len(shape) != 4 or not isinstance(img.header, nib.Nifti1Header)
+            or img.file_map['image'].filename != in_file):
+        # not a single file 4D nifti: go through the scaled data
+        trimmed = img.__class__(np.asanyarray(proxy)[:, :, :, keep], img.affine, img.header)
+        return save_nifti(trimmed, out_file, compresslevel=compresslevel)
+
+    with open_image(in_file, 'rb') as src:
+        header = img.header_class.from_fileobj(src)
+    header.set_data_shape(shape[:3] + (len(keep),))
+    volume_bytes = int(np.prod(shape[:3])) * proxy.dtype.itemsize
+    # write aside and rename, so that in_file may be out_file
+    with write_aside(out_file) as scratch:
+        with open_image(in_file, 'rb') as src, open_image(scratch, 'wb', compresslevel) as dst:
+            dst.write(header.binaryblock)
+            # extensions and padding up to the data
+            src.seek(len(header.binaryblock))
+            dst.write(src.read(proxy.offset - len(header.binaryblock)))
+            last = -1
+            for volume in keep:
+                if volume != last + 1:
+                    src.seek(proxy.offset + volume * volume_bytes)
+                dst.write(src.read(volume_bytes))
+                last = volume
+    return out_file
+
+
+def main():
+    opts = get_parser().parse_args()
 
-img = nib.load(opts.img)
-img_data = img.get_fdata()
+    tab = pd.read_csv(opts.tab, sep='\t')
+    drop = nonsteady_volumes(tab)
+    shape = nib.load(opts.img).shape
+    nvol = shape[3] if len(shape) > 3 else 1
+    if len(tab) != nvol:
+        raise ValueError('the confound table has %d rows for %d volumes'
+                         % (len(tab), nvol))
+    if len(drop) >= 1:
+        print("first " + str(len(drop)) + " non steady state volume(s) will be deleted")
+    else:
+        print("No non steady state volumes")
 
-tab = pd.read_csv(opts.tab, sep='\t')
-tad = tab.loc[:, tab.columns.str.contains('non_steady_state')]
-tads = tad.sum(axis=1, skipna=True)
+    trim_volumes(opts.img, opts.out, drop,
+                 compresslevel=0 if opts.uncompressed else None)
+    newtab = tab.drop(tab.index[drop])
+    newtab.to_csv(opts.sab, encoding='utf-8', index=False, sep='\t')
 
-dvol = tads[tads > 0]
-ndvol = len(dvol)
-if (ndvol >= 1):
-    newtab = tab.iloc[ndvol:]
-    new_image = img_data[:, :, :, (ndvol-1):-1]
-    img1 = nib.Nifti1Image(
-        dataobj=new_image, affine=img.affine, header=img.header)
-    print("first " + str(ndvol) + " non steady state volume(s) will be deleted")
-else:
-    print("No non steady state volumes")
-    img1 = nib.Nifti1Image(
-        dataobj=img_data, affine=img.affine, header=img.header)
-    newtab = tab
 
-nib.save(img1, opts.out)
-newtab.to_csv(opts.sab, encoding='utf-8', index=False, sep='\t')
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,20 @@
 import numpy as np
 import nibabel as nb
-import pandas as pd
-import sys 
+import os
+import base64
+import zlib
+import hashlib
 
-from nibabel.cifti2 import Cifti2Image
-from sklearn.linear_model import LinearRegression
+from imgio import working_dtype
 from scipy.signal import butter, filtfilt
-from nilearn.signal import clean 
-
-import matplotlib.pyplot as plt
-from matplotlib import gridspec as mgs
-import matplotlib.cm as cm
-from matplotlib.colors import ListedColormap, Normalize
-import seaborn as sns
-from seaborn import color_palette
 
 
 
 
 def surface_filt_reg(datafile,confound,lowpass,highpass,outfilename,pre_svg,post_svg,fd,tr,
-                     dvars,process_order=['DMT','REG','TMP'],filter_order=2):
+                     dvars,process_order=['DMT','REG','TMP'],filter_order=2,cache=False,
+                     basis=None,encoding='GIFTI_ENCODING_B64GZ',sidecar=False,qc_file=None,
+                     render=True):
     '''
     input file 
     datafile : gifti or cifti file
@@ -32,33 +27,134 @@ def surface_filt_reg(datafile,confound,lowpass,highpass,outfilename,pre_svg,post
     post_svg: plot of svg name after regression 
     fd: framewise displacement
     dvars: dvars before regression
+    cache: reuse the confound factorisation across calls with the same
+    confounds, see confound_basis
+    basis: precomputed regression_basis, e.g. shared by the files of a subject
+    encoding, sidecar: output options, see write_gifti_cifti
+    qc_file: where the arrays of the qc figures are saved, see save_qc
+    [default: post_svg with _qc.npz in place of .svg]
+    render: draw pre_svg and post_svg now; if False they can be drawn
+    later from qc_file with surfaceplot.py
     
     '''
     
-    datamatrix=read_gifti_cifti(datafile=datafile)
-    dd_data=demean_detrend_data(data=datamatrix,TR=tr,order=1)
-    dd_confound=demean_detrend_data(data=confound,TR=tr,order=1)
-    if process_order[1] == 'TMP':
-        filtered_data = butter_bandpass(data=dd_data,fs=1/tr,lowpass=lowpass,highpass=highpass,order=2)
-        filtered_confound = butter_bandpass(data=dd_confound,fs=1/tr,lowpass=lowpass,highpass=highpass,order=2)
-        pre_davrs=compute_dvars(datat = datamatrix)
-        reg_data = linear_regression(data=filtered_data,confound=filtered_confound)
-        plot_svg(fdata=datamatrix,fd=fd,dvars=pre_davrs,filename=pre_svg,tr=tr)
-        reg_davrs=compute_dvars(datat = reg_data)
-        plot_svg(fdata=reg_data,fd=fd,dvars=reg_davrs,filename=post_svg,tr=tr)
-        write_gifti_cifti(data_matrix=reg_data,template=datafile,filename=outfilename)
-    elif process_order[1] == 'REG':
-        reg_data = linear_regression(data=dd_data,confound=dd_confound)
-        pre_davrs=compute_dvars(datat = datamatrix)
-        filtered_data = butter_bandpass(data=reg_data,fs=1/tr,lowpass=lowpass,highpass=highpass,order=2)
-        plot_svg(fdata=pre_davrs,fd=fd,dvars=pre_davrs,filename=pre_svg,tr=tr)
-        reg_davrs=compute_dvars(datat = filtered_data)
-        plot_svg(fdata=filtered_data,fd=fd,dvars=reg_davrs,filename=post_svg,tr=tr)
-        write_gifti_cifti(data_matrix=filtered_data,template=datafile,filename=outfilename)
+    data=read_gifti_cifti(datafile=datafile)
+    pre_carpet,t_dec=decimate_carpet(data)
+    pre_davrs=compute_dvars(datat=data)
+    fused_filt_reg(data=data,confound=confound,tr=tr,lowpass=lowpass,highpass=highpass,
+                   process_order=process_order,filter_order=filter_order,cache=cache,
+                   basis=basis)
+    reg_davrs=compute_dvars(datat=data)
+    post_carpet,_=decimate_carpet(data)
+    write_gifti_cifti(data_matrix=data,template=datafile,filename=outfilename,
+                      encoding=encoding,sidecar=sidecar)
+    del data
+    if qc_file is None:
+        qc_file=os.path.splitext(post_svg)[0]+'_qc.npz'
+    save_qc(qc_file=qc_file,pre_carpet=pre_carpet,post_carpet=post_carpet,t_dec=t_dec,
+            fd=fd,pre_dvars=pre_davrs,post_dvars=reg_davrs,tr=tr,pre_svg=pre_svg,
+            post_svg=post_svg)
+    if render:
+        from surfaceplot import render_qc
+        render_qc(qc_file)
         
     return outfilename 
 
 
+def save_qc(qc_file,pre_carpet,post_carpet,t_dec,fd,pre_dvars,post_dvars,tr,pre_svg,post_svg):
+    '''
+    save what the qc figures need, the decimated carpets (float32), fd,
+    dvars and the figure names, in one compressed npz file
+    '''
+    np.savez_compressed(qc_file,pre_carpet=np.asarray(pre_carpet,dtype=np.float32),
+                        post_carpet=np.asarray(post_carpet,dtype=np.float32),
+                        t_dec=t_dec,fd=np.asarray(fd,dtype=np.float32),
+                        pre_dvars=np.asarray(pre_dvars,dtype=np.float32),
+                        post_dvars=np.asarray(post_dvars,dtype=np.float32),
+                        tr=float(tr),pre_svg=os.path.abspath(pre_svg),
+                        post_svg=os.path.abspath(post_svg))
+    return qc_file
+
+
+def _row_chunks(data,chunk_bytes=64*1024**2):
+    '''
+    slices over the rows of data such that a float64 copy of
+    one chunk takes about chunk_bytes
+    '''
+    nrows=max(1,int(chunk_bytes//(8*data.shape[1])))
+    return [slice(i,i+nrows) for i in range(0,data.shape[0],nrows)]
+
+
+def regression_basis(confound,tr,lowpass,highpass,process_order=['DMT','REG','TMP'],
+                     filter_order=2,cache=False,coefficients=None):
+    '''
+    run the confound side of the stages in process_order and factorise
+    the confounds as they enter the REG stage
+    confound : regressors by timepoints
+    DMT demeans and detrends the confounds, TMP filters them if it comes
+    before REG
+    coefficients: the bandpass_coefficients (b, a) of the TMP stage, if
+    already computed
+    returns the confound_basis, or None if there is no REG stage
+    '''
+    confound=np.array(confound,dtype=np.float64,ndmin=2)
+    for stage in process_order:
+        if stage == 'DMT':
+            confound=demean_detrend_data(data=confound,TR=tr,order=1)
+        elif stage == 'TMP':
+            if coefficients is None:
+                coefficients=bandpass_coefficients(fs=1/tr,lowpass=lowpass,highpass=highpass,
+                                                   order=filter_order)
+            b,a=coefficients
+            confound=filtfilt(b,a,confound,axis=1)+confound.mean(axis=1)[:,None]
+        elif stage == 'REG':
+            return confound_basis(confound,cache=cache)
+    return None
+
+
+def fused_filt_reg(data,confound,tr,lowpass,highpass,process_order=['DMT','REG','TMP'],
+                   filter_order=2,cache=False,basis=None):
+    '''
+    run the stages in process_order on data in place
+    data : vertices by timepoints, float32 or float64 working buffer
+    confound : regressors by timepoints
+    stages: DMT demean and detrend (data and confounds),
+            TMP butterworth bandpass (data, and confounds if REG has not run yet),
+            REG confound regression
+    every stage works through the buffer in row chunks so the only
+    full-size array is data itself; the confounds are filtered with the
+    same filter coefficients as the data
+    cache: reuse the confound factorisation, see confound_basis
+    basis: precomputed regression_basis for these confounds and stages
+    '''
+    b,a=bandpass_coefficients(fs=1/tr,lowpass=lowpass,highpass=highpass,order=filter_order)
+    if basis is None and 'REG' in process_order:
+        basis=regression_basis(confound=confound,tr=tr,lowpass=lowpass,highpass=highpass,
+                               process_order=process_order,filter_order=filter_order,
+                               cache=cache,coefficients=(b,a))
+    for stage in process_order:
+        if stage == 'DMT':
+            x=np.linspace(0,(data.shape[1]-1)*tr,num=data.shape[1])
+            vander=np.vander(x,2)
+            demean=data.mean(dtype=np.float64) > 0.00000000001
+            for rows in _row_chunks(data):
+                block=data[rows].astype(np.float64)
+                if demean:
+                    block-=block.mean(axis=1)[:,None]
+                block-=np.dot(vander,np.polyfit(x,block.T,1)).T
+                data[rows]=block
+        elif stage == 'TMP':
+            for rows in _row_chunks(data):
+                block=data[rows]
+                data[rows]=filtfilt(b,a,block,axis=1)+block.mean(axis=1,dtype=np.float64)[:,None]
+        elif stage == 'REG':
+            for rows in _row_chunks(data):
+                data[rows]=residualise(data[rows].astype(np.float64),basis)
+        else:
+            raise ValueError('unknown processing step '+str(stage))
+    return data
+
+
 def demean_detrend_data(data,TR,order=1):
     '''
     data should be voxels/vertices by timepoints dimension
@@ -77,13 +173,21 @@ def demean_detrend_data(data,TR,order=1):
     else:
         demeand=data
     x=np.linspace(0,(data.shape[1]-1)*TR,num=data.shape[1])
-    predicted=np.zeros_like(demeand)
-    for j in range(demeand.shape[0]):
-        model = np.polyfit(x,demeand[j,:],order)
-        predicted[j,:] = np.polyval(model, x) 
+    # fit every vertex in one least-squares solve: polyfit treats the
+    # columns of a 2D y as independent series
+    model = np.polyfit(x,demeand.T,order)
+    predicted = np.dot(np.vander(x,order+1),model).T
     return demeand - predicted
 
-from scipy.signal import butter, filtfilt
+def bandpass_coefficients(fs,lowpass,highpass,order=2):
+    '''
+    butterworth bandpass filter coefficients (b, a)
+    fs : sampling frequency, =1/TR(s)
+    '''
+    nyq = 0.5 * fs
+    lowcut = float(highpass) / nyq
+    highcut = float(lowpass) / nyq
+    return butter(int(order), [lowcut, highcut], btype='band')
 
 def butter_bandpass(data,fs,lowpass,highpass,order=2):
     '''
@@ -93,324 +197,195 @@ def butter_bandpass(data,fs,lowpass,highpass,order=2):
     highpass frequency 
     '''
     
-    nyq = 0.5 * fs
-    lowcut = np.float(highpass) / nyq
-    highcut = np.float(lowpass) / nyq
-    b, a = butter(order, [lowcut, highcut], btype='band')
+    b, a = bandpass_coefficients(fs=fs,lowpass=lowpass,highpass=highpass,order=order)
     mean_data=np.mean(data,axis=1)
-    y=np.zeros_like(data)
-    for i in range(data.shape[0]):
-        y[i,:] = filtfilt(b, a, data[i,:])
+    # filter all vertices at once along the time axis
+    y = filtfilt(b, a, data, axis=1)
     #add mean back 
-    mean_datag=np.outer(mean_data, np.ones(data.shape[1]))
-    return y + mean_datag
+    return y + mean_data[:,None]
     
-def linear_regression(data,confound):
+_confound_bases = {}
+
+def confound_basis(confound,cache=False):
+    '''
+    orthonormal basis (timepoints by k) of the span of an intercept and
+    the confounds, from a QR factorisation of the design matrix
+    confound: regressors by timepoints
+    cache: keep the basis keyed on the confound values, so that the
+    hemispheres and the cifti of one subject share one factorisation
+    '''
+    confound=np.array(confound,dtype=np.float64,ndmin=2)
+    if cache:
+        key=hashlib.sha1(confound.tobytes()+str(confound.shape).encode()).hexdigest()
+        if key in _confound_bases:
+            return _confound_bases[key]
+    design=np.column_stack((np.ones(confound.shape[1]),confound.T))
+    q,r=np.linalg.qr(design)
+    diag=np.abs(np.diag(r))
+    if diag.min() <= diag.max()*max(design.shape)*np.finfo(np.float64).eps:
+        # rank deficient confounds: keep only the directions they span
+        u,sv,_=np.linalg.svd(design,full_matrices=False)
+        q=u[:,sv > sv.max()*max(design.shape)*np.finfo(np.float64).eps]
+    if cache:
+        _confound_bases[key]=q
+    return q
+
+def residualise(data,basis):
+    '''
+    remove the projection of each row of data onto basis, in place
+    data: vertices by timepoints
+    basis: output of confound_basis
+    '''
+    data-=np.dot(np.dot(data,basis),basis.T)
+    return data
+
+def linear_regression(data,confound,cache=False):
     
     '''
      both data and confound should be point/voxels/vertices by timepoints
+     returns the residuals of an ordinary least squares fit of the
+     confounds and an intercept
     '''
-    regr = LinearRegression()
-    regr.fit(confound.T,data.T)
-    y_pred = regr.predict(confound.T)
-    return data - y_pred.T
+    basis=confound_basis(confound,cache=cache)
+    return residualise(np.array(data,dtype=np.result_type(data,np.float64)),basis)
 
-def read_gifti_cifti(datafile):
+def read_gifti_cifti(datafile,dtype=None):
+    '''
+    read a cifti or gifti file as vertices by timepoints in dtype
+    [default: imgio.PRECISION]
+    '''
+    dtype=working_dtype(dtype)
     if datafile.endswith('.dtseries.nii'):
-        data=nb.load(datafile).get_fdata().T
+        data=nb.load(datafile).get_fdata(dtype=dtype).T
     elif datafile.endswith('.func.gii'):
-        data=nb.load(datafile).agg_data()
+        data=np.asarray(nb.load(datafile).agg_data(),dtype=dtype)
     return data
     
     
-def write_gifti_cifti(data_matrix,template,filename):
+_gifti_encodings = {'GIFTI_ENCODING_B64GZ': 'GZipBase64Binary',
+                    'GIFTI_ENCODING_B64BIN': 'Base64Binary',
+                    'GIFTI_ENCODING_EXTBIN': 'ExternalFileBinary'}
+
+_gifti_coordsys = ('<CoordinateSystemTransformMatrix><DataSpace>NIFTI_XFORM_UNKNOWN</DataSpace>'
+                   '<TransformedSpace>NIFTI_XFORM_UNKNOWN</TransformedSpace><MatrixData>'
+                   + '\n'.join(' '.join('%10.6f' % v for v in row) for row in np.eye(4))
+                   + '</MatrixData></CoordinateSystemTransformMatrix>')
+
+def gifti_header_xml(template,blocksize=1024**2):
+    '''
+    the file level metadata and label table of a gifti file as xml bytes,
+    read from the start of the file without decoding any data array
+    '''
+    head=b''
+    with open(template,'rb') as fobj:
+        while b'<DataArray' not in head:
+            block=fobj.read(blocksize)
+            if not block:
+                break
+            head+=block
+    start=head.index(b'>',head.index(b'<GIFTI'))+1
+    end=head.find(b'<DataArray')
+    if end < 0:
+        end=head.rindex(b'</GIFTI>')
+    return head[start:end].strip()
+
+def write_gifti_timeseries(data_matrix,template,filename,encoding='GIFTI_ENCODING_B64GZ',
+                           compresslevel=1):
+    '''
+    write a vertices by timepoints matrix as a gifti time series, one
+    data array per timepoint, straight from one contiguous float32 buffer
+    template: gifti file whose metadata and label table are kept
+    encoding: GIFTI_ENCODING_B64GZ (gzip base64), GIFTI_ENCODING_B64BIN
+    (base64) or GIFTI_ENCODING_EXTBIN (all timepoints in one external
+    binary file next to filename, <filename>.dat)
+    compresslevel: zlib level for GIFTI_ENCODING_B64GZ
+    '''
+    if encoding not in _gifti_encodings:
+        raise ValueError('unsupported gifti encoding '+str(encoding))
+    header=gifti_header_xml(template)
+    # timepoints by vertices, so that every timepoint is contiguous
+    timepoints=np.ascontiguousarray(np.asarray(data_matrix).T,dtype='<f4')
+    nvert=timepoints.shape[1]
+    extfile=filename+'.dat'
+    if encoding == 'GIFTI_ENCODING_EXTBIN':
+        timepoints.tofile(extfile)
+    with open(filename,'wb') as fobj:
+        fobj.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                   b'<!DOCTYPE GIFTI SYSTEM "http://www.nitrc.org/frs/download.php/115/gifti.dtd">\n')
+        fobj.write(('<GIFTI Version="1.0" NumberOfDataArrays="%d">' % timepoints.shape[0]).encode())
+        fobj.write(header)
+        for i,timepoint in enumerate(timepoints):
+            if encoding == 'GIFTI_ENCODING_EXTBIN':
+                external,offset,payload=os.path.basename(extfile),i*timepoint.nbytes,b''
+            elif encoding == 'GIFTI_ENCODING_B64GZ':
+                external,offset='',0
+                payload=base64.b64encode(zlib.compress(timepoint.tobytes(),compresslevel))
+            else:
+                external,offset='',0
+                payload=base64.b64encode(timepoint.tobytes())
+            fobj.write(('<DataArray Intent="NIFTI_INTENT_TIME_SERIES" DataType="NIFTI_TYPE_FLOAT32" '
+                        'ArrayIndexingOrder="RowMajorOrder" Dimensionality="1" Dim0="%d" '
+                        'Encoding="%s" Endian="LittleEndian" ExternalFileName="%s" '
+                        'ExternalFileOffset="%d"><MetaData />%s<Data>'
+                        % (nvert,_gifti_encodings[encoding],external,offset,_gifti_coordsys)).encode())
+            fobj.write(payload)
+            fobj.write(b'</Data></DataArray>')
+        fobj.write(b'</GIFTI>\n')
+    return filename
+
+def write_sidecar(data_matrix,filename):
+    '''
+    write a vertices by timepoints matrix as a float32 .npy file,
+    <filename>.npy, that can be opened with np.load(..., mmap_mode='r')
+    '''
+    sidecar=np.lib.format.open_memmap(filename+'.npy',mode='w+',dtype=np.float32,
+                                      shape=data_matrix.shape)
+    sidecar[...]=data_matrix
+    sidecar.flush()
+    del sidecar
+    return filename+'.npy'
+
+def write_gifti_cifti(data_matrix,template,filename,encoding='GIFTI_ENCODING_B64GZ',
+                      sidecar=False):
     '''
     data matrix:  veritices by timepoint 
     template: real file loaded with nibabel to get header and filemap
     filename ; name of the output
+    encoding: gifti data encoding, see write_gifti_timeseries
+    sidecar: also write the matrix to <filename>.npy, see write_sidecar
     '''
     if template.endswith('.dtseries.nii'):
         from nibabel.cifti2 import Cifti2Image
         template=nb.load(template)
         dataimg=Cifti2Image(dataobj=data_matrix.T,header=template.header,
                     file_map=template.file_map,nifti_header=template.nifti_header)
+        dataimg.to_filename(filename)
         
     elif template.endswith('.func.gii'):
-        template=nb.load(template)
-        dataimg=nb.gifti.GiftiImage(header=template.header,file_map=template.file_map,extra=template.extra)
-        for i in range(data_matrix.shape[1]):
-            d_timepoint=nb.gifti.GiftiDataArray(data=np.asarray(data_matrix[:,i]),intent='NIFTI_INTENT_TIME_SERIES')
-            dataimg.add_gifti_data_array(d_timepoint)
-    dataimg.to_filename(filename)
+        write_gifti_timeseries(data_matrix=data_matrix,template=template,filename=filename,
+                               encoding=encoding)
+    if sidecar:
+        write_sidecar(data_matrix=data_matrix,filename=filename)
     return filename
 
-def compute_dvars(datat):
+def compute_dvars(datat,chunk=64):
     '''
      datat should be points by timepoints
+     the backward differences are taken chunk timepoints at a time
     '''
-    firstcolumn=np.zeros((datat.shape[0]))[...,None]
-    datax=np.hstack((firstcolumn,np.diff(datat)))
-    datax_ss=np.sum(np.square(datax),axis=0)/datat.shape[0]
+    datax_ss=np.zeros(datat.shape[1])
+    for start in range(1,datat.shape[1],chunk):
+        datax=np.diff(datat[:,start-1:start+chunk],axis=1)
+        datax_ss[start:start+chunk]=np.sum(np.square(datax,dtype=np.float64),axis=0)/datat.shape[0]
     return np.sqrt(datax_ss)
 
-def plot_carpet(func_data,detrend=True, nskip=0, size=(950, 800),
-                subplot=None, title=None, output_file=None, legend=False,
-                tr=None):
+def decimate_carpet(func_data, size=(950, 800)):
     """
-    Plot an image representation of voxel intensities across time also know
-    as the "carpet plot" or "Power plot". See Jonathan Power Neuroimage
-    2017 Jul 1; 154:150-158.
-    Parameters
-    ----------
-        img : Niimg-like object
-            See http://nilearn.github.io/manipulating_images/input_output.html
-            4D input image
-        atlaslabels: ndarray
-            A 3D array of integer labels from an atlas, resampled into ``img`` space.
-        detrend : boolean, optional
-            Detrend and standardize the data prior to plotting.
-        nskip : int
-            Number of volumes at the beginning of the scan marked as nonsteady state.
-        long_cutoff : int
-            Number of TRs to consider img too long (and decimate the time direction
-            to save memory)
-        axes : matplotlib axes, optional
-            The axes used to display the plot. If None, the complete
-            figure is used.
-        title : string, optional
-            The title displayed on the figure.
-        output_file : string, or None, optional
-            The name of an image file to export the plot to. Valid extensions
-            are .png, .pdf, .svg. If output_file is not None, the plot
-            is saved to a file, and the display is closed.
-        legend : bool
-            Whether to render the average functional series with ``atlaslabels`` as
-            overlay.
-        tr : float , optional
-            Specify the TR, if specified it uses this value. If left as None,
-            # Frames is plotted instead of time.
+    Decimate data to at most about ``size`` (rows, timepoints) for the
+    carpet plot. Returns the decimated copy and the time decimation factor.
     """
-
-    # Define TR and number of frames
-    notr = False
-    if tr is None:
-        notr = True
-        tr = 1.
-
-    
     ntsteps = func_data.shape[-1]
-
     data = func_data.reshape(-1, ntsteps)
-
-
     p_dec = 1 + data.shape[0] // size[0]
-    if p_dec:
-        data = data[::p_dec, :]
-
     t_dec = 1 + data.shape[1] // size[1]
-    if t_dec:
-        data = data[:, ::t_dec]
-
-    # Detrend data
-    v = (None, None)
-    if detrend:
-        data = clean(data.T, t_r=tr).T
-        v = (-2, 2)
-    # If subplot is not defined
-    if subplot is None:
-        subplot = mgs.GridSpec(1, 1)[0]
-
-    # Define nested GridSpec
-    wratios = [1, 100, 20]
-    gs = mgs.GridSpecFromSubplotSpec(1, 2 + int(legend), subplot_spec=subplot,
-                                     width_ratios=wratios[:2 + int(legend)],
-                                     wspace=0.0)
-
-    mycolors = ListedColormap(cm.get_cmap('Set1').colors[:3][::-1])
-
-
-    # Carpet plot
-    ax1 = plt.subplot(gs[1])
-    ax1.imshow(data, interpolation='nearest', aspect='auto', cmap='gray',
-               vmin=v[0], vmax=v[1])
-    ax1.grid(False)
-    ax1.set_yticks([])
-    ax1.set_yticklabels([])
-
-    # Set 10 frame markers in X axis
-    interval = max((int(data.shape[-1] + 1) //
-                    10, int(data.shape[-1] + 1) // 5, 1))
-    xticks = list(range(0, data.shape[-1])[::interval])
-    ax1.set_xticks(xticks)
-    if notr:
-        ax1.set_xlabel('time (frame #)')
-    else:
-        ax1.set_xlabel('time (s)')
-    labels = tr * (np.array(xticks)) * t_dec
-    ax1.set_xticklabels(['%.02f' % t for t in labels.tolist()], fontsize=10)
-
-    # Remove and redefine spines
-    for side in ["top", "right"]:
-        ax1.spines[side].set_color('none')
-        ax1.spines[side].set_visible(False)
-
-    ax1.yaxis.set_ticks_position('left')
-    ax1.xaxis.set_ticks_position('bottom')
-    ax1.spines["bottom"].set_visible(False)
-    ax1.spines["left"].set_color('none')
-    ax1.spines["left"].set_visible(False)
-    if output_file is not None:
-        figure = plt.gcf()
-        figure.savefig(output_file, bbox_inches='tight')
-        plt.close(figure)
-        figure = None
-        return output_file
-
-    return [ax1], gs
-
-def confoundplot(tseries, gs_ts, gs_dist=None, name=None,
-                 units=None, tr=None, hide_x=True, color='b', nskip=0,
-                 cutoff=None, ylims=None):
-
-    # Define TR and number of frames
-    notr = False
-    if tr is None:
-        notr = True
-        tr = 1.
-    ntsteps = len(tseries)
-    tseries = np.array(tseries)
-
-    # Define nested GridSpec
-    gs = mgs.GridSpecFromSubplotSpec(1, 2, subplot_spec=gs_ts,
-                                     width_ratios=[1, 100], wspace=0.0)
-
-    ax_ts = plt.subplot(gs[1])
-    ax_ts.grid(False)
-
-    # Set 10 frame markers in X axis
-    interval = max((ntsteps // 10, ntsteps // 5, 1))
-    xticks = list(range(0, ntsteps)[::interval])
-    ax_ts.set_xticks(xticks)
-
-    if not hide_x:
-        if notr:
-            ax_ts.set_xlabel('time (frame #)')
-        else:
-            ax_ts.set_xlabel('time (s)')
-            labels = tr * np.array(xticks)
-            ax_ts.set_xticklabels(['%.02f' % t for t in labels.tolist()])
-    else:
-        ax_ts.set_xticklabels([])
-
-    if name is not None:
-        if units is not None:
-            name += ' [%s]' % units
-
-        ax_ts.annotate(
-            name, xy=(0.0, 0.7), xytext=(0, 0), xycoords='axes fraction',
-            textcoords='offset points', va='center', ha='left',
-            color=color, size=20,
-            bbox={'boxstyle': 'round', 'fc': 'w', 'ec': 'none',
-                  'color': 'none', 'lw': 0, 'alpha': 0.8})
-
-    for side in ["top", "right"]:
-        ax_ts.spines[side].set_color('none')
-        ax_ts.spines[side].set_visible(False)
-
-    if not hide_x:
-        ax_ts.spines["bottom"].set_position(('outward', 20))
-        ax_ts.xaxis.set_ticks_position('bottom')
-    else:
-        ax_ts.spines["bottom"].set_color('none')
-        ax_ts.spines["bottom"].set_visible(False)
-
-    # ax_ts.spines["left"].set_position(('outward', 30))
-    ax_ts.spines["left"].set_color('none')
-    ax_ts.spines["left"].set_visible(False)
-    # ax_ts.yaxis.set_ticks_position('left')
-
-    ax_ts.set_yticks([])
-    ax_ts.set_yticklabels([])
-
-    nonnan = tseries[~np.isnan(tseries)]
-    if nonnan.size > 0:
-        # Calculate Y limits
-        valrange = (nonnan.max() - nonnan.min())
-        def_ylims = [nonnan.min() - 0.1 * valrange,
-                     nonnan.max() + 0.1 * valrange]
-        if ylims is not None:
-            if ylims[0] is not None:
-                def_ylims[0] = min([def_ylims[0], ylims[0]])
-            if ylims[1] is not None:
-                def_ylims[1] = max([def_ylims[1], ylims[1]])
-
-        # Add space for plot title and mean/SD annotation
-        def_ylims[0] -= 0.1 * (def_ylims[1] - def_ylims[0])
-
-        ax_ts.set_ylim(def_ylims)
-
-        # Annotate stats
-        maxv = nonnan.max()
-        mean = nonnan.mean()
-        stdv = nonnan.std()
-        p95 = np.percentile(nonnan, 95.0)
-    else:
-        maxv = 0
-        mean = 0
-        stdv = 0
-        p95 = 0
-
-    stats_label = (r'max: {max:.3f}{units} $\bullet$ mean: {mean:.3f}{units} '
-                   r'$\bullet$ $\sigma$: {sigma:.3f}').format(
-        max=maxv, mean=mean, units=units or '', sigma=stdv)
-    ax_ts.annotate(
-        stats_label, xy=(0.98, 0.7), xycoords='axes fraction',
-        xytext=(0, 0), textcoords='offset points',
-        va='center', ha='right', color=color, size=10,
-        bbox={'boxstyle': 'round', 'fc': 'w', 'ec': 'none', 'color': 'none',
-              'lw': 0, 'alpha': 0.8}
-    )
-
-    # Annotate percentile 95
-    ax_ts.plot((0, ntsteps - 1), [p95] * 2, linewidth=.1, color='lightgray')
-    ax_ts.annotate(
-        '%.2f' % p95, xy=(0, p95), xytext=(-1, 0),
-        textcoords='offset points', va='center', ha='right',
-        color='lightgray', size=3)
-
-    if cutoff is None:
-        cutoff = []
-
-    for i, thr in enumerate(cutoff):
-        ax_ts.plot((0, ntsteps - 1), [thr] * 2,
-                   linewidth=.2, color='dimgray')
-
-        ax_ts.annotate(
-            '%.2f' % thr, xy=(0, thr), xytext=(-1, 0),
-            textcoords='offset points', va='center', ha='right',
-            color='dimgray', size=3)
-
-    ax_ts.plot(tseries, color=color, linewidth=1.5)
-    ax_ts.set_xlim((0, ntsteps - 1))
-
-    if gs_dist is not None:
-        ax_dist = plt.subplot(gs_dist)
-        sns.displot(tseries, vertical=True, ax=ax_dist)
-        ax_dist.set_xlabel('Timesteps')
-        ax_dist.set_ylim(ax_ts.get_ylim())
-        ax_dist.set_yticklabels([])
-
-        return [ax_ts, ax_dist], gs
-    return ax_ts, gs
-
-def plot_svg(fdata,fd,dvars,filename,tr=1):
-    '''
-    plot carpetplot with fd and dvars
-    '''
-    fig = plt.figure(constrained_layout=False, figsize=(30, 15))
-    grid = mgs.GridSpec(3, 1, wspace=0.0, hspace=0.05,
-                               height_ratios=[1] * (3 - 1) + [5])
-    confoundplot(fd, grid[0], tr=tr, color='b', name='FD')
-    confoundplot(dvars, grid[1], tr=tr, color='r', name='DVARS')
-    plot_carpet(func_data=fdata,subplot=grid[-1], tr=tr,)
-    fig.savefig(filename,bbox_inches="tight", pad_inches=None)
+    return np.array(data[::p_dec, ::t_dec]), t_dec
@@ -6,9 +6,11 @@
 
 from argparse import (ArgumentParser, RawTextHelpFormatter)
 
+from multiprocessing import Pool, cpu_count
+
 import numpy as np
 import sys 
-from surfacefilter import surface_filt_reg
+from surfacefilter import regression_basis, surface_filt_reg
 
 def get_parser():
     parser = ArgumentParser(
@@ -33,11 +35,13 @@ def get_parser():
         '-c', '--confound', action='store', required=True,
         help='confound matrix')
     parser.add_argument(
-        '-y', '--fo', action='store', required=False,default=2,
+        '-y', '--fo', action='store', required=False,default=2,type=int,
         help='temporal filter order')
     parser.add_argument(
-        '-g', '--cg', action='store', required=True,
-        help='cifti or gifti file')
+        '-g', '--cg', action='store', required=True, nargs='+',
+        help='cifti and/or gifti files (.dtseries.nii, L_bold.func.gii,\n'
+             'R_bold.func.gii); several files are processed together\n'
+             'with the same confounds')
     parser.add_argument(
         '-r', '--ord', action='store', required=True,
         help='order of processing, DMT-TMP-REG')
@@ -47,43 +51,107 @@ def get_parser():
     parser.add_argument(
          '-s', '--highpass', action='store', required=True,
         help=' high pass frequency')
+    parser.add_argument(
+         '-n', '--nprocs', action='store', type=int, default=None,
+        help=' number of files processed at once\n'
+             ' [default: one process per file, up to the number of cpus]')
+    parser.add_argument(
+         '-e', '--encoding', action='store', default='B64GZ',
+         choices=['B64GZ', 'B64BIN', 'EXTBIN'],
+        help=' gifti data encoding: gzip base64 (B64GZ), base64 (B64BIN)\n'
+             ' or one external binary file, <output>.dat (EXTBIN)\n'
+             ' [default: B64GZ]')
+    parser.add_argument(
+         '-m', '--sidecar', action='store_true', default=False,
+        help=' also write the residualized matrix as <output>.npy,\n'
+             ' loadable with numpy.load(..., mmap_mode=\'r\')')
+    parser.add_argument(
+         '-x', '--figures', action='store', default='now',
+         choices=['now', 'later', 'skip'],
+        help=' when to draw the qc figures: with each file (now), once all\n'
+             ' files are processed (later) or not at all (skip); the qc\n'
+             ' arrays are always saved and can be drawn with surfaceplot.py\n'
+             ' [default: now]')
 
     return parser
 
-    # get file order 
-opts = get_parser().parse_args()
-outdir = opts.out
-prefix = opts.prefix
-tr = np.float(opts.tr)
-filter_order = opts.fo
-fd = np.loadtxt(opts.fd)
-dvars = np.loadtxt(opts.dvars)
-confound = np.loadtxt(opts.confound)
-cg_file = opts.cg
-lowpass=opts.lowpass
-highpass=opts.highpass
-
-    # get the processing steps
-process_order = opts.ord.split('-')
-
-    # get the file type
-if cg_file.endswith('.dtseries.nii'):
-     outfilename = outdir +'/'+ prefix +'_residualized.dtseries.nii'
-     pre_svg = outdir +'/'+ prefix +'_prestats_dtseries.svg'
-     post_svg = outdir +'/'+ prefix +'_residualized_dtseries.svg'
-elif cg_file.endswith('L_bold.func.gii'):
-     outfilename = outdir +'/'+ prefix +'_residualized_hemi-L_bold.func.gii'
-     pre_svg = outdir +'/'+ prefix +'_prestats_hemi-L_bold.func.svg'
-     post_svg = outdir +'/'+ prefix +'_residualized_hemi-L_bold.func.svg'
-elif cg_file.endswith('R_bold.func.gii'):
-     outfilename = outdir +'/'+ prefix +'_residualized_hemi-R_bold.func.gii'
-     pre_svg = outdir +'/'+ prefix +'_prestats_hemi-R_bold.func.svg'
-     post_svg = outdir +'/'+ prefix +'_residualized_hemi-R_bold.func.svg'
-else:
-    sys.exit("unknown file") 
-        
-    # do the processing 
-surface_filt_reg(datafile=cg_file,confound=confound.T,lowpass=lowpass,highpass=highpass, 
-                       outfilename=outfilename,pre_svg=pre_svg,post_svg=post_svg,process_order = process_order,
-                     fd=fd,dvars=dvars,tr=tr,filter_order=filter_order)
-    # processing steps 
+def output_names(cg_file, outdir, prefix):
+    """ output file, figure and qc file names for one cifti or gifti input """
+    if cg_file.endswith('.dtseries.nii'):
+        outfilename = outdir +'/'+ prefix +'_residualized.dtseries.nii'
+        pre_svg = outdir +'/'+ prefix +'_prestats_dtseries.svg'
+        post_svg = outdir +'/'+ prefix +'_residualized_dtseries.svg'
+        qc_file = outdir +'/'+ prefix +'_qc_dtseries.npz'
+    elif cg_file.endswith('L_bold.func.gii'):
+        outfilename = outdir +'/'+ prefix +'_residualized_hemi-L_bold.func.gii'
+        pre_svg = outdir +'/'+ prefix +'_prestats_hemi-L_bold.func.svg'
+        post_svg = outdir +'/'+ prefix +'_residualized_hemi-L_bold.func.svg'
+        qc_file = outdir +'/'+ prefix +'_qc_hemi-L_bold.npz'
+    elif cg_file.endswith('R_bold.func.gii'):
+        outfilename = outdir +'/'+ prefix +'_residualized_hemi-R_bold.func.gii'
+        pre_svg = outdir +'/'+ prefix +'_prestats_hemi-R_bold.func.svg'
+        post_svg = outdir +'/'+ prefix +'_residualized_hemi-R_bold.func.svg'
+        qc_file = outdir +'/'+ prefix +'_qc_hemi-R_bold.npz'
+    else:
+        sys.exit("unknown file " + cg_file)
+    return outfilename, pre_svg, post_svg, qc_file
+
+
+def _process_file(job):
+    """ run surface_filt_reg on one input; job is (cg_file, names, kwargs) """
+    cg_file, (outfilename, pre_svg, post_svg, qc_file), kwargs = job
+    return surface_filt_reg(datafile=cg_file, outfilename=outfilename,
+                            pre_svg=pre_svg, post_svg=post_svg,
+                            qc_file=qc_file, **kwargs)
+
+
+def main():
+    opts = get_parser().parse_args()
+    outdir = opts.out
+    prefix = opts.prefix
+    tr = float(opts.tr)
+    filter_order = int(opts.fo)
+    fd = np.loadtxt(opts.fd)
+    dvars = np.loadtxt(opts.dvars)
+    confound = np.loadtxt(opts.confound).T
+    lowpass = opts.lowpass
+    highpass = opts.highpass
+
+        # get the processing steps
+    process_order = opts.ord.split('-')
+
+        # the confounds, fd and dvars are parsed once and the regression
+        # factorisation is computed once for all input files
+    basis = regression_basis(confound=confound, tr=tr, lowpass=lowpass,
+                             highpass=highpass, process_order=process_order,
+                             filter_order=filter_order)
+    kwargs = dict(confound=confound, lowpass=lowpass, highpass=highpass,
+                  process_order=process_order, fd=fd, dvars=dvars, tr=tr,
+                  filter_order=filter_order, basis=basis,
+                  encoding='GIFTI_ENCODING_' + opts.encoding,
+                  sidecar=opts.sidecar, render=opts.figures == 'now')
+    jobs = [(cg_file, output_names(cg_file, outdir, prefix), kwargs)
+            for cg_file in opts.cg]
+
+        # do the processing
+    nprocs = opts.nprocs or min(len(jobs), cpu_count())
+    if nprocs > 1 and len(jobs) > 1:
+        pool = Pool(processes=nprocs)
+        try:
+            outputs = pool.map(_process_file, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        outputs = [_process_file(job) for job in jobs]
+    for outfilename in outputs:
+        print(outfilename)
+
+        # draw the figures from the saved qc arrays once the data is written
+    if opts.figures == 'later':
+        from surfaceplot import render_all
+        render_all([names[3] for _, names, _ in jobs], nprocs=opts.nprocs)
+
+
+if __name__ == '__main__':
+    main()